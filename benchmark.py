@@ -0,0 +1,260 @@
+"""Benchmark de extremo a extremo con los servicios simulados (BACKEND=local), sin claves ni red.
+
+Genera audio sintético (44.1 kHz estéreo, ráfagas de "habla" y pausas) de varias
+duraciones y lo pasa por conversión, transcripción, resumen, exportación y
+TTS. Por etapa y duración informa de la latencia (p50/p95), el rendimiento en
+segundos de audio por segundo de reloj (o caracteres/s en TTS) y el pico de
+memoria de Python (tracemalloc, medido en una pasada de calentamiento aparte
+para no distorsionar los tiempos).
+
+Con --arranque mide en cambio el arranque en frío de main.py y voz2.py: el
+tiempo de sus importaciones y el de la primera renderización (AppTest), cada
+repetición en un intérprete nuevo.
+
+Uso:
+    python benchmark.py --duraciones 60,600,1800 --repeticiones 5 [--paralelo] [--json resultados.json]
+    python benchmark.py --arranque --repeticiones 5
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import numpy as np
+import soundfile as sf
+
+import metricas
+import motor
+import sintesis
+from simulado import TranscriptorSimulado, obtener_servidor
+
+ETAPAS = ("conversion", "transcripcion", "resumen", "resumen_local", "exportacion", "tts")
+SCRIPTS_ARRANQUE = ("main.py", "voz2.py")
+
+# Se ejecuta en un intérprete nuevo: "importacion" importa lo que el script importa en
+# su nivel superior; "render" ejecuta el script una vez con AppTest (importaciones incluidas)
+_CODIGO_ARRANQUE = """
+import ast, json, resource, sys, time
+inicio = time.perf_counter()
+script, modo = sys.argv[1:3]
+if modo == "importacion":
+    with open(script, encoding="utf-8") as f:
+        arbol = ast.parse(f.read())
+    for nodo in arbol.body:
+        if isinstance(nodo, ast.Import):
+            for alias in nodo.names:
+                __import__(alias.name)
+        elif isinstance(nodo, ast.ImportFrom) and not nodo.level:
+            __import__(nodo.module)
+else:
+    from streamlit.testing.v1 import AppTest
+    app = AppTest.from_file(script, default_timeout=300).run()
+    if app.exception:
+        sys.exit(app.exception[0].value)
+print(json.dumps({"segundos": time.perf_counter() - inicio,
+                  "pico_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}))
+"""
+
+
+def generar_audio(ruta, duracion, sr=44100, canales=2, semilla=0, tam_bloque=10):
+    """Escribe un FLAC sintético por bloques: sílabas armónicas (tipo vocal) separadas por pausas"""
+    rng = np.random.default_rng(semilla)
+    with sf.SoundFile(ruta, "w", samplerate=sr, channels=canales, format="FLAC", subtype="PCM_16") as f:
+        restante = duracion
+        while restante > 0:
+            segundos = min(tam_bloque, restante)
+            n = int(segundos * sr)
+            t = np.arange(n) / sr
+            f0 = rng.uniform(110, 220)
+            vocal = sum(np.sin(2 * np.pi * k * f0 * t) / k for k in range(1, 6))
+            silabas = 0.5 * (1 + np.sin(2 * np.pi * 4 * t + rng.uniform(0, 2 * np.pi)))
+            habla = (np.sin(2 * np.pi * 0.25 * t + rng.uniform(0, 2 * np.pi)) > -0.3).astype(np.float32)
+            ruido = 0.002 * rng.standard_normal(n)
+            senal = (0.1 * vocal * silabas * habla + ruido).astype(np.float32)
+            f.write(np.repeat(senal[:, None], canales, axis=1))
+            restante -= segundos
+
+
+def _medir(funcion, repeticiones):
+    """Pico de memoria (calentamiento con tracemalloc) y tiempos de `repeticiones` ejecuciones"""
+    tracemalloc.start()
+    funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos, pico
+
+
+def _fila(etapa, duracion, tiempos, pico, unidades, unidad):
+    p50, p95 = np.percentile(tiempos, [50, 95])
+    return {
+        "etapa": etapa,
+        "duracion_audio": duracion,
+        "repeticiones": len(tiempos),
+        "p50": float(p50),
+        "p95": float(p95),
+        "rendimiento": unidades / p50 if p50 > 0 else float("inf"),
+        "unidad": unidad,
+        "pico_mb": pico / 1024 / 1024,
+    }
+
+
+def huella():
+    """Huella nueva en cada llamada: ninguna repetición se sirve desde la caché"""
+    return f"benchmark-{uuid.uuid4().hex}"
+
+
+def medir_duracion(ruta, duracion, args):
+    """Todas las etapas pedidas para un audio de `duracion` segundos; devuelve sus filas"""
+    filas = []
+
+    ruta_wav, _ = motor.convertir_a_wav(ruta, huella())
+    if "conversion" in args.etapas:
+        tiempos, pico = _medir(lambda: motor.convertir_a_wav(ruta, huella()), args.repeticiones)
+        filas.append(_fila("conversion", duracion, tiempos, pico, duracion, "s audio/s"))
+
+    segmentos, _ = motor.transcribir(ruta_wav, huella(), "es-ES", 3, paralelo=args.paralelo,
+                                     max_workers=args.fragmentos)
+    if "transcripcion" in args.etapas:
+        tiempos, pico = _medir(
+            lambda: motor.transcribir(ruta_wav, huella(), "es-ES", 3, paralelo=args.paralelo,
+                                      max_workers=args.fragmentos),
+            args.repeticiones,
+        )
+        filas.append(_fila("transcripcion", duracion, tiempos, pico, duracion, "s audio/s"))
+
+    resumen = " ".join(seg['text'] for seg in segmentos[:10])
+    if "resumen" in args.etapas:
+        tiempos, pico = _medir(lambda: motor.resumir_transcripcion(segmentos), args.repeticiones)
+        resumen = motor.resumir_transcripcion(segmentos)
+        filas.append(_fila("resumen", duracion, tiempos, pico, duracion, "s audio/s"))
+
+    if "resumen_local" in args.etapas:
+        tiempos, pico = _medir(lambda: motor.resumir_transcripcion(segmentos, motor_resumen="local"),
+                               args.repeticiones)
+        filas.append(_fila("resumen_local", duracion, tiempos, pico, duracion, "s audio/s"))
+
+    if "exportacion" in args.etapas:
+        def exportar_todo():
+            for formato in motor.FORMATOS_EXPORTACION:
+                motor.exportar(segmentos, formato, io.BytesIO())
+
+        tiempos, pico = _medir(exportar_todo, args.repeticiones)
+        filas.append(_fila("exportacion", duracion, tiempos, pico, duracion, "s audio/s"))
+
+    if "tts" in args.etapas:
+        url = obtener_servidor().url
+        # Sin caché: cada repetición sintetiza todas las frases contra el servidor simulado
+        tiempos, pico = _medir(
+            lambda: sintesis.sintetizar(resumen, "es-ES-ElviraNeural", url, motor.SPEECH_KEY, cache=None),
+            args.repeticiones,
+        )
+        filas.append(_fila("tts", duracion, tiempos, pico, len(resumen), "caracteres/s"))
+    return filas
+
+
+def medir_arranque(args, directorio):
+    """Importación y primera renderización de cada script, en intérpretes nuevos y con BACKEND=local"""
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    entorno = {
+        **os.environ, "BACKEND": "local", "METRICAS_LOG": "0", "METRICAS_PUERTO": "",
+        "CACHE_DIR": os.path.join(directorio, "cache"), "COLA_DB": os.path.join(directorio, "cola.sqlite3"),
+        "BIBLIOTECA_DB": os.path.join(directorio, "biblioteca.sqlite3"),
+        "FIRMAS_DB": os.path.join(directorio, "firmas.sqlite3"),
+    }
+    filas = []
+    for script in SCRIPTS_ARRANQUE:
+        for modo in ("importacion", "render"):
+            medidas = []
+            for _ in range(args.repeticiones):
+                proceso = subprocess.run([sys.executable, "-c", _CODIGO_ARRANQUE, script, modo], cwd=raiz,
+                                         env=entorno, capture_output=True, text=True)
+                if proceso.returncode:
+                    raise RuntimeError(f"{script} ({modo}) falló:\n{proceso.stderr[-2000:]}")
+                medidas.append(json.loads(proceso.stdout.strip().splitlines()[-1]))
+            tiempos = [m["segundos"] for m in medidas]
+            pico = max(m["pico_bytes"] for m in medidas)
+            filas.append(_fila(f"{script}:{modo}", 0, tiempos, pico, 1, "arranques/s"))
+    return filas
+
+
+def imprimir_tabla(filas):
+    ancho = max([14, *(len(fila["etapa"]) + 1 for fila in filas)])
+    print(f"{'etapa':<{ancho}}{'audio (s)':>10}{'reps':>6}{'p50 (s)':>10}{'p95 (s)':>10}"
+          f"{'rendimiento':>14} {'unidad':<13}{'pico MB':>9}")
+    for fila in filas:
+        print(f"{fila['etapa']:<{ancho}}{fila['duracion_audio']:>10.0f}{fila['repeticiones']:>6}"
+              f"{fila['p50']:>10.3f}{fila['p95']:>10.3f}{fila['rendimiento']:>14.1f} "
+              f"{fila['unidad']:<13}{fila['pico_mb']:>9.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo con servicios simulados.")
+    parser.add_argument("--duraciones", type=lambda v: [float(d) for d in v.split(",") if d.strip()],
+                        default=[60.0, 300.0, 900.0], help="Duraciones del audio sintético en segundos")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--etapas", type=lambda v: [e.strip() for e in v.split(",") if e.strip()],
+                        default=list(ETAPAS), help=f"Etapas separadas por comas ({', '.join(ETAPAS)})")
+    parser.add_argument("--paralelo", action="store_true", help="Transcribir por fragmentos en paralelo")
+    parser.add_argument("--fragmentos", type=int, default=4, help="Fragmentos simultáneos con --paralelo")
+    parser.add_argument("--factor", type=float, default=200.0,
+                        help="Factor de tiempo real del transcriptor simulado (s de audio por s)")
+    parser.add_argument("--latencia", type=float, default=0.02, help="Latencia simulada por petición/sesión (s)")
+    parser.add_argument("--arranque", action="store_true",
+                        help="Medir el arranque en frío de main.py y voz2.py en lugar del pipeline")
+    parser.add_argument("--json", help="Guardar también los resultados en este archivo JSON")
+    args = parser.parse_args(argv)
+
+    desconocidas = set(args.etapas) - set(ETAPAS)
+    if desconocidas:
+        parser.error(f"Etapas desconocidas: {', '.join(sorted(desconocidas))}")
+
+    metricas.METRICAS_LOG = False  # Una línea JSON por etapa ensuciaría la tabla
+    directorio = tempfile.mkdtemp(prefix="prollecto_benchmark_")
+    if args.arranque:
+        try:
+            filas = medir_arranque(args, directorio)
+        finally:
+            shutil.rmtree(directorio, ignore_errors=True)
+        return _informar(filas, args)
+
+    motor.CACHE_DIR = os.path.join(directorio, "cache")  # Caché aislada y desechable
+    servidor = obtener_servidor()
+    servidor.latencia = args.latencia
+    servidor.duracion_trabajo = args.latencia
+    motor.configurar(backend="local", transcriptor=TranscriptorSimulado(args.factor, args.latencia))
+
+    filas = []
+    try:
+        for duracion in args.duraciones:
+            ruta = os.path.join(directorio, f"sintetico_{duracion:.0f}s.flac")
+            generar_audio(ruta, duracion)
+            filas.extend(medir_duracion(ruta, duracion, args))
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    return _informar(filas, args)
+
+
+def _informar(filas, args):
+    imprimir_tabla(filas)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"parametros": {k: v for k, v in vars(args).items() if k != "json"}, "resultados": filas},
+                      f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""Índice de búsqueda de texto completo sobre todas las transcripciones (SQLite FTS5).
+
+Cada transcripción completada se indexa por episodio, hablante e instante, de
+forma incremental: volver a indexar un episodio sustituye solo sus segmentos.
+Las búsquedas devuelven el episodio y el `offset` de cada coincidencia,
+ordenadas por relevancia (BM25).
+
+Uso desde la línea de comandos:
+    python biblioteca.py "consulta" [--hablante Guest-1] [--episodio nombre] [--limite 20]
+"""
+import argparse
+import contextlib
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+BIBLIOTECA_DB = os.getenv("BIBLIOTECA_DB") or os.path.join(tempfile.gettempdir(), "prollecto_biblioteca.sqlite3")
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS episodios (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    clave TEXT NOT NULL UNIQUE,
+    nombre TEXT NOT NULL,
+    ruta TEXT,
+    idioma TEXT,
+    duracion REAL NOT NULL DEFAULT 0,
+    segmentos INTEGER NOT NULL DEFAULT 0,
+    indexado REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS segmentos (
+    id INTEGER PRIMARY KEY,
+    episodio INTEGER NOT NULL REFERENCES episodios (id),
+    hablante TEXT NOT NULL,
+    inicio REAL NOT NULL,
+    duracion REAL NOT NULL,
+    texto TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segmentos_episodio ON segmentos (episodio, inicio);
+CREATE VIRTUAL TABLE IF NOT EXISTS segmentos_fts USING fts5(
+    texto, content='segmentos', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS segmentos_insertar AFTER INSERT ON segmentos BEGIN
+    INSERT INTO segmentos_fts (rowid, texto) VALUES (new.id, new.texto);
+END;
+CREATE TRIGGER IF NOT EXISTS segmentos_borrar AFTER DELETE ON segmentos BEGIN
+    INSERT INTO segmentos_fts (segmentos_fts, rowid, texto) VALUES ('delete', old.id, old.texto);
+END;
+"""
+
+
+def _consulta_fts(texto):
+    """Convierte el texto del usuario en una consulta FTS5 segura (todos los términos; `pal*` busca por prefijo)"""
+    terminos = []
+    for termino in texto.split():
+        prefijo = termino.endswith("*") and len(termino) > 1
+        termino = termino.rstrip("*").replace('"', '""')
+        if termino:
+            terminos.append(f'"{termino}"*' if prefijo else f'"{termino}"')
+    return " ".join(terminos) or None
+
+
+class Biblioteca:
+    """Índice de texto completo persistente, compartible entre procesos"""
+
+    def __init__(self, ruta_db=BIBLIOTECA_DB):
+        self.ruta_db = ruta_db
+        with self._conexion() as conexion:
+            conexion.executescript(ESQUEMA)
+
+    @contextlib.contextmanager
+    def _conexion(self):
+        conexion = sqlite3.connect(self.ruta_db, timeout=30, isolation_level=None)
+        try:
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.row_factory = sqlite3.Row
+            yield conexion
+        finally:
+            conexion.close()
+
+    def indexar(self, clave, nombre, segmentos, ruta=None, idioma=None):
+        """Indexa (o reindexa) los segmentos de un episodio en una sola transacción"""
+        duracion = max((seg['offset'] + seg['duration'] for seg in segmentos), default=0.0)
+        with self._conexion() as conexion:
+            conexion.execute("BEGIN IMMEDIATE")
+            try:
+                fila = conexion.execute("SELECT id FROM episodios WHERE clave = ?", (clave,)).fetchone()
+                if fila is None:
+                    episodio = conexion.execute(
+                        "INSERT INTO episodios (clave, nombre, ruta, idioma, duracion, segmentos, indexado) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (clave, nombre, ruta, idioma, duracion, len(segmentos), time.time()),
+                    ).lastrowid
+                else:
+                    episodio = fila["id"]
+                    conexion.execute("DELETE FROM segmentos WHERE episodio = ?", (episodio,))
+                    conexion.execute(
+                        "UPDATE episodios SET nombre = ?, ruta = ?, idioma = ?, duracion = ?, segmentos = ?, "
+                        "indexado = ? WHERE id = ?",
+                        (nombre, ruta, idioma, duracion, len(segmentos), time.time(), episodio),
+                    )
+                conexion.executemany(
+                    "INSERT INTO segmentos (episodio, hablante, inicio, duracion, texto) VALUES (?, ?, ?, ?, ?)",
+                    ((episodio, seg['speaker'], seg['offset'], seg['duration'], seg['text']) for seg in segmentos),
+                )
+            except BaseException:
+                conexion.execute("ROLLBACK")
+                raise
+            conexion.execute("COMMIT")
+        return episodio
+
+    def buscar(self, texto, hablante=None, episodio=None, limite=50):
+        """Segmentos que contienen todos los términos, del más al menos relevante.
+
+        `episodio` acepta la clave o el nombre del episodio. Cada resultado
+        incluye el fragmento con los términos resaltados en markdown.
+        """
+        consulta = _consulta_fts(texto)
+        if consulta is None:
+            return []
+        condiciones = ["segmentos_fts MATCH ?"]
+        parametros = [consulta]
+        if hablante:
+            condiciones.append("s.hablante = ?")
+            parametros.append(hablante)
+        if episodio:
+            condiciones.append("(e.clave = ? OR e.nombre = ?)")
+            parametros.extend([episodio, episodio])
+        with self._conexion() as conexion:
+            filas = conexion.execute(
+                "SELECT e.nombre, e.clave, e.ruta, s.hablante, s.inicio, s.duracion, s.texto, "
+                "snippet(segmentos_fts, 0, '**', '**', '…', 16) AS fragmento "
+                "FROM segmentos_fts JOIN segmentos s ON s.id = segmentos_fts.rowid "
+                "JOIN episodios e ON e.id = s.episodio "
+                f"WHERE {' AND '.join(condiciones)} ORDER BY rank LIMIT ?",
+                (*parametros, limite),
+            ).fetchall()
+        return [
+            {
+                'episodio': fila["nombre"],
+                'clave': fila["clave"],
+                'ruta': fila["ruta"],
+                'speaker': fila["hablante"],
+                'offset': fila["inicio"],
+                'duration': fila["duracion"],
+                'text': fila["texto"],
+                'fragmento': fila["fragmento"],
+            }
+            for fila in filas
+        ]
+
+    def episodios(self):
+        """Episodios indexados, del más reciente al más antiguo"""
+        with self._conexion() as conexion:
+            filas = conexion.execute(
+                "SELECT clave, nombre, ruta, idioma, duracion, segmentos, indexado FROM episodios ORDER BY indexado DESC"
+            ).fetchall()
+        return [dict(fila) for fila in filas]
+
+    def segmentos(self, clave):
+        """Transcripción completa de un episodio indexado (lista de segmentos) o None"""
+        with self._conexion() as conexion:
+            filas = conexion.execute(
+                "SELECT s.hablante, s.inicio, s.duracion, s.texto FROM segmentos s "
+                "JOIN episodios e ON e.id = s.episodio WHERE e.clave = ? ORDER BY s.inicio, s.id",
+                (clave,),
+            ).fetchall()
+        if not filas:
+            return None
+        return [
+            {'speaker': fila["hablante"], 'offset': fila["inicio"], 'duration': fila["duracion"], 'text': fila["texto"]}
+            for fila in filas
+        ]
+
+
+_biblioteca = None
+_biblioteca_lock = threading.Lock()
+
+
+def obtener_biblioteca():
+    """Índice del proceso (el esquema se crea una sola vez)"""
+    global _biblioteca
+    with _biblioteca_lock:
+        if _biblioteca is None:
+            _biblioteca = Biblioteca()
+        return _biblioteca
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Busca en todas las transcripciones indexadas.")
+    parser.add_argument("consulta", help="Términos a buscar (`pal*` busca por prefijo)")
+    parser.add_argument("--hablante", help="Solo segmentos de este hablante")
+    parser.add_argument("--episodio", help="Solo este episodio (nombre o clave)")
+    parser.add_argument("--limite", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    inicio = time.perf_counter()
+    resultados = obtener_biblioteca().buscar(args.consulta, args.hablante, args.episodio, args.limite)
+    transcurrido = (time.perf_counter() - inicio) * 1000
+    for resultado in resultados:
+        minutos, segundos = divmod(int(resultado['offset']), 60)
+        print(f"{resultado['episodio']} [{minutos:02d}:{segundos:02d}] "
+              f"Hablante {resultado['speaker']}: {resultado['fragmento']}")
+    print(f"\n🔎 {len(resultados)} resultado(s) en {transcurrido:.1f} ms", file=sys.stderr)
+    return 0 if resultados else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
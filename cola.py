@@ -0,0 +1,357 @@
+"""Cola de trabajos persistente en SQLite con un pool de workers en segundo plano.
+
+La interfaz solo envía trabajos y consulta su progreso; la conversión, la
+transcripción y el resumen se ejecutan en los workers, de modo que sobreviven a
+los reruns de Streamlit y a recargas del navegador. Los trabajos que quedaron
+a medias porque el proceso murió vuelven a la cola al arrancar.
+"""
+import contextlib
+import functools
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+import metricas
+import motor
+from biblioteca import obtener_biblioteca
+from en_vivo import iniciar_en_vivo, terminar_en_vivo
+
+COLA_DB = os.getenv("COLA_DB") or os.path.join(tempfile.gettempdir(), "prollecto_trabajos.sqlite3")
+COLA_WORKERS = int(os.getenv("COLA_WORKERS", "4"))
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+FALLIDO = "fallido"
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tipo TEXT NOT NULL,
+    parametros TEXT NOT NULL,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    progreso REAL NOT NULL DEFAULT 0,
+    mensaje TEXT,
+    resultado TEXT,
+    error TEXT,
+    metricas TEXT,
+    pid INTEGER,
+    instancia TEXT,
+    creado REAL NOT NULL,
+    actualizado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trabajos_estado ON trabajos (estado, id);
+"""
+
+
+class ErrorTrabajo(Exception):
+    """Fallo controlado de un trabajo; su mensaje se guarda como error del trabajo"""
+
+
+# ==============================
+# MANEJADORES DE TRABAJOS
+# ==============================
+def _trabajo_transcripcion(parametros, informar):
+    """Convierte el audio subido a WAV 16 kHz y lo transcribe con diarización"""
+    if "tiempo_subida" in parametros:
+        # Medido en la interfaz al guardar el archivo subido, antes de encolar
+        metricas.registrar("lectura_subida", parametros["tiempo_subida"], bytes=parametros.get("bytes_subida"))
+    cache = motor.obtener_cache()
+    # La subida y su WAV no se expulsan de la caché mientras este trabajo los usa
+    with cache.retener(parametros["ruta"]):
+        informar(0.0, "🎧 Convirtiendo audio a WAV PCM (16 kHz mono)...")
+        try:
+            ruta_wav, _ = motor.convertir_a_wav(parametros["ruta"], parametros["huella"])
+        except motor.ErrorConversion:
+            raise ErrorTrabajo("⚠️ Tu instalación de soundfile/libsndfile no soporta este formato. "
+                               "Instala 'ffmpeg' o convierte el audio a WAV manualmente.")
+        duracion = motor.duracion_audio(ruta_wav) or 1.0
+        # Los segmentos se publican a medida que llegan para la vista en vivo de la interfaz
+        clave = motor.clave_transcripcion(parametros["huella"], parametros["idioma"], parametros["max_hablantes"])
+        en_vivo = iniciar_en_vivo(clave)
+
+        def al_segmento(segmento):
+            en_vivo.agregar(segmento)
+            informar((segmento['offset'] + segmento['duration']) / duracion,
+                     f"🎤 Hablante {segmento['speaker']}: {segmento['text'][:50]}...")
+
+        def al_progreso(completados, total):
+            informar(completados / total, f"🧩 Fragmentos transcritos: {completados}/{total}")
+
+        informar(0.0, "🎙️ Transcribiendo audio con identificación de hablantes...")
+        try:
+            with cache.retener(ruta_wav):
+                segmentos, error_msg = motor.transcribir(
+                    ruta_wav, parametros["huella"], parametros["idioma"], parametros["max_hablantes"],
+                    paralelo=parametros.get("paralelo", False), max_workers=parametros.get("max_workers", 4),
+                    al_segmento=al_segmento, al_progreso=al_progreso
+                )
+        finally:
+            terminar_en_vivo(clave, en_vivo)
+    if error_msg:
+        raise ErrorTrabajo(error_msg)
+    if segmentos:
+        # Incorporar el episodio al índice de búsqueda de la biblioteca
+        obtener_biblioteca().indexar(
+            clave, parametros.get("nombre") or parametros["huella"], segmentos,
+            ruta=parametros["ruta"], idioma=parametros["idioma"],
+        )
+    return segmentos
+
+
+def _trabajo_resumen(parametros, informar):
+    """Resume la transcripción producida por otro trabajo o la de un episodio de la biblioteca (`clave`)"""
+    if parametros.get("clave"):
+        segmentos = obtener_biblioteca().segmentos(parametros["clave"])
+    else:
+        origen = obtener_cola().estado(parametros["trabajo"])
+        segmentos = origen["resultado"] if origen is not None and origen["estado"] == COMPLETADO else None
+    if not segmentos:
+        raise ErrorTrabajo("La transcripción de origen no está disponible")
+    motor_resumen = parametros.get("motor", "azure")
+    informar(0.0, f"📝 Generando resumen con {motor.MOTORES_RESUMEN[motor_resumen]}...")
+    try:
+        return motor.resumir_transcripcion(
+            segmentos, parametros.get("tipo", "extractive"), motor_resumen=motor_resumen,
+            oraciones=parametros.get("oraciones", motor.ORACIONES_RESUMEN),
+        )
+    except motor.ErrorResumen as e:
+        raise ErrorTrabajo(str(e))
+
+
+MANEJADORES = {
+    "transcripcion": _trabajo_transcripcion,
+    "resumen": _trabajo_resumen,
+}
+
+
+# ==============================
+# COLA
+# ==============================
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _arranque_proceso(pid):
+    """Arranque del sistema e instante de inicio del proceso `pid`, de /proc; None si no se puede leer"""
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            arranque = f.read().strip()
+        with open(f"/proc/{pid}/stat") as f:
+            estado = f.read()
+    except OSError:
+        return None
+    # El nombre del ejecutable (campo 2) puede contener espacios: el inicio es el campo 22
+    return f"{arranque}-{estado.rsplit(')', 1)[1].split()[19]}"
+
+
+@functools.lru_cache(maxsize=None)
+def _instancia(pid):
+    """Identidad de este proceso en la columna `instancia`: distingue dos procesos con el mismo PID"""
+    return f"{pid}:{_arranque_proceso(pid) or uuid.uuid4().hex}"
+
+
+def _trabajo_vivo(pid, instancia):
+    """True si el proceso que reclamó el trabajo sigue ejecutándolo.
+
+    Tras reiniciar un contenedor la app vuelve a tener el mismo PID (a menudo
+    el 1), así que un PID vivo no basta: se compara también la instancia.
+    """
+    if pid is None:
+        return False
+    if instancia is None:
+        # Filas de antes de guardar la instancia: con nuestro PID solo pueden ser de una vida anterior
+        return pid != os.getpid() and _proceso_vivo(pid)
+    if pid == os.getpid():
+        return instancia == _instancia(pid)
+    arranque = _arranque_proceso(pid)
+    if arranque is not None:
+        return instancia == f"{pid}:{arranque}"
+    return _proceso_vivo(pid)  # Sin /proc no se puede saber si el PID se ha reutilizado
+
+
+class ColaTrabajos:
+    """Cola FIFO en SQLite compartible entre procesos, con workers en hilos"""
+
+    def __init__(self, ruta_db=COLA_DB, max_workers=COLA_WORKERS):
+        self.ruta_db = ruta_db
+        self.max_workers = max_workers
+        self._hay_trabajo = threading.Event()
+        self._workers = []
+        with self._conexion() as conexion:
+            conexion.executescript(ESQUEMA)
+            columnas = {fila["name"] for fila in conexion.execute("PRAGMA table_info(trabajos)")}
+            if "metricas" not in columnas:
+                # Bases de datos creadas antes de registrar métricas por trabajo
+                conexion.execute("ALTER TABLE trabajos ADD COLUMN metricas TEXT")
+            if "instancia" not in columnas:
+                conexion.execute("ALTER TABLE trabajos ADD COLUMN instancia TEXT")
+
+    @contextlib.contextmanager
+    def _conexion(self):
+        conexion = sqlite3.connect(self.ruta_db, timeout=30, isolation_level=None)
+        try:
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.row_factory = sqlite3.Row
+            yield conexion
+        finally:
+            conexion.close()
+
+    def enviar(self, tipo, parametros):
+        """Encola un trabajo y devuelve su id"""
+        if tipo not in MANEJADORES:
+            raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+        ahora = time.time()
+        with self._conexion() as conexion:
+            cursor = conexion.execute(
+                "INSERT INTO trabajos (tipo, parametros, creado, actualizado) VALUES (?, ?, ?, ?)",
+                (tipo, json.dumps(parametros, ensure_ascii=False), ahora, ahora),
+            )
+        self._hay_trabajo.set()
+        return cursor.lastrowid
+
+    def estado(self, trabajo_id):
+        """Estado, progreso y resultado de un trabajo (None si no existe)"""
+        with self._conexion() as conexion:
+            fila = conexion.execute("SELECT * FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+        if fila is None:
+            return None
+        trabajo = dict(fila)
+        trabajo["parametros"] = json.loads(trabajo["parametros"])
+        trabajo["resultado"] = json.loads(trabajo["resultado"]) if trabajo["resultado"] is not None else None
+        trabajo["metricas"] = json.loads(trabajo["metricas"]) if trabajo["metricas"] is not None else None
+        return trabajo
+
+    def metricas(self, trabajo_id):
+        """Estado y métricas de un trabajo, sin cargar su resultado (None si no existe)"""
+        with self._conexion() as conexion:
+            fila = conexion.execute("SELECT estado, metricas FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+        if fila is None:
+            return None
+        datos = fila["metricas"]
+        return {"estado": fila["estado"], "metricas": json.loads(datos) if datos is not None else None}
+
+    def posicion(self, trabajo_id):
+        """Trabajos pendientes que se ejecutarán antes que este"""
+        with self._conexion() as conexion:
+            return conexion.execute(
+                "SELECT COUNT(*) FROM trabajos WHERE estado = ? AND id < ?", (PENDIENTE, trabajo_id)
+            ).fetchone()[0]
+
+    def pendientes(self):
+        """Número de trabajos esperando y en curso"""
+        with self._conexion() as conexion:
+            filas = conexion.execute(
+                "SELECT estado, COUNT(*) FROM trabajos WHERE estado IN (?, ?) GROUP BY estado", (PENDIENTE, EN_CURSO)
+            ).fetchall()
+        return {estado: n for estado, n in filas}
+
+    def _recuperar_huerfanos(self):
+        """Devuelve a la cola los trabajos en curso de procesos que ya no existen"""
+        with self._conexion() as conexion:
+            filas = conexion.execute(
+                "SELECT id, pid, instancia FROM trabajos WHERE estado = ?", (EN_CURSO,)
+            ).fetchall()
+            huerfanos = [fila["id"] for fila in filas if not _trabajo_vivo(fila["pid"], fila["instancia"])]
+            conexion.executemany(
+                "UPDATE trabajos SET estado = ?, pid = NULL, instancia = NULL, progreso = 0 WHERE id = ? AND estado = ?",
+                [(PENDIENTE, trabajo_id, EN_CURSO) for trabajo_id in huerfanos],
+            )
+
+    def _reclamar(self):
+        """Toma de forma atómica el trabajo pendiente más antiguo"""
+        with self._conexion() as conexion:
+            conexion.execute("BEGIN IMMEDIATE")
+            try:
+                fila = conexion.execute(
+                    "SELECT id, tipo, parametros FROM trabajos WHERE estado = ? ORDER BY id LIMIT 1", (PENDIENTE,)
+                ).fetchone()
+                if fila is not None:
+                    conexion.execute(
+                        "UPDATE trabajos SET estado = ?, pid = ?, instancia = ?, actualizado = ? WHERE id = ?",
+                        (EN_CURSO, os.getpid(), _instancia(os.getpid()), time.time(), fila["id"]),
+                    )
+            except BaseException:
+                conexion.execute("ROLLBACK")
+                raise
+            conexion.execute("COMMIT")
+        return fila
+
+    def _actualizar(self, trabajo_id, **campos):
+        campos["actualizado"] = time.time()
+        asignaciones = ", ".join(f"{campo} = ?" for campo in campos)
+        with self._conexion() as conexion:
+            conexion.execute(f"UPDATE trabajos SET {asignaciones} WHERE id = ?", (*campos.values(), trabajo_id))
+
+    def _ejecutar(self, fila):
+        trabajo_id = fila["id"]
+        ultimo = 0.0
+
+        def informar(progreso, mensaje):
+            # Limitar escrituras: como mucho una actualización de progreso cada 0.5 s
+            nonlocal ultimo
+            if time.monotonic() - ultimo >= 0.5:
+                ultimo = time.monotonic()
+                self._actualizar(trabajo_id, progreso=min(max(progreso, 0.0), 1.0), mensaje=mensaje)
+
+        with metricas.trabajo(trabajo_id, fila["tipo"]) as registro:
+            try:
+                resultado = MANEJADORES[fila["tipo"]](json.loads(fila["parametros"]), informar)
+            except ErrorTrabajo as e:
+                registro.estado, campos = FALLIDO, {"error": str(e)}
+            except Exception as e:
+                registro.estado, campos = FALLIDO, {"error": f"Error inesperado: {e}"}
+            else:
+                registro.estado, campos = COMPLETADO, {
+                    "progreso": 1.0, "mensaje": None, "resultado": json.dumps(resultado, ensure_ascii=False)
+                }
+        self._actualizar(trabajo_id, estado=registro.estado,
+                         metricas=json.dumps(registro.como_dict(), ensure_ascii=False), **campos)
+
+    def _bucle_worker(self):
+        while True:
+            fila = self._reclamar()
+            if fila is None:
+                # Despertar al encolar en este proceso o, como mucho, cada segundo (otros procesos)
+                self._hay_trabajo.wait(timeout=1.0)
+                self._hay_trabajo.clear()
+                continue
+            self._ejecutar(fila)
+
+    def iniciar(self):
+        """Arranca los workers (una sola vez por instancia)"""
+        if self._workers:
+            return self
+        self._recuperar_huerfanos()
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._bucle_worker, name=f"cola-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        return self
+
+
+_cola = None
+_cola_lock = threading.Lock()
+
+
+def obtener_cola():
+    """Cola del proceso, con sus workers ya arrancados"""
+    global _cola
+    with _cola_lock:
+        if _cola is None:
+            _cola = ColaTrabajos().iniciar()
+            metricas.registrar_indicador("prollecto_cola_pendientes", "Trabajos esperando en la cola",
+                                         lambda: _cola.pendientes().get(PENDIENTE, 0))
+            metricas.registrar_indicador("prollecto_cola_en_curso", "Trabajos ejecutándose",
+                                         lambda: _cola.pendientes().get(EN_CURSO, 0))
+        return _cola
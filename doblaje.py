@@ -0,0 +1,205 @@
+"""Traducción con Azure Translator y doblaje de transcripciones diarizadas.
+
+Cada texto distinto se traduce una sola vez por proceso (memoria LRU) y los
+pendientes se envían en lotes que respetan los límites del servicio por
+petición (1000 elementos, 50 000 caracteres). `doblar_transcripcion()`
+sintetiza todos los segmentos en paralelo, cada hablante con su voz, y los
+coloca en su `offset` de una única pista: si la voz traducida no cabe antes
+del siguiente segmento, se vuelve a sintetizar más rápida.
+
+No depende de Streamlit; lo usa voz2.py.
+"""
+import collections
+import functools
+import io
+import threading
+
+import numpy as np
+
+import metricas
+from sintesis import dividir_frases, obtener_cache_tts, post_con_reintentos, resultados_en_orden, sintetizar_frase
+
+MAX_ELEMENTOS_TRADUCCION = 1000  # Límites de Translator por petición
+MAX_CARACTERES_TRADUCCION = 50_000
+MAX_MEMO_TRADUCCIONES = 10_000
+FORMATO_DOBLAJE = "riff-16khz-16bit-mono-pcm"
+SR_DOBLAJE = 16000
+VELOCIDAD_MAXIMA = 1.5  # Aceleración máxima de la voz para encajar un segmento en su hueco
+VOCES_DOBLAJE = ("es-ES-ElviraNeural", "es-ES-AlvaroNeural", "es-MX-DaliaNeural", "es-MX-JorgeNeural")
+
+_memo_traducciones = collections.OrderedDict()
+_memo_lock = threading.Lock()
+
+
+# ==============================
+# TRADUCCIÓN
+# ==============================
+def _trocear(texto, max_caracteres):
+    """Texto partido en trozos de frases completas de como mucho `max_caracteres`"""
+    trozos = []
+    actual = ""
+    for frase in dividir_frases(texto, max_caracteres):
+        if actual and len(actual) + 1 + len(frase) > max_caracteres:
+            trozos.append(actual)
+            actual = frase
+        else:
+            actual = f"{actual} {frase}" if actual else frase
+    if actual:
+        trozos.append(actual)
+    return trozos
+
+
+def lotes_traduccion(textos, max_elementos=MAX_ELEMENTOS_TRADUCCION, max_caracteres=MAX_CARACTERES_TRADUCCION):
+    """Índices de `textos` agrupados en lotes que respetan los límites por petición"""
+    lote = []
+    caracteres = 0
+    for i, texto in enumerate(textos):
+        if lote and (len(lote) == max_elementos or caracteres + len(texto) > max_caracteres):
+            yield lote
+            lote = []
+            caracteres = 0
+        lote.append(i)
+        caracteres += len(texto)
+    if lote:
+        yield lote
+
+
+def _traducir_lote(textos, endpoint, clave, region, destino, origen):
+    parametros = {"api-version": "3.0", "to": destino}
+    if origen:
+        parametros["from"] = origen
+    respuesta = post_con_reintentos(f"{endpoint}/translate", "traduccion", params=parametros,
+                                    json=[{"text": texto} for texto in textos], headers={
+                                        "Ocp-Apim-Subscription-Key": clave,
+                                        "Ocp-Apim-Subscription-Region": region,
+                                        "Content-Type": "application/json",
+                                    })
+    respuesta.raise_for_status()
+    return [item["translations"][0]["text"] for item in respuesta.json()]
+
+
+def traducir(textos, endpoint, clave, region, destino="es", origen=None):
+    """Traducciones de `textos` en el mismo orden; solo se piden al servicio las que no están memorizadas.
+
+    Los errores HTTP se propagan como requests.HTTPError.
+    """
+    resultado = list(textos)
+    pendientes = {}  # texto -> posiciones en las que aparece
+    with _memo_lock:
+        for i, texto in enumerate(textos):
+            memorizada = _memo_traducciones.get((origen, destino, texto))
+            if memorizada is not None:
+                _memo_traducciones.move_to_end((origen, destino, texto))
+                resultado[i] = memorizada
+            elif texto.strip():
+                pendientes.setdefault(texto, []).append(i)
+    aciertos = sum(1 for texto in textos if texto.strip()) - sum(len(p) for p in pendientes.values())
+    if aciertos:
+        metricas.contar("traduccion_cache", aciertos)
+    if not pendientes:
+        return resultado
+
+    # Los textos más largos que una petición se traducen por trozos de frases completas
+    piezas, duenos = [], []
+    for texto in pendientes:
+        trozos = [texto] if len(texto) <= MAX_CARACTERES_TRADUCCION else _trocear(texto, MAX_CARACTERES_TRADUCCION)
+        piezas.extend(trozos)
+        duenos.extend([texto] * len(trozos))
+    traducidas = [None] * len(piezas)
+    with metricas.etapa("traduccion", textos=len(pendientes), caracteres=sum(map(len, piezas))) as extra:
+        extra["lotes"] = 0
+        for lote in lotes_traduccion(piezas):
+            extra["lotes"] += 1
+            traduccion = _traducir_lote([piezas[i] for i in lote], endpoint, clave, region, destino, origen)
+            for i, texto in zip(lote, traduccion):
+                traducidas[i] = texto
+
+    partes = collections.defaultdict(list)
+    for texto, traducida in zip(duenos, traducidas):
+        partes[texto].append(traducida)
+    with _memo_lock:
+        for texto, posiciones in pendientes.items():
+            traducida = " ".join(partes[texto])
+            _memo_traducciones[(origen, destino, texto)] = traducida
+            for i in posiciones:
+                resultado[i] = traducida
+        while len(_memo_traducciones) > MAX_MEMO_TRADUCCIONES:
+            _memo_traducciones.popitem(last=False)
+    return resultado
+
+
+def traducir_transcripcion(segmentos, endpoint, clave, region, destino="es", origen=None):
+    """Copia de la transcripción con el texto de cada segmento traducido (en lotes)"""
+    traducidos = traducir([seg['text'] for seg in segmentos], endpoint, clave, region, destino, origen)
+    return [{**seg, 'text': texto} for seg, texto in zip(segmentos, traducidos)]
+
+
+# ==============================
+# DOBLAJE
+# ==============================
+def voces_por_hablante(segmentos, voces=VOCES_DOBLAJE):
+    """Una voz por hablante, repartidas en orden de aparición"""
+    asignadas = {}
+    for seg in segmentos:
+        if seg['speaker'] not in asignadas:
+            asignadas[seg['speaker']] = voces[len(asignadas) % len(voces)]
+    return asignadas
+
+
+def _pcm(audio_wav):
+    import soundfile as sf
+    datos, sr = sf.read(io.BytesIO(audio_wav), dtype="int16", always_2d=True)
+    if sr != SR_DOBLAJE:
+        raise ValueError(f"Frecuencia de muestreo inesperada en el audio sintetizado: {sr} Hz")
+    return datos[:, 0]
+
+
+def _doblar_segmento(texto, voz, hueco, endpoint, clave, cache):
+    """PCM de un segmento doblado, acelerado (hasta VELOCIDAD_MAXIMA) si no cabe en `hueco` segundos"""
+    def sintetizar_texto(velocidad):
+        partes = [_pcm(sintetizar_frase(frase, voz, endpoint, clave, FORMATO_DOBLAJE, cache, velocidad))
+                  for frase in dividir_frases(texto)]
+        return np.concatenate(partes) if partes else np.zeros(0, dtype=np.int16)
+
+    pcm = sintetizar_texto(1.0)
+    duracion = len(pcm) / SR_DOBLAJE
+    if hueco and duracion > hueco * 1.05:
+        pcm = sintetizar_texto(round(min(duracion / hueco, VELOCIDAD_MAXIMA), 2))
+    return pcm
+
+
+def doblar_transcripcion(segmentos, endpoint, clave, voces=None, cache=True, al_progreso=None):
+    """WAV (16 kHz, mono) con cada segmento sintetizado en su instante; `segmentos` ya traducidos.
+
+    `voces` asigna una voz a cada hablante (por defecto, voces_por_hablante()).
+    `al_progreso(hechos, total)` se llama a medida que se colocan los segmentos.
+    """
+    import soundfile as sf
+    orden = sorted(segmentos, key=lambda seg: seg['offset'])
+    voces = voces or voces_por_hablante(orden)
+    if cache is True:
+        cache = obtener_cache_tts()
+    fin = max((seg['offset'] + seg['duration'] for seg in orden), default=0.0)
+    pista = np.zeros(int(fin * SR_DOBLAJE) + 1, dtype=np.int16)
+
+    # Unos pocos segmentos en los hilos de TTS a la vez: así las demás sesiones se turnan con este doblaje
+    tareas = (
+        functools.partial(_doblar_segmento, seg['text'], voces[seg['speaker']],
+                          orden[i + 1]['offset'] - seg['offset'] if i + 1 < len(orden) else None,
+                          endpoint, clave, cache)
+        for i, seg in enumerate(orden)
+    )
+    with metricas.etapa("doblaje", segmentos=len(orden), duracion_audio=fin):
+        for hechos, (seg, pcm) in enumerate(zip(orden, resultados_en_orden(tareas)), 1):
+            inicio = int(round(seg['offset'] * SR_DOBLAJE))
+            if inicio + len(pcm) > len(pista):
+                pista = np.concatenate([pista, np.zeros(inicio + len(pcm) - len(pista), dtype=np.int16)])
+            # Mezclar (no sobrescribir) por si la voz anterior aún no había terminado
+            tramo = pista[inicio:inicio + len(pcm)]
+            tramo[:] = np.clip(tramo.astype(np.int32) + pcm, -32768, 32767)
+            if al_progreso is not None:
+                al_progreso(hechos, len(orden))
+
+    buffer = io.BytesIO()
+    sf.write(buffer, pista, SR_DOBLAJE, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
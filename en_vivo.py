@@ -0,0 +1,127 @@
+"""Transcripción en vivo: segmentos a medida que se reconocen y estadísticas por hablante.
+
+Los workers de la cola publican cada segmento (ya en la línea de tiempo del
+audio original) en una TranscripcionEnVivo del proceso, identificada por la
+clave de la transcripción; la interfaz la consulta cada segundo y solo recoge
+los segmentos nuevos, así que puede mostrar, analizar y exportar lo reconocido
+antes de que termine el trabajo.
+
+EstadisticasHablantes mantiene tiempo de habla, turnos, palabras y solape de
+cada hablante con coste constante por segmento; estadisticas_hablantes()
+calcula lo mismo, vectorizado con NumPy, sobre una transcripción completa.
+
+No depende de Streamlit; lo usan cola.py y main.py.
+"""
+import threading
+
+import numpy as np
+
+
+# ==============================
+# ESTADÍSTICAS POR HABLANTE
+# ==============================
+def _fila(hablante, segundos, turnos, palabras, solape):
+    return {
+        'hablante': hablante,
+        'segundos': float(segundos),
+        'turnos': int(turnos),
+        'palabras': int(palabras),
+        'palabras_minuto': 60 * float(palabras) / float(segundos) if segundos > 0 else 0.0,
+        'solape': float(solape),
+    }
+
+
+class EstadisticasHablantes:
+    """Acumuladores por hablante actualizados en O(1) por segmento, en orden de llegada.
+
+    Un turno empieza en cada segmento cuyo hablante no es el del anterior; el
+    solape de un segmento es el tiempo que comparte con los que lo preceden.
+    """
+
+    def __init__(self):
+        self._hablantes = {}  # hablante -> [segundos, turnos, palabras, solape]
+        self._anterior = None
+        self._fin_maximo = 0.0
+
+    def agregar(self, segmento):
+        fin = segmento['offset'] + segmento['duration']
+        acumulado = self._hablantes.setdefault(segmento['speaker'], [0.0, 0, 0, 0.0])
+        acumulado[0] += segmento['duration']
+        acumulado[1] += segmento['speaker'] != self._anterior
+        acumulado[2] += len(segmento['text'].split())
+        acumulado[3] += max(min(fin, self._fin_maximo) - segmento['offset'], 0.0)
+        self._anterior = segmento['speaker']
+        self._fin_maximo = max(self._fin_maximo, fin)
+
+    def resumen(self):
+        """[{hablante, segundos, turnos, palabras, palabras_minuto, solape}, ...] en orden de aparición"""
+        return [_fila(hablante, *valores) for hablante, valores in self._hablantes.items()]
+
+
+def estadisticas_hablantes(segmentos):
+    """Lo mismo que EstadisticasHablantes.resumen() tras agregar `segmentos` en orden, vectorizado"""
+    if not segmentos:
+        return []
+    ids = {}
+    codigos = np.fromiter((ids.setdefault(seg['speaker'], len(ids)) for seg in segmentos), dtype=np.int64,
+                          count=len(segmentos))
+    inicios = np.fromiter((seg['offset'] for seg in segmentos), dtype=np.float64, count=len(segmentos))
+    duraciones = np.fromiter((seg['duration'] for seg in segmentos), dtype=np.float64, count=len(segmentos))
+    palabras = np.fromiter((len(seg['text'].split()) for seg in segmentos), dtype=np.int64, count=len(segmentos))
+    fines = inicios + duraciones
+    fin_previo = np.concatenate([[0.0], np.maximum.accumulate(fines)[:-1]])
+    solape = np.clip(np.minimum(fines, fin_previo) - inicios, 0.0, None)
+    turno = np.concatenate([[True], codigos[1:] != codigos[:-1]])
+    n = len(ids)
+    columnas = (
+        np.bincount(codigos, duraciones, n), np.bincount(codigos, turno, n),
+        np.bincount(codigos, palabras, n), np.bincount(codigos, solape, n),
+    )
+    return [_fila(hablante, *(columna[i] for columna in columnas)) for hablante, i in ids.items()]
+
+
+# ==============================
+# TRANSCRIPCIONES EN CURSO
+# ==============================
+class TranscripcionEnVivo:
+    """Segmentos reconocidos hasta ahora de una transcripción en curso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._segmentos = []
+        self._estadisticas = EstadisticasHablantes()
+
+    def agregar(self, segmento):
+        with self._lock:
+            self._segmentos.append(segmento)
+            self._estadisticas.agregar(segmento)
+
+    def desde(self, n):
+        """(segmentos recibidos a partir del n-ésimo, estadísticas actuales por hablante)"""
+        with self._lock:
+            return self._segmentos[n:], self._estadisticas.resumen()
+
+
+_en_vivo = {}
+_en_vivo_lock = threading.Lock()
+
+
+def iniciar_en_vivo(clave):
+    """Nueva TranscripcionEnVivo publicada con la clave de la transcripción"""
+    en_vivo = TranscripcionEnVivo()
+    with _en_vivo_lock:
+        _en_vivo[clave] = en_vivo
+    return en_vivo
+
+
+def obtener_en_vivo(clave):
+    """TranscripcionEnVivo en curso con esa clave en este proceso, o None"""
+    with _en_vivo_lock:
+        return _en_vivo.get(clave)
+
+
+def terminar_en_vivo(clave, en_vivo):
+    """Retira la transcripción en vivo (si sigue siendo la publicada con esa clave)"""
+    with _en_vivo_lock:
+        if _en_vivo.get(clave) is en_vivo:
+            del _en_vivo[clave]
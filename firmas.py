@@ -0,0 +1,303 @@
+"""Firmas acústicas para reconocer tramos ya transcritos (sintonías, cuñas, despedidas).
+
+La firma de un audio es un conjunto de hashes de pares de picos del
+espectrograma (frecuencia del pico ancla, frecuencia del pico destino y
+distancia en tramas), cada uno con el instante de su ancla. Los picos
+sobreviven al ruido, a la recodificación y a desfases de unas muestras, así
+que un mismo tramo reutilizado en otro episodio produce muchos hashes
+iguales con la misma diferencia de tiempo.
+
+IndiceFirmas guarda en SQLite la firma y la transcripción de cada episodio
+transcrito; `buscar()` localiza en un audio nuevo los tramos que ya aparecen
+en episodios anteriores y devuelve su texto desplazado a la nueva línea de
+tiempo, para no volver a enviarlos al servicio de voz.
+"""
+import contextlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+FIRMAS_DB = os.getenv("FIRMAS_DB") or os.path.join(tempfile.gettempdir(), "prollecto_firmas.sqlite3")
+FIRMAS_MAX_EPISODIOS = int(os.getenv("FIRMAS_MAX_EPISODIOS", "50"))  # Episodios recientes en el índice en memoria
+
+SR_FIRMA = 16000
+VENTANA_FIRMA = 1024
+SALTO_FIRMA = 512  # 32 ms por trama
+SEGUNDOS_TRAMA_FIRMA = SALTO_FIRMA / SR_FIRMA
+MAX_BIN_FIRMA = 256  # Solo hasta 4 kHz: la zona más estable tras recodificar
+VECINDARIO_PICO = (15, 15)  # Tramas x bins en los que un pico debe ser el máximo
+PICOS_POR_SEGUNDO = 20
+ABANICO = 5  # Pares por pico ancla
+MAX_DT_PAR = 63  # Tramas (6 bits)
+MAX_OCURRENCIAS_HASH = 200  # Hashes más frecuentes en el índice: no discriminan, se ignoran
+MAX_CANDIDATOS = 50  # Pares (episodio, desfase) más votados que se examinan
+MIN_VOTOS = 20  # Hashes coincidentes con la misma diferencia de tiempo para aceptar un tramo
+MAX_HUECO_COINCIDENCIA = 2.0  # Segundos sin coincidencias que cortan un tramo
+MIN_DURACION_COINCIDENCIA = float(os.getenv("FIRMAS_MIN_DURACION", "5"))  # Segundos
+TOLERANCIA_BORDE = 0.5  # Segundos que un segmento puede asomar por los bordes imprecisos de la coincidencia
+TRAMAS_BLOQUE_FIRMA = 60 * SR_FIRMA // SALTO_FIRMA  # ~1 minuto de espectrograma en memoria
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS episodios (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    huella TEXT NOT NULL,
+    clave TEXT NOT NULL UNIQUE,
+    idioma TEXT,
+    hashes BLOB NOT NULL,
+    tiempos BLOB NOT NULL,
+    segmentos TEXT NOT NULL,
+    indexado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS episodios_huella ON episodios (huella);
+"""
+
+
+# ==============================
+# CÁLCULO DE LA FIRMA
+# ==============================
+def _picos_bloque(muestras, trama_inicial, desde, hasta):
+    """Picos (trama, bin, magnitud) de un bloque de audio cuya trama esté en [desde, hasta)"""
+    import scipy.fft  # Aquí y no arriba: motor.py importa este módulo y la app debe arrancar sin scipy
+    import scipy.ndimage
+    tramas = np.lib.stride_tricks.sliding_window_view(muestras, VENTANA_FIRMA)[::SALTO_FIRMA]
+    espectro = np.abs(scipy.fft.rfft(tramas * np.hanning(VENTANA_FIRMA).astype(np.float32), axis=1))
+    espectro = (20 * np.log10(espectro[:, 1:MAX_BIN_FIRMA + 1] + 1e-6)).astype(np.float32)
+    maximos = scipy.ndimage.maximum_filter(espectro, size=VECINDARIO_PICO, mode="constant", cval=-np.inf)
+    umbral = np.percentile(espectro, 75)
+    t, f = np.nonzero((espectro == maximos) & (espectro > umbral))
+    propios = (t + trama_inicial >= desde) & (t + trama_inicial < hasta)
+    t, f = t[propios], f[propios]
+    return t + trama_inicial, f + 1, espectro[t, f]
+
+
+def _limitar_densidad(t, f, magnitud):
+    """Conserva los PICOS_POR_SEGUNDO picos más fuertes de cada segundo"""
+    segundo = (t * SEGUNDOS_TRAMA_FIRMA).astype(np.int64)
+    orden = np.lexsort((-magnitud, segundo))
+    segundo = segundo[orden]
+    inicio_grupo = np.searchsorted(segundo, segundo, side="left")
+    rango = np.arange(len(orden)) - inicio_grupo
+    elegidos = orden[rango < PICOS_POR_SEGUNDO]
+    elegidos = elegidos[np.lexsort((f[elegidos], t[elegidos]))]
+    return t[elegidos], f[elegidos]
+
+
+def calcular_firma(ruta_wav):
+    """(hashes uint32, tiempos uint32 en tramas) de un WAV 16 kHz mono, leído por bloques"""
+    import soundfile as sf
+    # Cada bloque se lee con `margen` tramas de más a cada lado para que el filtro de máximos
+    # vea a los vecinos; solo se conservan los picos de su zona propia
+    margen = max(VECINDARIO_PICO) // 2
+    ts, fs, ms = [], [], []
+    with sf.SoundFile(ruta_wav) as entrada:
+        if entrada.samplerate != SR_FIRMA:
+            raise ValueError(f"La firma necesita audio a {SR_FIRMA} Hz (recibido {entrada.samplerate} Hz)")
+        for desde in range(0, max(entrada.frames - VENTANA_FIRMA, 0) // SALTO_FIRMA + 1, TRAMAS_BLOQUE_FIRMA):
+            trama_inicial = max(desde - margen, 0)
+            hasta = desde + TRAMAS_BLOQUE_FIRMA
+            entrada.seek(trama_inicial * SALTO_FIRMA)
+            muestras = entrada.read((hasta + margen - trama_inicial - 1) * SALTO_FIRMA + VENTANA_FIRMA,
+                                    dtype="float32", always_2d=True).mean(axis=1)
+            if len(muestras) < VENTANA_FIRMA:
+                break
+            t, f, m = _picos_bloque(muestras, trama_inicial, desde, hasta)
+            ts.append(t)
+            fs.append(f)
+            ms.append(m)
+    if not ts:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32)
+    t, f = _limitar_densidad(np.concatenate(ts), np.concatenate(fs), np.concatenate(ms))
+
+    # Pares (ancla, destino) con los ABANICO picos siguientes dentro de MAX_DT_PAR tramas
+    hashes, tiempos = [], []
+    for k in range(1, ABANICO + 1):
+        dt = t[k:] - t[:-k]
+        validos = (dt > 0) & (dt <= MAX_DT_PAR)
+        hashes.append((f[:-k][validos].astype(np.uint32) << 14) | (f[k:][validos].astype(np.uint32) << 6)
+                      | dt[validos].astype(np.uint32))
+        tiempos.append(t[:-k][validos].astype(np.uint32))
+    return np.concatenate(hashes), np.concatenate(tiempos)
+
+
+# ==============================
+# ÍNDICE PERSISTENTE
+# ==============================
+class IndiceFirmas:
+    """Firmas y transcripciones de los episodios ya transcritos, con búsqueda en memoria"""
+
+    def __init__(self, ruta_db=FIRMAS_DB, max_episodios=FIRMAS_MAX_EPISODIOS):
+        self.ruta_db = ruta_db
+        self.max_episodios = max_episodios
+        self._lock = threading.Lock()
+        self._version = None
+        self._hashes = np.zeros(0, dtype=np.uint32)
+        self._referencias = np.zeros(0, dtype=np.int64)  # (posición del episodio << 32) | tiempo
+        self._episodios = []  # [(id, huella, clave, idioma)]
+        with self._conexion() as conexion:
+            conexion.executescript(ESQUEMA)
+
+    @contextlib.contextmanager
+    def _conexion(self):
+        conexion = sqlite3.connect(self.ruta_db, timeout=30, isolation_level=None)
+        try:
+            conexion.execute("PRAGMA journal_mode=WAL")
+            yield conexion
+        finally:
+            conexion.close()
+
+    def indexar(self, huella, clave, idioma, firma, segmentos):
+        """Guarda (o sustituye) la firma y la transcripción de un episodio"""
+        hashes, tiempos = firma
+        with self._conexion() as conexion:
+            conexion.execute(
+                "INSERT OR REPLACE INTO episodios (huella, clave, idioma, hashes, tiempos, segmentos, indexado) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (huella, clave, idioma, hashes.astype("<u4").tobytes(), tiempos.astype("<u4").tobytes(),
+                 json.dumps(segmentos, ensure_ascii=False), time.time()),
+            )
+
+    def _actualizar(self):
+        """Reconstruye la tabla de búsqueda si se han indexado episodios desde la última vez"""
+        with self._conexion() as conexion:
+            version = conexion.execute("SELECT count(*), max(id) FROM episodios").fetchone()
+            if version == self._version:
+                return
+            filas = conexion.execute(
+                "SELECT id, huella, clave, idioma, hashes, tiempos FROM episodios ORDER BY id DESC LIMIT ?",
+                (self.max_episodios,),
+            ).fetchall()
+        hashes, referencias = [], []
+        for posicion, (_, _, _, _, blob_hashes, blob_tiempos) in enumerate(filas):
+            hashes.append(np.frombuffer(blob_hashes, dtype="<u4"))
+            referencias.append((np.int64(posicion) << 32) | np.frombuffer(blob_tiempos, dtype="<u4").astype(np.int64))
+        hashes = np.concatenate(hashes) if hashes else np.zeros(0, dtype=np.uint32)
+        referencias = np.concatenate(referencias) if referencias else np.zeros(0, dtype=np.int64)
+        orden = np.argsort(hashes, kind="stable")
+        self._hashes, self._referencias = hashes[orden], referencias[orden]
+        self._episodios = [fila[:4] for fila in filas]
+        self._version = version
+
+    def _segmentos_episodio(self, episodio_id):
+        with self._conexion() as conexion:
+            fila = conexion.execute("SELECT segmentos FROM episodios WHERE id = ?", (episodio_id,)).fetchone()
+        return json.loads(fila[0]) if fila else []
+
+    def _coincidencias(self, hashes, tiempos, excluidos):
+        """(posición de episodio, desfase en tramas, tiempos de la consulta) de cada hash coincidente"""
+        desde = np.searchsorted(self._hashes, hashes, side="left")
+        hasta = np.searchsorted(self._hashes, hashes, side="right")
+        cuantos = hasta - desde
+        cuantos[cuantos > MAX_OCURRENCIAS_HASH] = 0
+        total = int(cuantos.sum())
+        if not total:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int64)
+        consulta = np.repeat(np.arange(len(hashes)), cuantos)
+        indices = np.repeat(desde, cuantos) + np.arange(total) - np.repeat(np.cumsum(cuantos) - cuantos, cuantos)
+        referencias = self._referencias[indices]
+        episodio = referencias >> 32
+        t_consulta = tiempos[consulta].astype(np.int64)
+        desfase = (referencias & 0xFFFFFFFF) - t_consulta
+        validos = ~np.isin(episodio, excluidos)
+        return episodio[validos], desfase[validos], t_consulta[validos]
+
+    def buscar(self, firma, huella=None, idioma=None):
+        """Tramos del audio con firma `firma` ya transcritos en otros episodios (del mismo idioma).
+
+        Devuelve [{inicio, fin, clave, desplazamiento, segmentos, indices, total_segmentos}, ...]:
+        [inicio, fin) en segundos del audio nuevo, sin partir ningún segmento del episodio de
+        origen; `segmentos` ya desplazados a la nueva línea de tiempo; `indices`, sus
+        posiciones en la transcripción de origen (de `total_segmentos`).
+        """
+        hashes, tiempos = firma
+        with self._lock:
+            self._actualizar()
+            if not len(self._hashes) or not len(hashes):
+                return []
+            excluidos = [i for i, (_, h, _, idi) in enumerate(self._episodios)
+                         if h == huella or (idioma is not None and idi != idioma)]
+            episodio, desfase, t_consulta = self._coincidencias(hashes, tiempos, excluidos)
+            episodios = list(self._episodios)
+        if not len(episodio):
+            return []
+
+        # Votos por (episodio, desfase); al agrupar se suman los desfases vecinos (±1 trama),
+        # así que basta con una fracción de MIN_VOTOS en el desfase exacto para ser candidato
+        claves = (episodio << 32) | (desfase + (1 << 31))
+        unicas, votos = np.unique(claves, return_counts=True)
+        orden = np.argsort(-votos)
+        candidatos = unicas[orden][votos[orden] >= MIN_VOTOS // 3][:MAX_CANDIDATOS]
+
+        tramos = []
+        max_hueco = MAX_HUECO_COINCIDENCIA / SEGUNDOS_TRAMA_FIRMA
+        for candidato in candidatos:
+            ep, d = int(candidato >> 32), int(candidato & 0xFFFFFFFF) - (1 << 31)
+            t = np.unique(t_consulta[(episodio == ep) & (np.abs(desfase - d) <= 1)])
+            for grupo in np.split(t, np.flatnonzero(np.diff(t) > max_hueco) + 1):
+                if (len(grupo) >= MIN_VOTOS
+                        and (grupo[-1] - grupo[0]) * SEGUNDOS_TRAMA_FIRMA >= MIN_DURACION_COINCIDENCIA):
+                    tramos.append((int(grupo[0]), int(grupo[-1]) + 1, ep, d))
+
+        # Quedarse con los tramos más largos que no se solapan entre sí
+        aceptados = []
+        for inicio, fin, ep, d in sorted(tramos, key=lambda tr: tr[0] - tr[1]):
+            if all(fin <= a or inicio >= b for a, b, _, _ in aceptados):
+                aceptados.append((inicio, fin, ep, d))
+
+        resultado = []
+        for inicio, fin, ep, d in sorted(aceptados):
+            episodio_id, _, clave, _ = episodios[ep]
+            coincidencia = _ajustar_a_segmentos(
+                inicio * SEGUNDOS_TRAMA_FIRMA, fin * SEGUNDOS_TRAMA_FIRMA, d * SEGUNDOS_TRAMA_FIRMA,
+                self._segmentos_episodio(episodio_id),
+            )
+            if coincidencia is not None:
+                resultado.append({**coincidencia, 'clave': clave})
+        return resultado
+
+
+def _ajustar_a_segmentos(inicio, fin, desplazamiento, segmentos):
+    """Recorta [inicio, fin) para no partir segmentos del episodio de origen y desplaza los que quedan dentro"""
+    origen_inicio, origen_fin = inicio + desplazamiento, fin + desplazamiento
+    # Los segmentos que casi caben amplían el tramo; los que quedan partidos lo recortan
+    for seg in segmentos:
+        seg_fin = seg['offset'] + seg['duration']
+        if seg['offset'] < origen_inicio < seg_fin:
+            if seg['offset'] >= origen_inicio - TOLERANCIA_BORDE:
+                origen_inicio = seg['offset']
+            else:
+                origen_inicio = seg_fin
+        if seg['offset'] < origen_fin < seg_fin:
+            if seg_fin <= origen_fin + TOLERANCIA_BORDE:
+                origen_fin = seg_fin
+            else:
+                origen_fin = seg['offset']
+    indices = [i for i, seg in enumerate(segmentos)
+               if seg['offset'] >= origen_inicio and seg['offset'] + seg['duration'] <= origen_fin]
+    if origen_fin - origen_inicio < MIN_DURACION_COINCIDENCIA:
+        return None
+    return {
+        'inicio': origen_inicio - desplazamiento,
+        'fin': origen_fin - desplazamiento,
+        'desplazamiento': desplazamiento,
+        'segmentos': [{**segmentos[i], 'offset': segmentos[i]['offset'] - desplazamiento} for i in indices],
+        'indices': indices,
+        'total_segmentos': len(segmentos),
+    }
+
+
+_indice = None
+_indice_lock = threading.Lock()
+
+
+def obtener_indice():
+    """Índice de firmas del proceso"""
+    global _indice
+    with _indice_lock:
+        if _indice is None:
+            _indice = IndiceFirmas()
+        return _indice
@@ -0,0 +1,206 @@
+"""Limitación compartida de las peticiones a los servicios de Azure.
+
+Todas las sesiones de Streamlit, los workers de la cola y los hilos del
+proceso pasan por el mismo LimitadorServicio de cada servicio (Speech en
+tiempo real, audio corto, TTS, Language, Translator): un cubo de fichas limita
+las peticiones por segundo y un tope, las que están en curso a la vez. Quien
+no puede entrar espera en una cola justa: los turnos se reparten por rondas
+entre clientes (una sesión de la interfaz o un trabajo de la cola), así que un
+doblaje de cientos de frases no deja sin servicio a los demás. Un 429 frena el
+servicio entero durante el Retry-After, no solo la petición que lo recibió.
+
+La profundidad de cada cola, las peticiones en curso y las esperas se exponen
+en las métricas del proceso.
+
+No depende de Streamlit; lo usan motor.py y sintesis.py.
+"""
+import collections
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+import metricas
+
+MAX_SESIONES_SPEECH = int(os.getenv("MAX_SESIONES_SPEECH", "8"))
+# servicio -> (peticiones por segundo, peticiones en curso a la vez); 0 peticiones/s: sin límite de ritmo
+LIMITES_SERVICIOS = {
+    "speech": (2.0, MAX_SESIONES_SPEECH),  # Sesiones de ConversationTranscriber
+    "stt": (5.0, 8),  # API REST de audio corto
+    "tts": (20.0, 8),
+    "language": (10.0, 8),
+    "traduccion": (10.0, 4),
+}
+ESPERA_REGISTRADA = 0.01  # Las esperas más cortas no se registran como etapa
+
+
+def _leer_limites(texto):
+    """{servicio: (por_segundo, concurrencia)} de un texto como "tts=20/8,language=5/2" (LIMITES_AZURE)"""
+    limites = {}
+    for parte in filter(None, (p.strip() for p in texto.split(","))):
+        servicio, _, valor = parte.partition("=")
+        servicio = servicio.strip()
+        por_segundo, _, concurrencia = valor.partition("/")
+        anterior = LIMITES_SERVICIOS.get(servicio, (0.0, 8))
+        limites[servicio] = (float(por_segundo or anterior[0]), int(concurrencia or anterior[1]))
+    return limites
+
+
+LIMITES_SERVICIOS.update(_leer_limites(os.getenv("LIMITES_AZURE", "")))
+
+
+# ==============================
+# CLIENTE DE CADA PETICIÓN
+# ==============================
+_cliente = contextvars.ContextVar("cliente_azure", default=None)
+
+
+def fijar_cliente(cliente):
+    """Identifica al cliente (p. ej. la sesión de la interfaz) de las peticiones de este contexto.
+
+    Se hereda en los hilos lanzados con metricas.en_contexto.
+    """
+    _cliente.set(cliente)
+
+
+def cliente_actual():
+    """Cliente fijado con fijar_cliente, o el trabajo de métricas en curso, o "" si no hay ninguno"""
+    cliente = _cliente.get()
+    if cliente is None:
+        registro = metricas.trabajo_actual()
+        cliente = f"trabajo-{registro.trabajo}" if registro is not None and registro.trabajo is not None else ""
+    return cliente
+
+
+# ==============================
+# LIMITADOR POR SERVICIO
+# ==============================
+class LimitadorServicio:
+    """Cubo de fichas y tope de concurrencia de un servicio, con cola justa entre clientes"""
+
+    def __init__(self, servicio, por_segundo, concurrencia):
+        self.servicio = servicio
+        self.por_segundo = por_segundo
+        self.concurrencia = concurrencia
+        self.rafaga = max(por_segundo, 1.0)  # Fichas acumulables: un segundo de peticiones
+        self._fichas = self.rafaga
+        self._repuesto = time.monotonic()
+        self._frenado_hasta = 0.0
+        self._en_curso = 0
+        self._colas = collections.OrderedDict()  # cliente -> billetes en espera, en orden de ronda
+        self._cond = threading.Condition()
+        self.atendidas = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+        self.frenadas = 0
+
+    def _reponer(self, ahora):
+        if self.por_segundo > 0:
+            self._fichas = min(self.rafaga, self._fichas + (ahora - self._repuesto) * self.por_segundo)
+        self._repuesto = ahora
+
+    def _espera_necesaria(self, ahora):
+        """Segundos hasta que el primero de la ronda pueda entrar (0: ya); None si está lleno"""
+        if self._en_curso >= self.concurrencia:
+            return None
+        espera = self._frenado_hasta - ahora
+        if self.por_segundo > 0 and self._fichas < 1:
+            espera = max(espera, (1 - self._fichas) / self.por_segundo)
+        return max(espera, 0.0)
+
+    def _primero(self):
+        return next(iter(self._colas.values()))[0]
+
+    def _retirar(self, cliente, billete):
+        cola = self._colas.pop(cliente)
+        cola.remove(billete)
+        if cola:
+            self._colas[cliente] = cola  # Al final de la ronda: ahora les toca a los demás clientes
+        self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def turno(self, cliente=None):
+        """Espera el turno de una petición al servicio y la cuenta como en curso durante el bloque"""
+        cliente = cliente_actual() if cliente is None else cliente
+        billete = object()
+        inicio = time.monotonic()
+        with self._cond:
+            self._colas.setdefault(cliente, collections.deque()).append(billete)
+            try:
+                while True:
+                    ahora = time.monotonic()
+                    self._reponer(ahora)
+                    espera = self._espera_necesaria(ahora) if self._primero() is billete else None
+                    if espera == 0:
+                        break
+                    self._cond.wait(espera)
+            except BaseException:
+                self._retirar(cliente, billete)  # Sin esto, un hilo interrumpido bloquearía la cola
+                raise
+            self._retirar(cliente, billete)
+            if self.por_segundo > 0:
+                self._fichas -= 1
+            self._en_curso += 1
+            espera = time.monotonic() - inicio
+            self.atendidas += 1
+            self.espera_total += espera
+            self.espera_maxima = max(self.espera_maxima, espera)
+        if espera >= ESPERA_REGISTRADA:
+            metricas.registrar(f"espera_{self.servicio}", espera, log=False)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._en_curso -= 1
+                self._cond.notify_all()
+
+    def frenar(self, segundos):
+        """El servicio ha respondido 429/503: nadie entra hasta dentro de `segundos`"""
+        with self._cond:
+            self._frenado_hasta = max(self._frenado_hasta, time.monotonic() + segundos)
+            self._fichas = min(self._fichas, 0.0)  # Tras el frenado, retomar el ritmo poco a poco
+            self.frenadas += 1
+            self._cond.notify_all()
+        metricas.contar(f"{self.servicio}_frenadas")
+
+    def estado(self):
+        """Cola, peticiones en curso y esperas acumuladas del servicio"""
+        with self._cond:
+            return {
+                'servicio': self.servicio,
+                'en_cola': sum(len(cola) for cola in self._colas.values()),
+                'clientes_en_cola': len(self._colas),
+                'en_curso': self._en_curso,
+                'atendidas': self.atendidas,
+                'espera_media': self.espera_total / self.atendidas if self.atendidas else 0.0,
+                'espera_maxima': self.espera_maxima,
+                'frenadas': self.frenadas,
+            }
+
+
+_limitadores = {}
+_limitadores_lock = threading.Lock()
+
+
+def obtener_limitador(servicio):
+    """LimitadorServicio del proceso para `servicio` (ver LIMITES_SERVICIOS)"""
+    with _limitadores_lock:
+        limitador = _limitadores.get(servicio)
+        if limitador is None:
+            por_segundo, concurrencia = LIMITES_SERVICIOS.get(servicio, (0.0, 8))
+            limitador = _limitadores[servicio] = LimitadorServicio(servicio, por_segundo, concurrencia)
+            metricas.registrar_indicador(f"prollecto_azure_{servicio}_en_cola",
+                                         f"Peticiones a {servicio} esperando turno",
+                                         lambda: limitador.estado()['en_cola'])
+            metricas.registrar_indicador(f"prollecto_azure_{servicio}_en_curso",
+                                         f"Peticiones a {servicio} en curso",
+                                         lambda: limitador.estado()['en_curso'])
+        return limitador
+
+
+def estado_limitadores():
+    """estado() de cada servicio usado hasta ahora en el proceso"""
+    with _limitadores_lock:
+        limitadores = list(_limitadores.values())
+    return [limitador.estado() for limitador in limitadores]
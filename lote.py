@@ -0,0 +1,232 @@
+"""Procesamiento por lotes de episodios desde la línea de comandos, sin Streamlit.
+
+La decodificación y el remuestreo se reparten entre procesos; la transcripción,
+el resumen y la exportación (limitados por la red) se ejecutan en hilos.
+
+Uso:
+    python lote.py carpeta_o_manifiesto --salida resultados [--resumen] [--paralelo]
+
+El manifiesto es un archivo de texto con una ruta por línea o un JSONL con
+objetos {"ruta": ..., "idioma": ..., "hablantes": ...}; las rutas relativas se
+resuelven respecto al propio manifiesto.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import metricas
+import motor
+from biblioteca import obtener_biblioteca
+
+EXTENSIONES_AUDIO = (".mp3", ".wav", ".flac", ".ogg")
+
+
+def listar_episodios(entrada, idioma, hablantes):
+    """Lista de episodios {ruta, idioma, hablantes} de una carpeta o un manifiesto"""
+    if os.path.isdir(entrada):
+        return [
+            {"ruta": os.path.join(entrada, nombre), "idioma": idioma, "hablantes": hablantes}
+            for nombre in sorted(os.listdir(entrada))
+            if nombre.lower().endswith(EXTENSIONES_AUDIO)
+        ]
+
+    base = os.path.dirname(os.path.abspath(entrada))
+    episodios = []
+    with open(entrada, encoding="utf-8") as f:
+        for linea in f:
+            linea = linea.strip()
+            if not linea or linea.startswith("#"):
+                continue
+            episodio = json.loads(linea) if linea.startswith("{") else {"ruta": linea}
+            episodio["ruta"] = os.path.join(base, episodio["ruta"])
+            episodio.setdefault("idioma", idioma)
+            episodio.setdefault("hablantes", hablantes)
+            episodios.append(episodio)
+    return episodios
+
+
+def preparar_episodio(ruta):
+    """Etapa de CPU (se ejecuta en un proceso): hash del contenido y conversión a WAV 16 kHz.
+
+    El WAV queda retenido en la caché (los demás workers pueden estar
+    expulsando entradas) hasta que el hilo que lo transcribe suelta la marca
+    devuelta. Devuelve también las etapas medidas, para sumarlas a las
+    métricas del episodio.
+    """
+    inicio = time.perf_counter()
+    cache = motor.obtener_cache()
+    with metricas.trabajo(tipo="preparacion") as registro:
+        with metricas.etapa("hash"):
+            huella = motor.huella_archivo(ruta)
+        marca = cache.retener_entrada(cache.ruta(motor.clave_wav(huella), ".wav"))
+        try:
+            ruta_wav, _ = motor.convertir_a_wav(ruta, huella)
+            duracion = motor.duracion_audio(ruta_wav)
+        except BaseException:
+            cache.soltar(marca)
+            raise
+        registro.estado = "completado"
+    etapas = registro.como_dict()["etapas"]
+    return huella, ruta_wav, marca, duracion, time.perf_counter() - inicio, etapas
+
+
+def procesar_episodio(episodio, huella, ruta_wav, args, etapas_preparacion=(), marca=None):
+    """Etapas de red (se ejecutan en un hilo): transcripción, resumen y exportación.
+
+    Al terminar suelta `marca`, la retención del WAV hecha en preparar_episodio.
+    """
+    nombre = os.path.splitext(os.path.basename(episodio["ruta"]))[0]
+    try:
+        with metricas.trabajo(nombre, "episodio") as registro:
+            registro.estado = "fallido"  # Salvo que _procesar_episodio termine sin error
+            # Las etapas de la preparación ya se registraron (y se escribieron en el log) en su proceso
+            for etapa in etapas_preparacion:
+                extra = {k: v for k, v in etapa.items() if k not in ("etapa", "segundos", "rss_mb")}
+                metricas.registrar(etapa["etapa"], etapa["segundos"], log=False, **extra)
+            resultado = _procesar_episodio(episodio, nombre, huella, ruta_wav, args)
+            if not resultado["error"]:
+                registro.estado = "completado"
+    finally:
+        motor.obtener_cache().soltar(marca)
+    resultado["metricas"] = registro.como_dict()
+    return resultado
+
+
+def _procesar_episodio(episodio, nombre, huella, ruta_wav, args):
+    resultado = {"episodio": nombre, "ruta": episodio["ruta"], "huella": huella, "error": None}
+
+    inicio = time.perf_counter()
+    segmentos, error_msg = motor.transcribir(
+        ruta_wav, huella, episodio["idioma"], episodio["hablantes"],
+        paralelo=args.paralelo, max_workers=args.fragmentos
+    )
+    resultado["tiempo_transcripcion"] = time.perf_counter() - inicio
+    resultado["segmentos"] = segmentos
+    if error_msg:
+        resultado["error"] = error_msg
+        return resultado
+    if args.indexar and segmentos:
+        obtener_biblioteca().indexar(
+            motor.clave_transcripcion(huella, episodio["idioma"], episodio["hablantes"]), nombre, segmentos,
+            ruta=os.path.abspath(episodio["ruta"]), idioma=episodio["idioma"],
+        )
+
+    if args.resumen and segmentos:
+        inicio = time.perf_counter()
+        try:
+            resultado["resumen"] = motor.resumir_transcripcion(segmentos, motor_resumen=args.motor_resumen)
+        except motor.ErrorResumen as e:
+            resultado["error"] = str(e)
+        resultado["tiempo_resumen"] = time.perf_counter() - inicio
+
+    for formato in args.formatos:
+        extension, _ = motor.info_formato(formato)
+        with open(os.path.join(args.salida, f"{nombre}{extension}"), "wb") as f:
+            motor.exportar(segmentos, formato, f)
+    return resultado
+
+
+def procesar_lote(episodios, args):
+    """Ejecuta todo el lote y escribe resultados.jsonl; devuelve las métricas del lote"""
+    os.makedirs(args.salida, exist_ok=True)
+    inicio = time.perf_counter()
+    segundos_audio = 0.0
+    fallidos = 0
+
+    with ProcessPoolExecutor(max_workers=args.procesos) as procesos, \
+            ThreadPoolExecutor(max_workers=args.hilos) as hilos, \
+            open(os.path.join(args.salida, "resultados.jsonl"), "w", encoding="utf-8") as salida:
+        preparaciones = {procesos.submit(preparar_episodio, ep["ruta"]): ep for ep in episodios}
+        pendientes = {}
+
+        def fallido(episodio, error):
+            salida.write(json.dumps({"ruta": episodio["ruta"], "error": error}, ensure_ascii=False) + "\n")
+            salida.flush()
+            print(f"✗ {episodio['ruta']}: {error}", file=sys.stderr)
+
+        # A medida que termina cada conversión, su episodio pasa a la etapa de red
+        for futuro in as_completed(preparaciones):
+            episodio = preparaciones[futuro]
+            try:
+                huella, ruta_wav, marca, duracion, tiempo_conversion, etapas = futuro.result()
+            except Exception as e:  # Un episodio que falla no detiene el lote
+                fallidos += 1
+                fallido(episodio, str(e) if isinstance(e, motor.ErrorConversion) else repr(e))
+                continue
+            segundos_audio += duracion
+            trabajo = hilos.submit(procesar_episodio, episodio, huella, ruta_wav, args, etapas, marca)
+            pendientes[trabajo] = (episodio, duracion, tiempo_conversion)
+
+        for futuro in as_completed(pendientes):
+            episodio, duracion, tiempo_conversion = pendientes[futuro]
+            try:
+                resultado = futuro.result()
+            except Exception as e:
+                fallidos += 1
+                fallido(episodio, repr(e))
+                continue
+            resultado.update(duracion=duracion, tiempo_conversion=tiempo_conversion)
+            salida.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+            salida.flush()
+            if resultado["error"]:
+                fallidos += 1
+                print(f"✗ {resultado['episodio']}: {resultado['error']}", file=sys.stderr)
+            else:
+                print(f"✓ {resultado['episodio']} ({duracion / 60:.1f} min, {len(resultado['segmentos'])} segmentos)")
+
+    transcurrido = time.perf_counter() - inicio
+    return {
+        "episodios": len(episodios),
+        "fallidos": fallidos,
+        "horas_audio": segundos_audio / 3600,
+        "segundos_reloj": transcurrido,
+        "factor_tiempo_real": segundos_audio / transcurrido if transcurrido > 0 else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transcribe con diarización todos los episodios de una carpeta o manifiesto.")
+    parser.add_argument("entrada", help="Carpeta con audios o manifiesto (.txt / .jsonl)")
+    parser.add_argument("--salida", default="resultados", help="Carpeta de salida (resultados.jsonl + exportaciones)")
+    parser.add_argument("--idioma", default="es-ES")
+    parser.add_argument("--hablantes", type=int, default=5, help="Máximo de hablantes a detectar")
+    parser.add_argument("--formatos", type=lambda v: [f.strip().upper() for f in v.split(",") if f.strip()],
+                        default=["SRT", "VTT", "TXT"], help="Formatos de exportación separados por comas")
+    parser.add_argument("--resumen", action="store_true", help="Generar también el resumen de cada episodio")
+    parser.add_argument("--motor-resumen", choices=list(motor.MOTORES_RESUMEN), default="azure",
+                        help="Resumir con Azure Language o con el resumen extractivo local (sin claves)")
+    parser.add_argument("--paralelo", action="store_true", help="Transcribir cada episodio por fragmentos en paralelo")
+    parser.add_argument("--fragmentos", type=int, default=4, help="Fragmentos simultáneos por episodio con --paralelo")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count(), help="Procesos para decodificar y remuestrear")
+    parser.add_argument("--hilos", type=int, default=4, help="Episodios transcribiéndose a la vez")
+    parser.add_argument("--sin-indice", dest="indexar", action="store_false",
+                        help="No añadir los episodios al índice de búsqueda (ver biblioteca.py)")
+    args = parser.parse_args(argv)
+
+    desconocidos = set(args.formatos) - set(motor.FORMATOS_EXPORTACION)
+    if desconocidos:
+        parser.error(f"Formatos no soportados: {', '.join(sorted(desconocidos))}")
+    motor.configurar()  # Aplica BACKEND=local si está definido
+    if not motor.SPEECH_KEY or not motor.REGION:
+        parser.error("No se encontraron las variables de entorno SPEECH_KEY o SPEECH_REGION.")
+    if args.resumen and args.motor_resumen == "azure" and (not motor.LANGUAGE_KEY or not motor.LANGUAGE_ENDPOINT):
+        parser.error("No se encontraron las variables de entorno LANGUAGE_KEY o LANGUAGE_ENDPOINT.")
+
+    episodios = listar_episodios(args.entrada, args.idioma, args.hablantes)
+    if not episodios:
+        parser.error(f"No hay episodios en {args.entrada}")
+
+    resumen = procesar_lote(episodios, args)
+    print(
+        f"\n📊 {resumen['episodios'] - resumen['fallidos']}/{resumen['episodios']} episodios, "
+        f"{resumen['horas_audio']:.2f} h de audio en {resumen['segundos_reloj']:.1f} s "
+        f"({resumen['factor_tiempo_real']:.1f}× tiempo real)"
+    )
+    return 1 if resumen["fallidos"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,266 +1,364 @@
 import streamlit as st
-import azure.cognitiveservices.speech as speechsdk
+import bisect
+import functools
+import json
 import os
-import tempfile
 import time
-import scipy.signal
-import soundfile as sf
-import requests
-import json
+
+from biblioteca import obtener_biblioteca
+from cola import EN_CURSO, FALLIDO, PENDIENTE, obtener_cola
+from en_vivo import estadisticas_hablantes, obtener_en_vivo
+from limitador import estado_limitadores
+from metricas import iniciar_servidor_prometheus, resumen_proceso
+from motor import (
+    EXPORTADORES, FORMATOS_EXPORTACION, MOTORES_RESUMEN, ORACIONES_RESUMEN, PRECALENTAR, ErrorResumen,
+    cargar_palabras, clave_transcripcion, configurar, exportar_a_cache, huella_bytes, info_formato, obtener_cache,
+    precalentar_en_segundo_plano, resumir_transcripcion, vista_previa,
+)
 
 # ==============================
 # CONFIGURACIÓN AZURE SPEECH
 # ==============================
-SPEECH_KEY = os.getenv("SPEECH_KEY") or st.secrets.get("SPEECH_KEY")
-REGION = os.getenv("SPEECH_REGION") or st.secrets.get("SPEECH_REGION")
+# BACKEND=local sustituye Speech y Language por dobles locales (simulado.py): no hacen falta claves
+BACKEND = os.getenv("BACKEND", "azure")
+
+if BACKEND == "local":
+    configurar(backend="local")
+else:
+    SPEECH_KEY = os.getenv("SPEECH_KEY") or st.secrets.get("SPEECH_KEY")
+    REGION = os.getenv("SPEECH_REGION") or st.secrets.get("SPEECH_REGION")
+
+    # Configuración Azure Language Service
+    LANGUAGE_KEY = os.getenv("LANGUAGE_KEY") or st.secrets.get("LANGUAGE_KEY")
+    LANGUAGE_ENDPOINT = os.getenv("LANGUAGE_ENDPOINT") or st.secrets.get("LANGUAGE_ENDPOINT")
 
-# Configuración Azure Language Service
-LANGUAGE_KEY = os.getenv("LANGUAGE_KEY") or st.secrets.get("LANGUAGE_KEY")
-LANGUAGE_ENDPOINT = os.getenv("LANGUAGE_ENDPOINT") or st.secrets.get("LANGUAGE_ENDPOINT")
+    if not SPEECH_KEY or not REGION:
+        st.error("❌ No se encontraron las variables de entorno SPEECH_KEY o SPEECH_REGION.")
+        st.stop()
 
-if not SPEECH_KEY or not REGION:
-    st.error("❌ No se encontraron las variables de entorno SPEECH_KEY o SPEECH_REGION.")
-    st.stop()
+    if not LANGUAGE_KEY or not LANGUAGE_ENDPOINT:
+        st.error("❌ No se encontraron las variables de entorno LANGUAGE_KEY o LANGUAGE_ENDPOINT.")
+        st.stop()
 
-if not LANGUAGE_KEY or not LANGUAGE_ENDPOINT:
-    st.error("❌ No se encontraron las variables de entorno LANGUAGE_KEY o LANGUAGE_ENDPOINT.")
-    st.stop()
+    configurar(SPEECH_KEY, REGION, LANGUAGE_KEY, LANGUAGE_ENDPOINT)
+
+# Endpoint /metrics de Prometheus si METRICAS_PUERTO está definido (una vez por proceso)
+PUERTO_METRICAS = iniciar_servidor_prometheus()
+
+if PRECALENTAR:
+    precalentar_en_segundo_plano()
 
 # ==============================
-# FUNCIÓN DE RESUMEN CON AZURE LANGUAGE
+# COLA DE TRABAJOS EN SEGUNDO PLANO
 # ==============================
-@st.cache_data(ttl=600)
-def generar_resumen(texto, tipo="extractive"):
-    """
-    Genera un resumen del texto usando Azure Language Service
-    tipo: 'extractive' (extrae oraciones clave) o 'abstractive' (genera resumen)
-    """
-    
-    # URL para trabajos asíncronos
-    url = f"{LANGUAGE_ENDPOINT.rstrip('/')}/language/analyze-text/jobs?api-version=2023-04-01"
-    
-    headers = {
-        "Ocp-Apim-Subscription-Key": LANGUAGE_KEY,
-        "Content-Type": "application/json"
-    }
-    
-    if tipo == "extractive":
-        # Resumen extractivo - extrae oraciones más relevantes
-        body = {
-            "displayName": "Extractive Summarization Task",
-            "analysisInput": {
-                "documents": [
-                    {
-                        "id": "1",
-                        "language": "es",
-                        "text": texto
-                    }
-                ]
-            },
-            "tasks": [
-                {
-                    "kind": "ExtractiveSummarization",
-                    "taskName": "ExtractiveSummarization_1",
-                    "parameters": {
-                        "sentenceCount": 5,
-                        "sortBy": "Offset"
-                    }
-                }
-            ]
-        }   
-    try:
-        # Enviar solicitud inicial
-        response = requests.post(url, headers=headers, json=body)
-        response.raise_for_status()
-        
-        # Obtener URL de estado del trabajo
-        operation_location = response.headers.get('Operation-Location')
-        if not operation_location:
-            st.error("No se recibió la URL de operación")
-            return None
-        
-        # Esperar a que el trabajo se complete (polling)
-        max_attempts = 60  # 60 intentos = 1 minuto máximo
-        attempt = 0
-        
-        while attempt < max_attempts:
-            time.sleep(2)  # Esperar 2 segundos entre consultas
-            
-            status_response = requests.get(operation_location, headers=headers)
-            status_response.raise_for_status()
-            status_data = status_response.json()
-            
-            status = status_data.get('status')
-            
-            if status == 'succeeded':
-                # Extraer el resumen
-                tasks = status_data.get('tasks', {}).get('items', [])
-                if not tasks:
-                    st.error("No se encontraron tareas en la respuesta")
-                    return None
-                
-                task_result = tasks[0].get('results', {})
-                documents = task_result.get('documents', [])
-                
-                if not documents:
-                    st.error("No se encontraron documentos en los resultados")
-                    return None
-                
-                doc = documents[0]
-                
-                if tipo == "extractive":
-                    # Extraer oraciones del resumen extractivo
-                    sentences = doc.get('sentences', [])
-                    resumen = " ".join([s['text'] for s in sentences])
-                else:
-                    # Extraer resumen abstractivo
-                    summaries = doc.get('summaries', [])
-                    resumen = " ".join([s['text'] for s in summaries])
-                
-                return resumen
-            
-            elif status == 'failed':
-                errors = status_data.get('errors', [])
-                error_msg = errors[0] if errors else "Error desconocido"
-                st.error(f"El trabajo falló: {error_msg}")
-                return None
-            
-            # Si está en progreso, continuar esperando
-            attempt += 1
-        
-        st.error("Tiempo de espera agotado. El proceso tardó demasiado.")
-        return None
-    
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error al generar resumen: {str(e)}")
-        if hasattr(e, 'response') and hasattr(e.response, 'text'):
-            st.error(f"Detalles: {e.response.text}")
-        return None
+def guardar_subida(uploaded_file, huella):
+    """Guarda el archivo subido en la caché (una sola vez por contenido) y devuelve su ruta"""
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    cache = obtener_cache()
+    en_cache = cache.obtener(huella, extension)
+    if en_cache is not None:
+        return en_cache
+
+    with cache.temporal(extension) as temporal:
+        with open(temporal, "wb") as f:
+            f.write(uploaded_file.getbuffer())  # Vista del búfer de la subida, sin copiarlo en memoria
+        return cache.guardar_archivo(huella, extension, temporal)
+
+
+def mostrar_estado_trabajo(trabajo):
+    """Muestra el estado de un trabajo en cola o en curso"""
+    if trabajo["estado"] == PENDIENTE:
+        st.info(f"⏳ En cola: {obtener_cola().posicion(trabajo['id'])} trabajo(s) por delante")
+    elif trabajo["estado"] == EN_CURSO:
+        st.progress(trabajo["progreso"], text=trabajo["mensaje"] or "Procesando...")
 
 # ==============================
-# FUNCIÓN DE TRANSCRIPCIÓN CON DIARIZACIÓN
+# VISTA PAGINADA DE LA TRANSCRIPCIÓN
 # ==============================
-@st.cache_data(ttl=600)
-def transcribir_audio_con_diarizacion(file_path, _progress_bar, _status_text):
-    """Transcribe audios con diarización (identificación de hablantes) usando Azure Speech SDK"""
-    
-    speech_config = speechsdk.SpeechConfig(subscription=SPEECH_KEY, region=REGION)
-    
-    # Configurar idioma (ajusta según necesites)
-    speech_config.speech_recognition_language = "es-ES"
-    
-    # ACTIVAR DIARIZACIÓN - Método correcto
-    speech_config.set_property(
-        speechsdk.PropertyId.SpeechServiceConnection_LanguageIdMode, "Continuous"
-    )
-    speech_config.request_word_level_timestamps()
-    
-    # Habilitar diarización del hablante
-    speech_config.set_property_by_name("DiarizationEnabled", "true")
-    speech_config.set_property_by_name("MaxSpeakerCount", "10")  # Máximo de hablantes a detectar
-    
-    # Configurar audio de entrada
-    audio_config = speechsdk.audio.AudioConfig(filename=file_path)
-    
-    # Usar ConversationTranscriber para diarización
-    conversation_transcriber = speechsdk.transcription.ConversationTranscriber(
-        speech_config=speech_config,
-        audio_config=audio_config
+COLORES_HABLANTE = ["🔵", "🟢", "🟠", "🟣", "🟡", "🔴"]
+
+
+def indexar_transcripcion(transcripcion, indice=None):
+    """Agrupación por hablante e índices por tiempo, calculados una sola vez por transcripción.
+
+    Con el `indice` de un prefijo de `transcripcion` (la vista en vivo) solo se
+    añaden los segmentos nuevos; si alguno llega fuera de orden, se reconstruye entero.
+    """
+    if indice is not None:
+        ultimo = indice['inicios'][-1] if indice['inicios'] else float("-inf")
+        for i in range(indice['segmentos'], len(transcripcion)):
+            if transcripcion[i]['offset'] < ultimo:
+                indice = None
+                break
+            ultimo = transcripcion[i]['offset']
+    if indice is None:
+        indice = {'orden': [], 'rango': [], 'inicios': [], 'por_hablante': {}, 'inicios_hablante': {},
+                  'colores': {}, 'duracion': 0.0, 'segmentos': 0}
+        nuevos = sorted(range(len(transcripcion)), key=lambda i: transcripcion[i]['offset'])
+    else:
+        nuevos = range(indice['segmentos'], len(transcripcion))
+
+    indice['rango'].extend([0] * (len(transcripcion) - len(indice['rango'])))
+    for i in nuevos:
+        item = transcripcion[i]
+        hablante = item['speaker']
+        if hablante not in indice['por_hablante']:
+            indice['colores'][hablante] = COLORES_HABLANTE[len(indice['por_hablante']) % len(COLORES_HABLANTE)]
+            indice['por_hablante'][hablante] = []
+            indice['inicios_hablante'][hablante] = []
+        indice['rango'][i] = len(indice['orden'])
+        indice['orden'].append(i)
+        indice['inicios'].append(item['offset'])
+        indice['por_hablante'][hablante].append(i)
+        indice['inicios_hablante'][hablante].append(item['offset'])
+        indice['duracion'] = max(indice['duracion'], item['offset'] + item['duration'])
+    indice['segmentos'] = len(transcripcion)
+    return indice
+
+
+def filtrar_segmentos(indice, hablantes, desde, hasta):
+    """Índices de los segmentos de `hablantes` (None = todos) que empiezan en [desde, hasta], en orden temporal"""
+    if hablantes is None:
+        inicios = indice['inicios']
+        return indice['orden'][bisect.bisect_left(inicios, desde):bisect.bisect_right(inicios, hasta)]
+
+    seleccion = []
+    for h in hablantes:
+        inicios = indice['inicios_hablante'].get(h, [])
+        indices = indice['por_hablante'].get(h, [])
+        seleccion.extend(indices[bisect.bisect_left(inicios, desde):bisect.bisect_right(inicios, hasta)])
+    return sorted(seleccion, key=indice['rango'].__getitem__)
+
+
+def mostrar_transcripcion(transcripcion, indice):
+    """Muestra una página de segmentos con filtros por hablante y por tramo de tiempo.
+
+    Cada página se pinta con un único bloque markdown, así el coste de cada
+    rerun depende del tamaño de página y no de la longitud de la transcripción.
+    """
+    st.markdown("### 📝 Transcripción con Hablantes Identificados")
+    st.info(f"🎭 **Hablantes detectados:** {len(indice['por_hablante'])}")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        todos = list(indice['por_hablante'])
+        elegidos = st.multiselect("Hablantes:", todos, default=todos,
+                                  format_func=lambda h: f"{indice['colores'][h]} Hablante {h}")
+    with col2:
+        duracion = max(float(indice['duracion']), 1.0)
+        if 'tramo' not in st.session_state:
+            st.session_state.tramo = (0.0, duracion)
+        desde, hasta = st.slider("Tramo (s):", 0.0, duracion, step=1.0, key="tramo")
+
+    seleccion = filtrar_segmentos(indice, None if len(elegidos) == len(todos) else elegidos, desde, hasta)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        por_pagina = st.selectbox("Segmentos por página:", [25, 50, 100], index=1)
+    paginas = max(-(-len(seleccion) // por_pagina), 1)
+    with col2:
+        pagina = st.number_input(f"Página (de {paginas}):", min_value=1, max_value=paginas, value=1, step=1)
+
+    bloques = []
+    for i in seleccion[(pagina - 1) * por_pagina:pagina * por_pagina]:
+        item = transcripcion[i]
+        bloques.append(
+            f"{indice['colores'][item['speaker']]} **Hablante {item['speaker']}** "
+            f"[{item['offset']:.2f}s - {item['offset'] + item['duration']:.2f}s]  \n"
+            f"{item['text']}"
+        )
+    st.caption(f"{len(seleccion)} segmento(s) con los filtros actuales")
+    if bloques:
+        st.markdown("\n\n---\n\n".join(bloques))
+
+
+def mostrar_estadisticas_hablantes(filas):
+    """Tabla de tiempo de habla, turnos, ritmo y solape de cada hablante"""
+    st.dataframe(
+        [
+            {"hablante": f["hablante"], "habla (s)": round(f["segundos"], 1), "turnos": f["turnos"],
+             "palabras": f["palabras"], "palabras/min": round(f["palabras_minuto"]),
+             "solape (s)": round(f["solape"], 1)}
+            for f in filas
+        ],
+        hide_index=True, use_container_width=True,
     )
-    
-    transcripcion_completa = []
-    progreso = 0
-    done = False
-    error_msg = None
-
-    def transcribed_cb(evt):
-        """Callback cuando se reconoce un segmento con hablante"""
-        nonlocal progreso
-        if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech:
-            speaker_id = evt.result.speaker_id if hasattr(evt.result, 'speaker_id') else "Desconocido"
-            text = evt.result.text
-            offset = evt.result.offset / 10_000_000  # Convertir a segundos
-            duration = evt.result.duration / 10_000_000
-            
-            transcripcion_completa.append({
-                'speaker': speaker_id,
-                'offset': offset,
-                'duration': duration,
-                'text': text
-            })
-            
-            progreso = min(progreso + 0.02, 1.0)
-            _progress_bar.progress(progreso)
-            _status_text.text(f"🎤 Hablante {speaker_id}: {text[:50]}...")
-
-    def session_stopped_cb(evt):
-        """Callback cuando termina la sesión"""
-        nonlocal done
-        done = True
-
-    def canceled_cb(evt):
-        """Callback en caso de error"""
-        nonlocal done, error_msg
-        if evt.reason == speechsdk.CancellationReason.Error:
-            error_msg = f"Error: {evt.error_details}"
-        done = True
-
-    # Conectar callbacks
-    conversation_transcriber.transcribed.connect(transcribed_cb)
-    conversation_transcriber.session_stopped.connect(session_stopped_cb)
-    conversation_transcriber.canceled.connect(canceled_cb)
-
-    # Iniciar transcripción
-    conversation_transcriber.start_transcribing_async()
-    
-    # Esperar hasta que termine
-    while not done:
-        time.sleep(0.5)
-    
-    conversation_transcriber.stop_transcribing_async()
-    
-    if error_msg:
-        st.error(f"❌ {error_msg}")
-    
-    _progress_bar.progress(1.0)
-    return transcripcion_completa
 
 # ==============================
-# CONVERSIÓN MP3 → WAV SIN FFMPEG
+# VISTA EN VIVO DURANTE LA TRANSCRIPCIÓN
 # ==============================
-@st.cache_data(ttl=600)
-def convertir_a_wav_si_es_necesario(uploaded_file):
-    """Convierte MP3 o WAV subido a WAV PCM 16 kHz mono, sin ffmpeg ni audioread"""
-    temp_input = tempfile.NamedTemporaryFile(delete=False, suffix=f"_{uploaded_file.name}")
-    temp_input.write(uploaded_file.read())
-    temp_input.flush()
-
-    temp_wav = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
+SEGMENTOS_EN_VIVO = 8  # Últimos segmentos mostrados mientras se transcribe
 
-    if uploaded_file.name.lower().endswith(".mp3"):
-        st.info("🎧 Convirtiendo MP3 a WAV PCM (16 kHz mono)...")
 
-        try:
-            data, sr = sf.read(temp_input.name)
-        except RuntimeError:
-            st.error("⚠️ Tu instalación de soundfile/libsndfile no soporta MP3. Instala 'ffmpeg' o convierte el audio a WAV manualmente.")
-            st.stop()
+def subtitulos_parciales(segmentos, formato):
+    """Documento SRT/VTT con los segmentos reconocidos hasta ahora"""
+    return "".join(EXPORTADORES[formato][0](segmentos))
 
-        if data.ndim > 1:
-            data = data.mean(axis=1)
 
-        if sr != 16000:
-            num_samples = round(len(data) * 16000 / sr)
-            data = scipy.signal.resample(data, num_samples)
-            sr = 16000
+def mostrar_en_vivo(trabajo):
+    """Segmentos reconocidos hasta ahora, estadísticas por hablante y subtítulos parciales"""
+    parametros = trabajo["parametros"]
+    en_vivo = obtener_en_vivo(
+        clave_transcripcion(parametros["huella"], parametros["idioma"], parametros["max_hablantes"])
+    )
+    if en_vivo is None:
+        return  # El trabajo se ejecuta en otro proceso o todavía no ha empezado a transcribir
+    vista = st.session_state.en_vivo
+    if vista['trabajo'] != trabajo["id"]:
+        vista.update(trabajo=trabajo["id"], segmentos=[], indice=None)
+    nuevos, estadisticas = en_vivo.desde(len(vista['segmentos']))
+    vista['segmentos'].extend(nuevos)
+    segmentos = vista['segmentos']
+    if not segmentos:
+        return
+    vista['indice'] = indexar_transcripcion(segmentos, vista['indice'])
+    colores = vista['indice']['colores']
+
+    with st.expander(f"🔴 En vivo: {len(segmentos)} segmento(s) reconocido(s)", expanded=True):
+        st.markdown("\n\n".join(
+            f"{colores[item['speaker']]} **Hablante {item['speaker']}** [{item['offset']:.2f}s]  \n{item['text']}"
+            for item in segmentos[-SEGMENTOS_EN_VIVO:]
+        ))
+        mostrar_estadisticas_hablantes(estadisticas)
+        copia = list(segmentos)  # Lo reconocido al pintar, aunque sigan llegando segmentos
+        for col, formato in zip(st.columns(2), ("SRT", "VTT")):
+            extension, mime = info_formato(formato)
+            with col:
+                st.download_button(
+                    label=f"⬇️ {formato} parcial", data=functools.partial(subtitulos_parciales, copia, formato),
+                    file_name=f"transcripcion_parcial{extension}", mime=mime, key=f"parcial_{formato}",
+                )
 
-        sf.write(temp_wav.name, data, sr, subtype='PCM_16')
+# ==============================
+# MARCAS DE TIEMPO POR PALABRA
+# ==============================
+@st.cache_resource(max_entries=8)
+def obtener_palabras(clave):
+    """Almacén de palabras de una transcripción en caché (compartido entre sesiones, solo lectura)"""
+    return cargar_palabras(clave) if clave else None
+
+
+@st.cache_resource(max_entries=8)
+def subtitulos_por_palabra(clave):
+    """Segmentos de subtítulo recortados con los tiempos exactos de cada palabra"""
+    return obtener_palabras(clave).resegmentar()
+
+
+def mostrar_busqueda_tiempo(palabras, duracion):
+    """Muestra la palabra dicha en un instante y el texto de alrededor"""
+    with st.expander("🔎 ¿Qué se dijo en…?"):
+        segundos = st.number_input("Instante (s):", min_value=0.0, max_value=max(float(duracion), 0.0),
+                                   value=0.0, step=1.0)
+        fila = palabras.en_tiempo(segundos)
+        if fila is not None:
+            st.markdown(f"**{fila['palabra']}** — Hablante {fila['speaker']} "
+                        f"[{fila['offset']:.2f}s - {fila['offset'] + fila['duration']:.2f}s]")
+        else:
+            st.caption("Silencio en ese instante")
+        contexto = palabras.entre(max(segundos - 5, 0.0), segundos + 5)
+        if contexto:
+            st.text(contexto)
 
-    else:
-        with open(temp_input.name, "rb") as src, open(temp_wav.name, "wb") as dst:
-            dst.write(src.read())
+# ==============================
+# BÚSQUEDA EN LA BIBLIOTECA DE EPISODIOS
+# ==============================
+def abrir_resultado(resultado):
+    """Carga el episodio de un resultado de búsqueda y sitúa la vista en su instante"""
+    segmentos = obtener_biblioteca().segmentos(resultado['clave'])
+    if not segmentos:
+        return
+    st.session_state.resultado = segmentos
+    st.session_state.indice = None
+    st.session_state.resumen = None
+    st.session_state.clave_resultado = resultado['clave']
+    st.session_state.trabajo_origen = None
+    st.session_state.salto = resultado
+
+
+def mostrar_busqueda_biblioteca():
+    """Buscador de texto completo sobre todos los episodios transcritos"""
+    with st.expander("🔎 Buscar en episodios anteriores"):
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            consulta = st.text_input("Buscar:", placeholder="palabras a buscar (pal* para prefijos)")
+        with col2:
+            hablante = st.text_input("Hablante:", placeholder="p. ej. Guest-1")
+        if not consulta:
+            st.caption(f"📚 {len(obtener_biblioteca().episodios())} episodio(s) indexado(s)")
+            return
+        resultados = obtener_biblioteca().buscar(consulta, hablante=hablante or None)
+        st.caption(f"{len(resultados)} resultado(s)")
+        for i, resultado in enumerate(resultados):
+            col1, col2 = st.columns([5, 1])
+            with col1:
+                st.markdown(
+                    f"**{resultado['episodio']}** · Hablante {resultado['speaker']} "
+                    f"[{resultado['offset']:.2f}s]  \n{resultado['fragmento']}"
+                )
+            with col2:
+                st.button("▶️ Ir", key=f"ir_{i}", on_click=abrir_resultado, args=(resultado,))
 
-    return temp_wav.name
+# ==============================
+# PANEL DE DIAGNÓSTICO
+# ==============================
+def mostrar_metricas_trabajo(trabajo):
+    """Etapas, contadores y pico de memoria registrados para un trabajo de la cola"""
+    datos = trabajo.get("metricas")
+    if not datos:
+        st.caption("Sin métricas todavía")
+        return
+    st.caption(f"{datos['estado']} · {datos['segundos']:.1f} s · pico RSS {datos['pico_rss_mb']:.0f} MB")
+    st.dataframe(
+        [
+            {"etapa": e["etapa"], "segundos": round(e["segundos"], 3),
+             "× tiempo real": round(e["factor_tiempo_real"], 1) if "factor_tiempo_real" in e else None}
+            for e in datos["etapas"]
+        ],
+        hide_index=True, use_container_width=True,
+    )
+    for etapa in datos["etapas"]:
+        if etapa["etapa"] == "vad" and etapa.get("duracion_original"):
+            st.caption(f"✂️ Silencio recortado antes de transcribir: {etapa['segundos_recortados']:.0f} s de "
+                       f"{etapa['duracion_original']:.0f} s ({etapa['porcentaje_recortado']:.0f} %)")
+        if etapa["etapa"] == "firmas" and etapa.get("coincidencias"):
+            st.caption(f"♻️ Reutilizados {etapa['segundos_reutilizados']:.0f} s ya transcritos en otros episodios "
+                       f"({etapa['segmentos_reutilizados']} segmentos)")
+    if datos["contadores"]:
+        st.caption(" · ".join(f"{evento}: {n}" for evento, n in sorted(datos["contadores"].items())))
+
+
+def mostrar_diagnostico(cola):
+    """Panel lateral con las métricas de los últimos trabajos y del proceso"""
+    with st.expander("🩺 Diagnóstico"):
+        for tipo, trabajo_id in st.session_state.diagnostico.items():
+            trabajo = cola.metricas(trabajo_id)
+            if trabajo is not None:
+                st.markdown(f"**{tipo.capitalize()}** (trabajo {trabajo_id})")
+                mostrar_metricas_trabajo(trabajo)
+
+        proceso = resumen_proceso()
+        pendientes = cola.pendientes()
+        st.markdown("**Proceso**")
+        st.caption(f"RSS {proceso['rss_mb']:.0f} MB (pico {proceso['pico_rss_mb']:.0f} MB) · "
+                   f"cola: {pendientes.get(PENDIENTE, 0)} pendiente(s), {pendientes.get(EN_CURSO, 0)} en curso")
+        if proceso["etapas"]:
+            st.dataframe(
+                [{"etapa": etapa, "veces": d["cuenta"], "media (s)": round(d["media"], 3)}
+                 for etapa, d in sorted(proceso["etapas"].items())],
+                hide_index=True, use_container_width=True,
+            )
+        servicios = estado_limitadores()
+        if servicios:
+            st.markdown("**Servicios de Azure**")
+            st.dataframe(
+                [{"servicio": s["servicio"], "en cola": s["en_cola"], "en curso": s["en_curso"],
+                  "peticiones": s["atendidas"], "espera media (s)": round(s["espera_media"], 3),
+                  "espera máx. (s)": round(s["espera_maxima"], 3), "429": s["frenadas"]}
+                 for s in servicios],
+                hide_index=True, use_container_width=True,
+            )
+        if PUERTO_METRICAS:
+            st.caption(f"📈 Prometheus: `:{PUERTO_METRICAS}/metrics`")
 
 # ==============================
 # INTERFAZ STREAMLIT CON TABS
@@ -271,6 +369,8 @@ st.markdown("Sube un archivo de audio (MP3 o WAV) y obtén una transcripción co
 # Configuración en sidebar
 with st.sidebar:
     st.header("⚙️ Configuración")
+    if BACKEND == "local":
+        st.caption("🧪 Backend local simulado: no se llama a ningún servicio de Azure")
     max_speakers = st.slider("Máximo de hablantes a detectar:", 2, 10, 5)
     idioma = st.selectbox("Idioma:", [
         ("es-ES", "Español (España)"),
@@ -278,97 +378,196 @@ with st.sidebar:
         ("en-US", "Inglés (EE.UU.)"),
         ("en-GB", "Inglés (Reino Unido)"),
     ], format_func=lambda x: x[1])
+    paralelo = st.checkbox(
+        "Transcripción paralela por fragmentos",
+        help="Divide el audio en fragmentos solapados cortados en silencios y los transcribe a la vez. "
+             "Recomendado para episodios largos."
+    )
+    max_workers = st.slider("Fragmentos simultáneos:", 2, 8, 4, disabled=not paralelo)
 
 audio_file = st.file_uploader("🎵 Sube tu archivo de audio:", type=["wav", "mp3"])
+mostrar_busqueda_biblioteca()
 
 # Inicializar session_state para mantener los resultados
 if 'resultado' not in st.session_state:
     st.session_state.resultado = None
 if 'resumen' not in st.session_state:
     st.session_state.resumen = None
+if 'indice' not in st.session_state:
+    st.session_state.indice = None
+if 'clave_resultado' not in st.session_state:
+    st.session_state.clave_resultado = None
+if 'huellas' not in st.session_state:
+    st.session_state.huellas = {}
+if 'trabajo_resumen' not in st.session_state:
+    st.session_state.trabajo_resumen = None
+if 'trabajo_transcripcion' not in st.session_state:
+    # El id del trabajo viaja en la URL para recuperarlo tras recargar el navegador
+    trabajo_url = st.query_params.get("trabajo")
+    st.session_state.trabajo_transcripcion = int(trabajo_url) if trabajo_url and trabajo_url.isdigit() else None
+    st.session_state.trabajo_origen = None
+if 'salto' not in st.session_state:
+    st.session_state.salto = None
+if 'en_vivo' not in st.session_state:
+    # Segmentos ya recogidos de la transcripción en curso y su índice incremental
+    st.session_state.en_vivo = {'trabajo': None, 'segmentos': [], 'indice': None}
+if 'diagnostico' not in st.session_state:
+    # Últimos trabajos enviados por tipo, para el panel de diagnóstico
+    st.session_state.diagnostico = {}
+
+cola = obtener_cola()
 
 if audio_file is not None:
     st.audio(audio_file)
-    wav_path = convertir_a_wav_si_es_necesario(audio_file)
 
-    st.success("✅ Archivo convertido correctamente.")
+    # Hash del contenido calculado una sola vez por archivo subido
+    if audio_file.file_id not in st.session_state.huellas:
+        st.session_state.huellas[audio_file.file_id] = huella_bytes(audio_file.getbuffer())
+    huella = st.session_state.huellas[audio_file.file_id]
 
+if audio_file is not None or st.session_state.trabajo_transcripcion is not None or st.session_state.resultado:
     tab_transcribir, tab_resumen, tab_exportar = st.tabs(["📝 Transcribir", "📊 Resumen", "💾 Exportar"])
 
     with tab_transcribir:
-        if st.button("🎙️ Iniciar Transcripción con Diarización", type="primary"):
-            with st.spinner("Transcribiendo audio con identificación de hablantes... esto puede tardar ⏳"):
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                st.session_state.resultado = transcribir_audio_con_diarizacion(wav_path, progress_bar, status_text)
-                st.session_state.resumen = None  # Reset resumen al hacer nueva transcripción
-
-            if st.session_state.resultado:
-                st.markdown("### 📝 Transcripción con Hablantes Identificados")
-                
-                # Agrupar por hablante para mostrar estadísticas
-                hablantes = {}
-                for item in st.session_state.resultado:
-                    speaker = item['speaker']
-                    if speaker not in hablantes:
-                        hablantes[speaker] = []
-                    hablantes[speaker].append(item)
-                
-                # Mostrar resumen
-                st.info(f"🎭 **Hablantes detectados:** {len(hablantes)}")
-                
-                # Mostrar transcripción
-                for item in st.session_state.resultado:
-                    speaker_color = ["🔵", "🟢", "🟠", "🟣", "🟡", "🔴"][hash(item['speaker']) % 6]
-                    st.write(
-                        f"{speaker_color} **Hablante {item['speaker']}** "
-                        f"[{item['offset']:.2f}s - {item['offset'] + item['duration']:.2f}s]"
-                    )
-                    st.write(f"   {item['text']}")
-                    st.divider()
-            else:
+        if st.button("🎙️ Iniciar Transcripción con Diarización", type="primary", disabled=audio_file is None):
+            inicio = time.perf_counter()
+            ruta = guardar_subida(audio_file, huella)
+            trabajo_id = cola.enviar("transcripcion", {
+                "ruta": ruta,
+                "tiempo_subida": time.perf_counter() - inicio,
+                "bytes_subida": audio_file.size,
+                "huella": huella,
+                "nombre": audio_file.name,
+                "idioma": idioma[0],
+                "max_hablantes": max_speakers,
+                "paralelo": paralelo,
+                "max_workers": max_workers,
+            })
+            st.session_state.trabajo_transcripcion = trabajo_id
+            st.session_state.diagnostico["transcripcion"] = trabajo_id
+            st.query_params["trabajo"] = str(trabajo_id)
+            st.session_state.resultado = None
+            st.session_state.indice = None
+            st.session_state.resumen = None  # Reset resumen al hacer nueva transcripción
+            st.session_state.salto = None
+
+        @st.fragment(run_every=1.0 if st.session_state.trabajo_transcripcion is not None else None)
+        def seguimiento_transcripcion():
+            """Consulta el trabajo de transcripción sin bloquear la interfaz"""
+            trabajo_id = st.session_state.trabajo_transcripcion
+            if trabajo_id is None:
+                return
+            trabajo = cola.estado(trabajo_id)
+            if trabajo is None:
+                st.session_state.trabajo_transcripcion = None
+                return
+            if trabajo["estado"] in (PENDIENTE, EN_CURSO):
+                mostrar_estado_trabajo(trabajo)
+                if trabajo["estado"] == EN_CURSO:
+                    mostrar_en_vivo(trabajo)
+                return
+
+            st.session_state.trabajo_transcripcion = None
+            if trabajo["estado"] == FALLIDO:
+                st.error(f"❌ {trabajo['error']}")
+                return
+            parametros = trabajo["parametros"]
+            st.session_state.resultado = trabajo["resultado"]
+            st.session_state.indice = None
+            # Si lo visto en vivo es el principio del resultado, su índice solo necesita completarse
+            vista = st.session_state.en_vivo
+            st.session_state.indice_en_vivo = (
+                vista['indice'] if vista['trabajo'] == trabajo_id and trabajo["resultado"]
+                and vista['segmentos'] == trabajo["resultado"][:len(vista['segmentos'])] else None
+            )
+            vista.update(trabajo=None, segmentos=[], indice=None)
+            st.session_state.clave_resultado = clave_transcripcion(
+                parametros["huella"], parametros["idioma"], parametros["max_hablantes"]
+            )
+            st.session_state.trabajo_origen = trabajo_id
+            st.session_state.salto = None
+            if not trabajo["resultado"]:
                 st.error("No se obtuvo ninguna transcripción.")
-        
+                return
+            st.rerun(scope="app")
+
+        seguimiento_transcripcion()
+
         # Mostrar transcripción si ya existe en session_state
-        elif st.session_state.resultado:
-            st.markdown("### 📝 Transcripción con Hablantes Identificados")
-            
-            # Agrupar por hablante para mostrar estadísticas
-            hablantes = {}
-            for item in st.session_state.resultado:
-                speaker = item['speaker']
-                if speaker not in hablantes:
-                    hablantes[speaker] = []
-                hablantes[speaker].append(item)
-            
-            # Mostrar resumen
-            st.info(f"🎭 **Hablantes detectados:** {len(hablantes)}")
-            
-            # Mostrar transcripción
-            for item in st.session_state.resultado:
-                speaker_color = ["🔵", "🟢", "🟠", "🟣", "🟡", "🔴"][hash(item['speaker']) % 6]
-                st.write(
-                    f"{speaker_color} **Hablante {item['speaker']}** "
-                    f"[{item['offset']:.2f}s - {item['offset'] + item['duration']:.2f}s]"
+        if st.session_state.resultado:
+            if st.session_state.indice is None:
+                st.session_state.indice = indexar_transcripcion(
+                    st.session_state.resultado, st.session_state.pop("indice_en_vivo", None)
+                )
+                st.session_state.estadisticas = estadisticas_hablantes(st.session_state.resultado)
+                # Nueva transcripción: tramo completo, o desde el instante de un resultado de búsqueda
+                salto = st.session_state.salto or {'offset': 0.0}
+                st.session_state.tramo = (
+                    float(int(salto['offset'])), max(float(st.session_state.indice['duracion']), 1.0)
                 )
-                st.write(f"   {item['text']}")
-                st.divider()
+            salto = st.session_state.salto
+            if salto and salto['ruta'] and os.path.exists(salto['ruta']):
+                st.audio(salto['ruta'], start_time=int(salto['offset']))
+            mostrar_transcripcion(st.session_state.resultado, st.session_state.indice)
+            with st.expander("📈 Estadísticas por hablante"):
+                mostrar_estadisticas_hablantes(st.session_state.estadisticas)
+            palabras = obtener_palabras(st.session_state.clave_resultado)
+            if palabras:
+                mostrar_busqueda_tiempo(palabras, st.session_state.indice['duracion'])
 
     with tab_resumen:
         if st.session_state.resultado:
             st.markdown("### 📊 Resumen de la Conversación")
-            
+            col_motor, col_oraciones = st.columns(2)
+            with col_motor:
+                motor_resumen = st.radio("Motor de resumen", list(MOTORES_RESUMEN), format_func=MOTORES_RESUMEN.get,
+                                         help="El motor local elige las oraciones más representativas sin "
+                                              "llamar a Azure y responde al instante")
+            with col_oraciones:
+                oraciones = st.slider("Oraciones del resumen", 1, 20, ORACIONES_RESUMEN)
+
             if st.button("📝 Generar Resumen", type="primary"):
-                with st.spinner("Generando resumen con Azure Language Service..."):
-                    # Obtener texto completo de la transcripción
-                    texto_completo = " ".join([item['text'] for item in st.session_state.resultado])
-                    
-                    # Generar resumen extractivo
-                    st.session_state.resumen = generar_resumen(texto_completo, tipo="extractive")
-                    
-                    if st.session_state.resumen:
-                        st.success("✅ Resumen generado correctamente")
-            
+                if motor_resumen == "local":
+                    # Milisegundos incluso para horas de audio: no merece la pena pasar por la cola
+                    try:
+                        st.session_state.resumen = resumir_transcripcion(
+                            st.session_state.resultado, motor_resumen="local", oraciones=oraciones)
+                    except ErrorResumen as e:
+                        st.error(str(e))
+                        st.session_state.resumen = None
+                else:
+                    # Resumen extractivo (jerárquico si la transcripción es larga) en la cola de trabajos
+                    origen = (
+                        {"trabajo": st.session_state.trabajo_origen} if st.session_state.trabajo_origen is not None
+                        else {"clave": st.session_state.clave_resultado}
+                    )
+                    st.session_state.trabajo_resumen = cola.enviar(
+                        "resumen", {**origen, "tipo": "extractive", "motor": motor_resumen, "oraciones": oraciones})
+                    st.session_state.diagnostico["resumen"] = st.session_state.trabajo_resumen
+                    st.session_state.resumen = None
+
+            @st.fragment(run_every=0.5 if st.session_state.trabajo_resumen is not None else None)
+            def seguimiento_resumen():
+                """Consulta el trabajo en curso sin bloquear el resto de la interfaz"""
+                trabajo_id = st.session_state.trabajo_resumen
+                if trabajo_id is None:
+                    return
+                trabajo = cola.estado(trabajo_id)
+                if trabajo is None:
+                    st.session_state.trabajo_resumen = None
+                    return
+                if trabajo["estado"] in (PENDIENTE, EN_CURSO):
+                    mostrar_estado_trabajo(trabajo)
+                    return
+                st.session_state.trabajo_resumen = None
+                if trabajo["estado"] == FALLIDO:
+                    st.error(trabajo["error"])
+                    return
+                st.session_state.resumen = trabajo["resultado"]
+                st.rerun(scope="app")
+
+            seguimiento_resumen()
+
             # Mostrar resumen si existe
             if st.session_state.resumen:
                 st.markdown("#### 📄 Resumen:")
@@ -400,73 +599,45 @@ if audio_file is not None:
 
     with tab_exportar:
         if st.session_state.resultado:
-            def formato_tiempo(segundos):
-                horas = int(segundos // 3600)
-                minutos = int((segundos % 3600) // 60)
-                segs = int(segundos % 60)
-                milis = int((segundos - int(segundos)) * 1000)
-                return f"{horas:02}:{minutos:02}:{segs:02},{milis:03}"
-
-            def generar_srt(transcripcion):
-                srt_lines = []
-                for i, item in enumerate(transcripcion, start=1):
-                    start = formato_tiempo(item['offset'])
-                    end = formato_tiempo(item['offset'] + item['duration'])
-                    speaker = f"Hablante {item['speaker']}"
-                    srt_lines.append(f"{i}\n{start} --> {end}\n[{speaker}] {item['text']}\n")
-                return "\n".join(srt_lines)
-
-            def generar_vtt(transcripcion):
-                vtt_lines = ["WEBVTT\n"]
-                for item in transcripcion:
-                    start = formato_tiempo(item['offset']).replace(",", ".")
-                    end = formato_tiempo(item['offset'] + item['duration']).replace(",", ".")
-                    speaker = f"Hablante {item['speaker']}"
-                    vtt_lines.append(f"{start} --> {end}\n<v {speaker}>{item['text']}\n")
-                return "\n".join(vtt_lines)
-            
-            def generar_txt(transcripcion):
-                txt_lines = []
-                for item in transcripcion:
-                    tiempo = formato_tiempo(item['offset'])
-                    speaker = f"Hablante {item['speaker']}"
-                    txt_lines.append(f"[{tiempo}] {speaker}: {item['text']}")
-                return "\n\n".join(txt_lines)
-
-            formato = st.selectbox("Elige formato de exportación:", ["SRT", "VTT", "TXT"])
+            formato = st.selectbox("Elige formato de exportación:", FORMATOS_EXPORTACION)
+            extension, mime = info_formato(formato)
+            nombre = f"transcripcion_diarizacion{extension}"
+            transcripcion = st.session_state.resultado
+            clave = st.session_state.clave_resultado
+            if obtener_palabras(clave) and st.checkbox(
+                "Subtítulos ajustados por palabra",
+                help="Corta los subtítulos en los límites exactos de cada palabra: "
+                     "líneas más cortas y sincronizadas que los segmentos del reconocimiento."
+            ):
+                transcripcion = subtitulos_por_palabra(clave)
+                clave = f"{clave}|palabras"
             
             col1, col2 = st.columns(2)
             
             with col1:
-                if st.button("📥 Exportar", type="primary"):
-                    if formato == "SRT":
-                        contenido = generar_srt(st.session_state.resultado)
-                        nombre = "transcripcion_diarizacion.srt"
-                        mime = "text/plain"
-                    elif formato == "VTT":
-                        contenido = generar_vtt(st.session_state.resultado)
-                        nombre = "transcripcion_diarizacion.vtt"
-                        mime = "text/vtt"
-                    else:
-                        contenido = generar_txt(st.session_state.resultado)
-                        nombre = "transcripcion_diarizacion.txt"
-                        mime = "text/plain"
-
-                    st.download_button(
-                        label=f"⬇️ Descargar {nombre}",
-                        data=contenido,
-                        file_name=nombre,
-                        mime=mime
-                    )
+                # El documento solo se genera al pulsar (en otro hilo) y queda en la caché por transcripción.
+                # Streamlit no sirve descargas en streaming: lo que devuelva el callback (bytes o un archivo
+                # abierto, que lee entero) lo guarda en memoria hasta el siguiente rerun. Se lee una sola vez
+                # y sin copias intermedias; la exportación por trozos sin tope de memoria es la de lote.py.
+                def descargar():
+                    clave_contenido = clave or huella_bytes(json.dumps(transcripcion).encode())
+                    with open(exportar_a_cache(transcripcion, clave_contenido, formato), "rb") as f:
+                        return f.read()
+
+                st.download_button(
+                    label=f"⬇️ Descargar {nombre}",
+                    data=descargar,
+                    file_name=nombre,
+                    mime=mime,
+                    type="primary"
+                )
             
             with col2:
-                # Vista previa
+                # Vista previa: solo se generan los primeros elementos del documento
                 with st.expander("👁️ Vista previa"):
-                    if formato == "SRT":
-                        st.text(generar_srt(st.session_state.resultado)[:500] + "...")
-                    elif formato == "VTT":
-                        st.text(generar_vtt(st.session_state.resultado)[:500] + "...")
-                    else:
-                        st.text(generar_txt(st.session_state.resultado)[:500] + "...")
+                    st.text(vista_previa(transcripcion, formato) + "...")
         else:
-            st.info("Primero realiza la transcripción para poder exportar.")
\ No newline at end of file
+            st.info("Primero realiza la transcripción para poder exportar.")
+
+with st.sidebar:
+    mostrar_diagnostico(cola)
@@ -0,0 +1,303 @@
+"""Instrumentación por etapa: tiempos, contadores y memoria, por trabajo y por proceso.
+
+Cada etapa del pipeline (lectura de la subida, decodificación, remuestreo,
+escritura del WAV, transcripción, resumen, exportación) se registra con
+`etapa()`/`registrar()` y los eventos sueltos con `contar()`. Los datos van a:
+
+- el registro del trabajo en curso (ver `trabajo()`), que la cola guarda junto
+  al resultado y la app muestra en el panel de diagnóstico;
+- una línea JSON por evento en el logger "prollecto.metricas";
+- los agregados del proceso, expuestos en formato de texto de Prometheus
+  (`texto_prometheus()` o el servidor de `iniciar_servidor_prometheus()`).
+"""
+import bisect
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+METRICAS_LOG = os.getenv("METRICAS_LOG", "1") != "0"
+METRICAS_PUERTO = int(os.getenv("METRICAS_PUERTO") or 0)  # 0: sin endpoint de Prometheus
+LIMITES_HISTOGRAMA = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+logger = logging.getLogger("prollecto.metricas")
+if METRICAS_LOG and not logger.handlers:
+    _manejador = logging.StreamHandler()
+    _manejador.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_manejador)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def memoria_rss():
+    """Memoria residente actual del proceso en bytes (0 si no se puede leer)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return memoria_pico()
+
+
+def memoria_pico():
+    """Pico de memoria residente del proceso en bytes"""
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # ru_maxrss viene en KiB en Linux
+
+
+def _log(evento, **campos):
+    if METRICAS_LOG:
+        logger.info(json.dumps({"ts": round(time.time(), 3), "evento": evento, **campos},
+                               ensure_ascii=False, default=str))
+
+
+# ==============================
+# REGISTRO POR TRABAJO
+# ==============================
+class RegistroTrabajo:
+    """Etapas, contadores y pico de memoria de un trabajo (seguro entre hilos)"""
+
+    def __init__(self, trabajo=None, tipo=None):
+        self.trabajo = trabajo
+        self.tipo = tipo
+        self.estado = None
+        self.inicio = time.time()
+        self.etapas = []
+        self.contadores = {}
+        self.pico_rss = memoria_rss()
+        self._lock = threading.Lock()
+
+    def agregar_etapa(self, etapa, segundos, rss, extra):
+        with self._lock:
+            self.etapas.append({"etapa": etapa, "segundos": segundos, "rss_mb": rss / 2**20, **extra})
+            self.pico_rss = max(self.pico_rss, rss)
+
+    def contar(self, evento, n):
+        with self._lock:
+            self.contadores[evento] = self.contadores.get(evento, 0) + n
+
+    def como_dict(self):
+        with self._lock:
+            return {
+                "trabajo": self.trabajo,
+                "tipo": self.tipo,
+                "estado": self.estado,
+                "segundos": time.time() - self.inicio,
+                "pico_rss_mb": self.pico_rss / 2**20,
+                "etapas": list(self.etapas),
+                "contadores": dict(self.contadores),
+            }
+
+
+_registro_actual = contextvars.ContextVar("registro_metricas", default=None)
+
+
+@contextlib.contextmanager
+def trabajo(trabajo_id=None, tipo=None):
+    """Activa un RegistroTrabajo para todo lo que se ejecute dentro (en este hilo o vía en_contexto)"""
+    registro = RegistroTrabajo(trabajo_id, tipo)
+    token = _registro_actual.set(registro)
+    try:
+        yield registro
+    finally:
+        _registro_actual.reset(token)
+        datos = registro.como_dict()
+        _agregados.trabajo(tipo, registro.estado, datos["segundos"])
+        _log("trabajo", **datos)
+
+
+def trabajo_actual():
+    """RegistroTrabajo activo en este contexto, o None"""
+    return _registro_actual.get()
+
+
+def en_contexto(funcion):
+    """Envuelve `funcion` para ejecutarla en otro hilo con el registro actual (p. ej. pool.submit)"""
+    return functools.partial(contextvars.copy_context().run, funcion)
+
+
+def registrar(etapa, segundos, log=True, **extra):
+    """Registra la duración de una etapa en el trabajo actual y en los agregados del proceso"""
+    rss = memoria_rss()
+    registro = _registro_actual.get()
+    if registro is not None:
+        registro.agregar_etapa(etapa, segundos, rss, extra)
+    _agregados.etapa(etapa, segundos, extra)
+    if log:
+        _log("etapa", etapa=etapa, segundos=segundos, rss_mb=rss / 2**20,
+             trabajo=registro.trabajo if registro else None, **extra)
+
+
+@contextlib.contextmanager
+def etapa(nombre, **extra):
+    """Mide el bloque como una etapa; el dict devuelto admite datos extra (bytes, segundos de audio...)"""
+    inicio = time.perf_counter()
+    try:
+        yield extra
+    finally:
+        registrar(nombre, time.perf_counter() - inicio, **extra)
+
+
+def contar(evento, n=1):
+    """Suma `n` a un contador del trabajo actual y del proceso"""
+    registro = _registro_actual.get()
+    if registro is not None:
+        registro.contar(evento, n)
+    _agregados.contar(evento, n)
+
+
+# ==============================
+# AGREGADOS DEL PROCESO Y PROMETHEUS
+# ==============================
+class _Agregados:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.etapas = {}  # etapa -> [cubetas..., +Inf], suma, cuenta
+        self.eventos = {}
+        self.trabajos = {}
+        self.factor_tiempo_real = {}
+        self.indicadores = {}
+
+    def etapa(self, etapa, segundos, extra):
+        with self._lock:
+            cubetas, suma, cuenta = self.etapas.get(etapa) or ([0] * (len(LIMITES_HISTOGRAMA) + 1), 0.0, 0)
+            cubetas[bisect.bisect_left(LIMITES_HISTOGRAMA, segundos)] += 1
+            self.etapas[etapa] = (cubetas, suma + segundos, cuenta + 1)
+            if "factor_tiempo_real" in extra:
+                self.factor_tiempo_real[etapa] = extra["factor_tiempo_real"]
+
+    def contar(self, evento, n):
+        with self._lock:
+            self.eventos[evento] = self.eventos.get(evento, 0) + n
+
+    def trabajo(self, tipo, estado, segundos):
+        with self._lock:
+            clave = (tipo or "", estado or "")
+            cuenta, suma = self.trabajos.get(clave, (0, 0.0))
+            self.trabajos[clave] = (cuenta + 1, suma + segundos)
+
+    def resumen(self):
+        """Cuenta y media de cada etapa, para mostrar en la interfaz"""
+        with self._lock:
+            return {
+                etapa: {"cuenta": cuenta, "media": suma / cuenta if cuenta else 0.0}
+                for etapa, (_, suma, cuenta) in self.etapas.items()
+            }
+
+
+_agregados = _Agregados()
+
+
+def resumen_proceso():
+    """Agregados del proceso: etapas (cuenta y media), contadores y memoria"""
+    with _agregados._lock:
+        eventos = dict(_agregados.eventos)
+    rss = memoria_rss()
+    return {
+        "etapas": _agregados.resumen(),
+        "contadores": eventos,
+        "rss_mb": rss / 2**20,
+        "pico_rss_mb": max(memoria_pico(), rss) / 2**20,
+    }
+
+
+def registrar_indicador(nombre, ayuda, funcion):
+    """Añade un gauge calculado al exportarse (p. ej. trabajos pendientes en la cola)"""
+    with _agregados._lock:
+        _agregados.indicadores[nombre] = (ayuda, funcion)
+
+
+def _etiqueta(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def texto_prometheus():
+    """Agregados del proceso en el formato de exposición de texto de Prometheus"""
+    with _agregados._lock:
+        etapas = {etapa: (list(c), s, n) for etapa, (c, s, n) in _agregados.etapas.items()}
+        eventos = dict(_agregados.eventos)
+        trabajos = dict(_agregados.trabajos)
+        factores = dict(_agregados.factor_tiempo_real)
+        indicadores = dict(_agregados.indicadores)
+
+    lineas = [
+        "# HELP prollecto_etapa_segundos Duración de cada etapa del pipeline",
+        "# TYPE prollecto_etapa_segundos histogram",
+    ]
+    for etapa, (cubetas, suma, cuenta) in sorted(etapas.items()):
+        acumulado = 0
+        for limite, n in zip((*LIMITES_HISTOGRAMA, "+Inf"), cubetas):
+            acumulado += n
+            lineas.append(f'prollecto_etapa_segundos_bucket{{etapa="{_etiqueta(etapa)}",le="{limite}"}} {acumulado}')
+        lineas.append(f'prollecto_etapa_segundos_sum{{etapa="{_etiqueta(etapa)}"}} {suma}')
+        lineas.append(f'prollecto_etapa_segundos_count{{etapa="{_etiqueta(etapa)}"}} {cuenta}')
+
+    lineas += ["# HELP prollecto_eventos_total Eventos contados (envíos, consultas, reintentos...)",
+               "# TYPE prollecto_eventos_total counter"]
+    lineas += [f'prollecto_eventos_total{{evento="{_etiqueta(e)}"}} {n}' for e, n in sorted(eventos.items())]
+
+    lineas += ["# HELP prollecto_trabajos_total Trabajos terminados por tipo y estado",
+               "# TYPE prollecto_trabajos_total counter"]
+    lineas += [f'prollecto_trabajos_total{{tipo="{_etiqueta(t)}",estado="{_etiqueta(e)}"}} {n}'
+               for (t, e), (n, _) in sorted(trabajos.items())]
+
+    lineas += ["# HELP prollecto_factor_tiempo_real Último factor de tiempo real por etapa",
+               "# TYPE prollecto_factor_tiempo_real gauge"]
+    lineas += [f'prollecto_factor_tiempo_real{{etapa="{_etiqueta(e)}"}} {f}' for e, f in sorted(factores.items())]
+
+    rss = memoria_rss()
+    lineas += ["# HELP prollecto_memoria_rss_bytes Memoria residente actual del proceso",
+               "# TYPE prollecto_memoria_rss_bytes gauge",
+               f"prollecto_memoria_rss_bytes {rss}",
+               "# HELP prollecto_memoria_pico_bytes Pico de memoria residente del proceso",
+               "# TYPE prollecto_memoria_pico_bytes gauge",
+               f"prollecto_memoria_pico_bytes {max(memoria_pico(), rss)}"]
+
+    for nombre, (ayuda, funcion) in sorted(indicadores.items()):
+        try:
+            valor = funcion()
+        except Exception:
+            continue
+        lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} gauge", f"{nombre} {valor}"]
+    return "\n".join(lineas) + "\n"
+
+
+class _ManejadorPrometheus(BaseHTTPRequestHandler):
+    def log_message(self, formato, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        cuerpo = texto_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+
+_servidor = None
+_servidor_lock = threading.Lock()
+
+
+def iniciar_servidor_prometheus(puerto=METRICAS_PUERTO):
+    """Sirve /metrics en `puerto` desde un hilo (una sola vez por proceso); devuelve el puerto o None"""
+    global _servidor
+    with _servidor_lock:
+        if _servidor is None and puerto:
+            _servidor = ThreadingHTTPServer(("0.0.0.0", puerto), _ManejadorPrometheus)
+            _servidor.daemon_threads = True
+            threading.Thread(target=_servidor.serve_forever, name="metricas-prometheus", daemon=True).start()
+        return _servidor.server_port if _servidor is not None else None
@@ -0,0 +1,1551 @@
+"""Motor de procesamiento de podcasts: conversión, transcripción con diarización,
+resumen y exportación. No depende de Streamlit; lo usan main.py y lote.py.
+"""
+import os
+import contextlib
+import math
+import tempfile
+import time
+import functools
+import itertools
+import hashlib
+import importlib
+import importlib.util
+import json
+import shutil
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import firmas
+import metricas
+from limitador import obtener_limitador
+import vad
+from palabras import ConstructorPalabras, TranscripcionPalabras
+from puntos_control import ConstructorRegistrado, PuntoControl
+from resumen_local import resumir_local
+from simulado import TranscriptorSimulado, obtener_servidor
+
+# Exportación a Parquet/Arrow opcional; pyarrow solo se importa al exportar
+PYARROW_DISPONIBLE = importlib.util.find_spec("pyarrow") is not None
+
+# ==============================
+# CONFIGURACIÓN AZURE
+# ==============================
+SPEECH_KEY = os.getenv("SPEECH_KEY")
+REGION = os.getenv("SPEECH_REGION")
+LANGUAGE_KEY = os.getenv("LANGUAGE_KEY")
+LANGUAGE_ENDPOINT = os.getenv("LANGUAGE_ENDPOINT")
+
+# "azure" o "local": servicios simulados en este proceso (ver simulado.py), sin claves ni red
+BACKEND = os.getenv("BACKEND", "azure")
+_transcriptor_simulado = None
+
+
+def configurar(speech_key=None, region=None, language_key=None, language_endpoint=None, backend=None,
+               transcriptor=None):
+    """Sobrescribe las credenciales leídas del entorno (p. ej. con st.secrets) y aplica el backend.
+
+    Con el backend "local", las sesiones de Speech las atiende `transcriptor`
+    (por defecto un TranscriptorSimulado) y Language apunta al servidor simulado.
+    """
+    global SPEECH_KEY, REGION, LANGUAGE_KEY, LANGUAGE_ENDPOINT, BACKEND, _transcriptor_simulado
+    SPEECH_KEY = speech_key or SPEECH_KEY
+    REGION = region or REGION
+    LANGUAGE_KEY = language_key or LANGUAGE_KEY
+    LANGUAGE_ENDPOINT = language_endpoint or LANGUAGE_ENDPOINT
+    BACKEND = backend or BACKEND
+    if BACKEND == "local":
+        SPEECH_KEY = REGION = LANGUAGE_KEY = "local"
+        LANGUAGE_ENDPOINT = obtener_servidor().url
+        _transcriptor_simulado = transcriptor or _transcriptor_simulado or TranscriptorSimulado()
+    else:
+        _transcriptor_simulado = None
+
+# ==============================
+# ARRANQUE Y PRECALENTAMIENTO
+# ==============================
+# El Speech SDK, scipy (firmas, resumen local), soundfile, requests y pyarrow se
+# importan dentro de las funciones que los usan: ver, exportar o buscar no esperan
+# a cargarlos. Solo numpy se importa al cargar el módulo (palabras.py y en_vivo.py
+# lo usan en la propia vista). Con PRECALENTAR=1 la app los carga en segundo plano
+# al arrancar, para que tampoco espere la primera transcripción.
+PRECALENTAR = os.getenv("PRECALENTAR", "0") != "0"
+
+
+def precalentar():
+    """Importa las dependencias diferidas y abre la caché y la sesión HTTP"""
+    with metricas.etapa("precalentamiento"):
+        try:
+            obtener_speechsdk()
+        except ImportError:
+            pass  # Sin el SDK se puede usar igualmente el backend local
+        for modulo in ("soundfile", "scipy.fft", "scipy.ndimage", "scipy.sparse"):  # También firmas.py y resumen_local.py
+            importlib.import_module(modulo)
+        if PYARROW_DISPONIBLE:
+            importlib.import_module("pyarrow.parquet")
+        obtener_cache()
+        obtener_sesion_http()
+
+
+@functools.lru_cache(maxsize=None)
+def precalentar_en_segundo_plano():
+    """Lanza precalentar() en un hilo, una sola vez por proceso (Streamlit reejecuta el script en cada interacción)"""
+    hilo = threading.Thread(target=precalentar, name="precalentamiento", daemon=True)
+    hilo.start()
+    return hilo
+
+# ==============================
+# CACHÉ PERSISTENTE EN DISCO
+# ==============================
+CACHE_DIR = os.getenv("CACHE_DIR") or os.path.join(tempfile.gettempdir(), "prollecto_cache")
+CACHE_MAX_MB = int(os.getenv("CACHE_MAX_MB", "2048"))
+EDAD_MAXIMA_TEMPORAL = 3600  # Segundos sin tocar tras los que un .tmp se da por abandonado (proceso muerto)
+EDAD_MAXIMA_RETENCION = 24 * 3600  # Una retención que nadie suelta en un día es de un proceso muerto
+
+
+class CacheDisco:
+    """Caché en disco direccionada por contenido, con expulsión LRU limitada por tamaño.
+
+    Cada entrada es un archivo `<clave><extension>`; la fecha de modificación
+    marca el último uso, así que el orden LRU sobrevive a reinicios del proceso.
+    Las entradas retenidas por un trabajo en curso (ver retener) no se expulsan
+    hasta que ese trabajo las suelta, y los temporales que dejó un proceso
+    muerto se borran al cabo de EDAD_MAXIMA_TEMPORAL.
+
+    Cada retención es un archivo `<entrada>.<id>` en el subdirectorio
+    `.retenidas`, así que la respetan todos los procesos que comparten la
+    caché (los workers de lote.py, varias réplicas de la app) y puede pasar de
+    un proceso a otro (ver retener_entrada).
+    """
+
+    def __init__(self, directorio, max_bytes):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.dir_retenidas = os.path.join(directorio, ".retenidas")
+        self._lock = threading.Lock()
+        os.makedirs(self.dir_retenidas, exist_ok=True)
+
+    @contextlib.contextmanager
+    def temporal(self, sufijo):
+        """Ruta de un archivo temporal en la caché, borrado al salir salvo que se haya guardado con guardar_archivo"""
+        # Sufijo .tmp: la expulsión LRU ignora los archivos que aún se están escribiendo
+        descriptor, ruta = tempfile.mkstemp(suffix=f"{sufijo}.tmp", dir=self.directorio)
+        os.close(descriptor)
+        try:
+            yield ruta
+        finally:
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+
+    def retener_entrada(self, ruta):
+        """Protege de la expulsión la entrada `ruta`, exista ya o no, hasta soltar(marca); devuelve la marca.
+
+        La marca es una ruta: otro proceso puede soltarla (p. ej. el que recibe
+        el WAV convertido por un worker). None si `ruta` no está en la caché.
+        """
+        directorio, nombre = os.path.split(os.path.abspath(ruta))
+        if directorio != os.path.abspath(self.directorio):
+            return None  # Fuera de la caché: nunca se expulsa
+        marca = os.path.join(self.dir_retenidas, f"{nombre}.{uuid.uuid4().hex}")
+        open(marca, "x").close()
+        return marca
+
+    def soltar(self, marca):
+        """Deshace una retención de retener_entrada (None no hace nada)"""
+        if marca is not None:
+            self._borrar(marca)
+            self._expulsar()
+
+    @contextlib.contextmanager
+    def retener(self, *rutas):
+        """Protege de la expulsión las entradas `rutas` (se ignoran los None) mientras dure el bloque"""
+        marcas = [self.retener_entrada(ruta) for ruta in rutas if ruta is not None]
+        try:
+            yield
+        finally:
+            for marca in filter(None, marcas):
+                self._borrar(marca)
+            self._expulsar()
+
+    def _retenidas(self):
+        """Nombres de las entradas retenidas por algún proceso; borra las retenciones abandonadas"""
+        retenidas = set()
+        limite = time.time() - EDAD_MAXIMA_RETENCION
+        try:
+            marcas = list(os.scandir(self.dir_retenidas))
+        except FileNotFoundError:
+            return retenidas
+        for marca in marcas:
+            try:
+                abandonada = marca.stat().st_mtime < limite
+            except FileNotFoundError:
+                continue  # Soltada mientras se listaba
+            if abandonada:
+                self._borrar(marca.path)
+            else:
+                retenidas.add(marca.name.rsplit(".", 1)[0])
+        return retenidas
+
+    def ruta(self, clave, extension):
+        return os.path.join(self.directorio, f"{clave}{extension}")
+
+    def obtener(self, clave, extension):
+        """Devuelve la ruta de la entrada si existe (y la marca como usada) o None"""
+        ruta = self.ruta(clave, extension)
+        try:
+            os.utime(ruta)
+        except FileNotFoundError:
+            return None
+        return ruta
+
+    def guardar_archivo(self, clave, extension, ruta_origen):
+        """Mueve un archivo ya escrito a la caché y devuelve su ruta definitiva"""
+        ruta = self.ruta(clave, extension)
+        try:
+            os.replace(ruta_origen, ruta)
+        except OSError:
+            # Distinto sistema de archivos: copiar y luego renombrar de forma atómica
+            temporal = f"{ruta}.{os.getpid()}.tmp"
+            shutil.copyfile(ruta_origen, temporal)
+            os.replace(temporal, ruta)
+            os.remove(ruta_origen)
+        self._expulsar()
+        return ruta
+
+    def obtener_json(self, clave):
+        ruta = self.obtener(clave, ".json")
+        if ruta is None:
+            return None
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+
+    def guardar_json(self, clave, datos):
+        temporal = f"{self.ruta(clave, '.json')}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(datos, f, ensure_ascii=False)
+        return self.guardar_archivo(clave, ".json", temporal)
+
+    def guardar_bytes(self, clave, extension, datos):
+        temporal = f"{self.ruta(clave, extension)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporal, "wb") as f:
+            f.write(datos)
+        return self.guardar_archivo(clave, extension, temporal)
+
+    def _expulsar(self):
+        """Elimina las entradas usadas hace más tiempo (no retenidas) hasta respetar el tamaño máximo"""
+        with self._lock:
+            entradas = []
+            abandonados = []
+            limite_temporales = time.time() - EDAD_MAXIMA_TEMPORAL
+            for entrada in os.scandir(self.directorio):
+                if not entrada.is_file():
+                    continue
+                info = entrada.stat()
+                if entrada.name.endswith(".tmp"):
+                    if info.st_mtime < limite_temporales:
+                        abandonados.append(entrada.path)
+                    continue
+                entradas.append((info.st_mtime, info.st_size, entrada.path))
+            total = sum(tam for _, tam, _ in entradas)
+            retenidas = self._retenidas()
+            candidatas = [
+                (tam, ruta) for _, tam, ruta in sorted(entradas) if os.path.basename(ruta) not in retenidas
+            ]
+            for ruta in abandonados:
+                self._borrar(ruta)
+            for tam, ruta in candidatas:
+                if total <= self.max_bytes:
+                    break
+                self._borrar(ruta)
+                total -= tam
+
+    @staticmethod
+    def _borrar(ruta):
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+
+@functools.lru_cache(maxsize=None)
+def obtener_cache():
+    return CacheDisco(CACHE_DIR, CACHE_MAX_MB * 1024 * 1024)
+
+
+def huella_bytes(buffer):
+    """Hash SHA-256 de un buffer en memoria (bytes, memoryview...) sin copiarlo"""
+    return hashlib.sha256(buffer).hexdigest()
+
+
+def huella_archivo(ruta, tam_bloque=1024 * 1024):
+    """Hash SHA-256 del contenido de un archivo, leído por bloques"""
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(tam_bloque), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def clave_transcripcion(huella, idioma, max_hablantes):
+    """Clave de caché de una transcripción: contenido del audio + parámetros de reconocimiento"""
+    recorte = "|vad" if RECORTAR_SILENCIOS else ""
+    return hashlib.sha256(f"{huella}|{idioma}|{max_hablantes}{recorte}".encode()).hexdigest()
+
+# ==============================
+# CONVERSIÓN MP3 → WAV SIN FFMPEG
+# ==============================
+SR_DESTINO = 16000
+TAM_BLOQUE = 65536  # Frames leídos por bloque (~1.5 s a 44.1 kHz)
+
+
+def _filtro_paso_bajo(coeficientes, corte):
+    """FIR de fase lineal con ventana de Kaiser (beta=5) y ganancia 1 en continua.
+
+    Da los mismos coeficientes que scipy.signal.firwin(coeficientes, corte,
+    window=("kaiser", 5.0)); `corte` es relativo a la frecuencia de Nyquist.
+    Importar scipy.signal costaría más de un segundo en el arranque.
+    """
+    n = np.arange(coeficientes) - (coeficientes - 1) / 2
+    h = corte * np.sinc(corte * n) * np.kaiser(coeficientes, 5.0)
+    return h / h.sum()
+
+
+class RemuestreadorPolifasico:
+    """Remuestreo racional (up/down) con filtro FIR polifásico que conserva estado entre bloques.
+
+    Equivale a scipy.signal.resample_poly aplicado a la señal completa, pero
+    procesando bloques de tamaño arbitrario con memoria constante.
+    """
+
+    def __init__(self, sr_origen, sr_destino):
+        g = math.gcd(int(sr_origen), int(sr_destino))
+        self.up = int(sr_destino) // g
+        self.down = int(sr_origen) // g
+
+        # Mismo diseño de filtro que resample_poly (Kaiser, beta=5)
+        max_rate = max(self.up, self.down)
+        half_len = 10 * max_rate
+        h = _filtro_paso_bajo(2 * half_len + 1, 1.0 / max_rate) * self.up
+        self.retardo = half_len  # Retardo del filtro en muestras sobremuestreadas
+
+        # Matriz polifásica: fila p = coeficientes h[p + k*up], invertidos para
+        # multiplicar directamente por ventanas de entrada en orden cronológico
+        self.taps = -(-len(h) // self.up)
+        h = np.concatenate([h, np.zeros(self.taps * self.up - len(h))])
+        self.fases = h.reshape(self.taps, self.up).T[:, ::-1].copy()
+
+        # Historial inicial de ceros (la señal se considera nula antes de t=0)
+        self._buffer = np.zeros(self.taps - 1)
+        self._inicio = -(self.taps - 1)  # Índice global de la primera muestra del buffer
+        self._n_entrada = 0
+        self._n_salida = 0
+
+    def _producir(self, hasta):
+        """Calcula las salidas [_n_salida, hasta) con las muestras disponibles en el buffer"""
+        if hasta <= self._n_salida:
+            return np.zeros(0)
+
+        pos = np.arange(self._n_salida, hasta, dtype=np.int64) * self.down + self.retardo
+        indices = pos // self.up
+        fases = pos % self.up
+
+        ventanas = np.lib.stride_tricks.sliding_window_view(self._buffer, self.taps)
+        salida = np.einsum("ij,ij->i", ventanas[indices - (self.taps - 1) - self._inicio], self.fases[fases])
+        self._n_salida = hasta
+
+        # Descartar historial que ya no necesita ninguna salida futura
+        siguiente = (self._n_salida * self.down + self.retardo) // self.up
+        descartar = siguiente - (self.taps - 1) - self._inicio
+        if descartar > 0:
+            self._buffer = self._buffer[descartar:]
+            self._inicio += descartar
+        return salida
+
+    def procesar(self, bloque):
+        """Añade un bloque de muestras y devuelve las salidas que ya pueden calcularse"""
+        self._buffer = np.concatenate([self._buffer, bloque])
+        self._n_entrada += len(bloque)
+        hasta = (self._n_entrada * self.up - self.retardo - 1) // self.down + 1
+        return self._producir(max(hasta, self._n_salida))
+
+    def finalizar(self):
+        """Vacía el filtro rellenando con ceros y devuelve las últimas salidas"""
+        total = -(-self._n_entrada * self.up // self.down)
+        relleno = self.retardo // self.up + self.taps + 1
+        self._buffer = np.concatenate([self._buffer, np.zeros(relleno)])
+        return self._producir(total)
+
+
+def _bloques_convertidos(ruta_entrada, sr_destino, tam_bloque, stats):
+    """Genera bloques float32 mono a sr_destino; al terminar rellena `stats`"""
+    import soundfile as sf
+    inicio = time.perf_counter()
+    tiempo_decodificacion = tiempo_remuestreo = 0.0
+
+    with sf.SoundFile(ruta_entrada) as entrada:
+        sr_origen = entrada.samplerate
+        remuestreador = RemuestreadorPolifasico(sr_origen, sr_destino) if sr_origen != sr_destino else None
+        frames_entrada = 0
+        bloques = entrada.blocks(blocksize=tam_bloque, dtype="float32", always_2d=True)
+
+        while True:
+            t0 = time.perf_counter()
+            bloque = next(bloques, None)
+            t1 = time.perf_counter()
+            tiempo_decodificacion += t1 - t0
+            if bloque is None:
+                break
+            frames_entrada += len(bloque)
+            mono = bloque.mean(axis=1)
+            if remuestreador is not None:
+                mono = remuestreador.procesar(mono)
+            tiempo_remuestreo += time.perf_counter() - t1
+            yield mono
+
+        if remuestreador is not None:
+            t0 = time.perf_counter()
+            resto = remuestreador.finalizar()
+            tiempo_remuestreo += time.perf_counter() - t0
+            yield resto
+
+    segundos_audio = frames_entrada / sr_origen
+    segundos_proceso = time.perf_counter() - inicio
+    stats.update({
+        "duracion_audio": segundos_audio,
+        "tiempo_proceso": segundos_proceso,
+        "tiempo_decodificacion": tiempo_decodificacion,
+        "tiempo_remuestreo": tiempo_remuestreo,
+        "factor_tiempo_real": segundos_audio / segundos_proceso if segundos_proceso > 0 else float("inf"),
+    })
+    metricas.registrar("decodificacion", tiempo_decodificacion, duracion_audio=segundos_audio,
+                       formato=os.path.splitext(str(ruta_entrada))[1].lower().lstrip("."))
+    metricas.registrar("remuestreo", tiempo_remuestreo, duracion_audio=segundos_audio, sr_origen=sr_origen)
+
+
+def convertir_audio_en_bloques(ruta_entrada, ruta_salida, sr_destino=SR_DESTINO, tam_bloque=TAM_BLOQUE):
+    """Convierte cualquier audio legible por soundfile a WAV PCM_16 mono por bloques.
+
+    Lee, mezcla a mono, remuestrea y escribe bloque a bloque, de modo que el
+    pico de memoria no depende de la duración del audio. Devuelve estadísticas
+    de la conversión, incluido el factor de tiempo real.
+    """
+    import soundfile as sf
+    stats = {}
+    tiempo_escritura = 0.0
+    with sf.SoundFile(ruta_salida, "w", samplerate=sr_destino, channels=1, format="WAV", subtype="PCM_16") as salida:
+        for bloque in _bloques_convertidos(ruta_entrada, sr_destino, tam_bloque, stats):
+            inicio = time.perf_counter()
+            salida.write(bloque)
+            tiempo_escritura += time.perf_counter() - inicio
+    stats["tiempo_escritura"] = tiempo_escritura
+    metricas.registrar("escritura_wav", tiempo_escritura, duracion_audio=stats["duracion_audio"])
+    return stats
+
+
+def leer_pcm(ruta_wav, inicio=0.0, fin=None, tam_bloque=TAM_BLOQUE):
+    """Genera los bytes PCM 16 bit del tramo [inicio, fin) de un WAV mono, bloque a bloque"""
+    import soundfile as sf
+    with sf.SoundFile(ruta_wav) as f:
+        f.seek(int(inicio * f.samplerate))
+        restantes = (f.frames if fin is None else int(fin * f.samplerate)) - int(inicio * f.samplerate)
+        while restantes > 0:
+            bloque = f.read(min(restantes, tam_bloque), dtype="int16")
+            if not len(bloque):
+                break
+            yield bloque.astype("<i2", copy=False).tobytes()
+            restantes -= len(bloque)
+
+
+def duracion_audio(ruta):
+    """Duración en segundos de un archivo de audio, leyendo solo la cabecera"""
+    import soundfile as sf
+    return sf.info(ruta).duration
+
+
+def clave_wav(huella):
+    """Clave en la caché del WAV 16 kHz de un audio (la subida original también puede ser `<huella>.wav`)"""
+    return f"{huella}-16k"
+
+
+class ErrorConversion(Exception):
+    """El audio de entrada no se puede decodificar"""
+
+
+def es_wav_destino(ruta):
+    """True si `ruta` ya es WAV PCM 16 bit, 16 kHz y mono: se puede transcribir tal cual"""
+    import soundfile as sf
+    try:
+        info = sf.info(ruta)
+    except RuntimeError:
+        return False
+    return (info.format, info.subtype, info.samplerate, info.channels) == ("WAV", "PCM_16", SR_DESTINO, 1)
+
+
+def convertir_a_wav(ruta_entrada, huella=None, mover=False):
+    """Convierte un archivo de audio a WAV PCM 16 kHz mono dentro de la caché.
+
+    Un WAV que ya está en ese formato no se copia ni se reescribe: se devuelve
+    su misma ruta o, con `mover` (un temporal que ya no se necesita), se mueve
+    a la caché. Devuelve (ruta_wav, estadísticas); las estadísticas están
+    vacías si no hubo conversión. Lanza ErrorConversion si libsndfile no puede
+    leerlo.
+    """
+    cache = obtener_cache()
+    if es_wav_destino(ruta_entrada):
+        metricas.contar("wav_sin_conversion")
+        if mover:
+            return cache.guardar_archivo(clave_wav(huella or huella_archivo(ruta_entrada)), ".wav", ruta_entrada), {}
+        return os.fspath(ruta_entrada), {}
+    clave = clave_wav(huella or huella_archivo(ruta_entrada))
+    en_cache = cache.obtener(clave, ".wav")
+    if en_cache is not None:
+        return en_cache, {}
+
+    with cache.temporal(".wav") as temporal:
+        try:
+            stats = convertir_audio_en_bloques(ruta_entrada, temporal)
+        except RuntimeError as e:
+            raise ErrorConversion(str(e)) from e
+        return cache.guardar_archivo(clave, ".wav", temporal), stats
+
+# ==============================
+# FUNCIÓN DE RESUMEN CON AZURE LANGUAGE
+# ==============================
+PLAZO_RESUMEN = float(os.getenv("PLAZO_RESUMEN", "120"))  # Segundos máximos por trabajo de resumen
+ESPERA_INICIAL = 0.25  # Primera consulta de estado: los textos cortos suelen estar listos enseguida
+ESPERA_MAXIMA = 5.0
+MAX_CARACTERES_DOCUMENTO = 125_000  # Límite del servicio por documento de resumen
+MAX_DOCUMENTOS_POR_TRABAJO = 25  # Límite del servicio de documentos por trabajo
+MAX_SEGUNDOS_DOCUMENTO = 15 * 60  # Cada documento cubre como mucho este tramo de la conversación
+ORACIONES_RESUMEN = 5  # sentenceCount por defecto; el servicio admite de 1 a 20
+MOTORES_RESUMEN = {
+    "azure": "☁️ Azure Language",
+    "local": "💻 Local (TF-IDF + TextRank)",
+}
+
+
+class ErrorResumen(Exception):
+    """Fallo al generar un resumen con Azure Language"""
+
+
+@functools.lru_cache(maxsize=None)
+def obtener_sesion_http():
+    """Sesión HTTP compartida con keep-alive y pool de conexiones"""
+    import requests
+    sesion = requests.Session()
+    adaptador = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    sesion.mount("https://", adaptador)
+    sesion.mount("http://", adaptador)
+    return sesion
+
+
+def _segundos_retry_after(response, por_defecto):
+    """Segundos indicados por la cabecera Retry-After (o el valor por defecto si no hay)"""
+    valor = response.headers.get("Retry-After")
+    try:
+        return max(float(valor), 0.0)
+    except (TypeError, ValueError):
+        return por_defecto
+
+
+def _peticion_con_reintentos(metodo, url, limite, **kwargs):
+    """Petición HTTP a Language que reintenta 429/503 respetando Retry-After hasta la hora límite.
+
+    Cada intento espera su turno en el limitador compartido del servicio; un
+    429/503 lo frena para todas las sesiones del proceso.
+    """
+    sesion = obtener_sesion_http()
+    limitador = obtener_limitador("language")
+    espera = ESPERA_INICIAL
+    while True:
+        with limitador.turno():
+            response = sesion.request(metodo, url, timeout=30, **kwargs)
+        if response.status_code not in (429, 503):
+            response.raise_for_status()
+            return response
+        metricas.contar("resumen_reintentos")
+        espera = _segundos_retry_after(response, min(espera * 2, ESPERA_MAXIMA))
+        if time.monotonic() + espera > limite:
+            response.raise_for_status()
+        limitador.frenar(espera)
+
+
+def _cuerpo_trabajo(textos, tipo, oraciones=ORACIONES_RESUMEN):
+    """Cuerpo de un trabajo analyze-text con un documento por texto"""
+    if tipo == "extractive":
+        # Resumen extractivo - extrae oraciones más relevantes
+        tarea = {
+            "kind": "ExtractiveSummarization",
+            "taskName": "ExtractiveSummarization_1",
+            "parameters": {
+                "sentenceCount": oraciones,
+                "sortBy": "Offset"
+            }
+        }
+    else:
+        # Resumen abstractivo - genera un resumen nuevo
+        tarea = {
+            "kind": "AbstractiveSummarization",
+            "taskName": "AbstractiveSummarization_1",
+            "parameters": {
+                "sentenceCount": oraciones
+            }
+        }
+    return {
+        "displayName": f"{tarea['kind']} Task",
+        "analysisInput": {
+            "documents": [
+                {"id": str(i), "language": "es", "text": texto}
+                for i, texto in enumerate(textos, start=1)
+            ]
+        },
+        "tasks": [tarea]
+    }
+
+
+def enviar_trabajo_resumen(textos, tipo="extractive", limite=None, oraciones=ORACIONES_RESUMEN):
+    """Envía el trabajo y devuelve la URL de estado (Operation-Location)"""
+    limite = limite or time.monotonic() + PLAZO_RESUMEN
+    url = f"{LANGUAGE_ENDPOINT.rstrip('/')}/language/analyze-text/jobs?api-version=2023-04-01"
+    headers = {
+        "Ocp-Apim-Subscription-Key": LANGUAGE_KEY,
+        "Content-Type": "application/json"
+    }
+    response = _peticion_con_reintentos("POST", url, limite, headers=headers, json=_cuerpo_trabajo(textos, tipo, oraciones))
+    metricas.contar("resumen_envios")
+
+    operation_location = response.headers.get('Operation-Location')
+    if not operation_location:
+        raise ErrorResumen("No se recibió la URL de operación")
+    return operation_location
+
+
+def esperar_trabajo_resumen(operation_location, tipo="extractive", limite=None):
+    """Consulta el estado con espera exponencial (o la que pida Retry-After) y devuelve un resumen por documento"""
+    limite = limite or time.monotonic() + PLAZO_RESUMEN
+    headers = {"Ocp-Apim-Subscription-Key": LANGUAGE_KEY}
+    espera = ESPERA_INICIAL
+
+    while True:
+        if time.monotonic() + espera > limite:
+            raise ErrorResumen("Tiempo de espera agotado. El proceso tardó demasiado.")
+        time.sleep(espera)
+
+        status_response = _peticion_con_reintentos("GET", operation_location, limite, headers=headers)
+        metricas.contar("resumen_consultas")
+        status_data = status_response.json()
+        status = status_data.get('status')
+
+        if status == 'succeeded':
+            # Extraer el resumen de cada documento, en el orden en que se enviaron
+            tasks = status_data.get('tasks', {}).get('items', [])
+            if not tasks:
+                raise ErrorResumen("No se encontraron tareas en la respuesta")
+
+            documents = tasks[0].get('results', {}).get('documents', [])
+            if not documents:
+                raise ErrorResumen("No se encontraron documentos en los resultados")
+
+            clave = 'sentences' if tipo == "extractive" else 'summaries'
+            documents = sorted(documents, key=lambda doc: int(doc['id']))
+            return [" ".join(s['text'] for s in doc.get(clave, [])) for doc in documents]
+
+        elif status == 'failed':
+            errors = status_data.get('errors', [])
+            raise ErrorResumen(f"El trabajo falló: {errors[0] if errors else 'Error desconocido'}")
+
+        # Si está en progreso, esperar más (o lo que indique el servicio)
+        espera = _segundos_retry_after(status_response, min(espera * 2, ESPERA_MAXIMA))
+
+
+def _trocear_texto(texto, max_caracteres):
+    """Parte un texto demasiado largo en trozos por espacios"""
+    trozos = []
+    while len(texto) > max_caracteres:
+        corte = texto.rfind(" ", 0, max_caracteres)
+        corte = corte if corte > 0 else max_caracteres
+        trozos.append(texto[:corte])
+        texto = texto[corte:].lstrip()
+    return trozos + [texto]
+
+
+def dividir_transcripcion(segmentos, max_caracteres=MAX_CARACTERES_DOCUMENTO, max_segundos=MAX_SEGUNDOS_DOCUMENTO):
+    """Agrupa segmentos consecutivos en documentos que respetan el límite de caracteres y de duración.
+
+    Cuando hay que cortar, se prefiere el último cambio de hablante de la
+    segunda mitad del documento, para no partir una intervención por la mitad.
+    """
+    documentos = []
+    actual = []  # Textos del documento en construcción
+    inicios = []  # Offset de cada texto de `actual`
+    cambios = []  # Posiciones de `actual` donde empieza un turno de otro hablante
+    caracteres = 0
+    hablante_previo = None
+
+    def cerrar(hasta):
+        nonlocal actual, inicios, cambios, caracteres
+        documentos.append(" ".join(actual[:hasta]))
+        actual, inicios = actual[hasta:], inicios[hasta:]
+        cambios = [c - hasta for c in cambios if c > hasta]
+        caracteres = sum(len(t) + 1 for t in actual)
+
+    for seg in segmentos:
+        for texto in _trocear_texto(seg['text'], max_caracteres):
+            if not texto:
+                continue
+            excede = actual and (
+                caracteres + len(texto) + 1 > max_caracteres
+                or seg['offset'] - inicios[0] > max_segundos
+            )
+            if excede:
+                turnos = [c for c in cambios if c >= len(actual) // 2]
+                cerrar(turnos[-1] if turnos else len(actual))
+                if actual and caracteres + len(texto) + 1 > max_caracteres:
+                    cerrar(len(actual))
+            if actual and seg['speaker'] != hablante_previo:
+                cambios.append(len(actual))
+            actual.append(texto)
+            inicios.append(seg['offset'])
+            caracteres += len(texto) + 1
+            hablante_previo = seg['speaker']
+
+    if actual:
+        documentos.append(" ".join(actual))
+    return documentos
+
+
+def _resumir_documentos(textos, tipo, limite, oraciones=ORACIONES_RESUMEN):
+    """Resume una lista de textos en trabajos de hasta MAX_DOCUMENTOS_POR_TRABAJO documentos, en paralelo"""
+    lotes = [textos[i:i + MAX_DOCUMENTOS_POR_TRABAJO] for i in range(0, len(textos), MAX_DOCUMENTOS_POR_TRABAJO)]
+
+    def resumir_lote(lote):
+        return esperar_trabajo_resumen(enviar_trabajo_resumen(lote, tipo, limite, oraciones), tipo, limite)
+
+    if len(lotes) == 1:
+        return resumir_lote(lotes[0])
+    with ThreadPoolExecutor(max_workers=min(len(lotes), 4)) as pool:
+        futuros = [pool.submit(metricas.en_contexto(resumir_lote), lote) for lote in lotes]
+        return [resumen for futuro in futuros for resumen in futuro.result()]
+
+
+def resumir_transcripcion(segmentos, tipo="extractive", plazo=PLAZO_RESUMEN, motor_resumen="azure",
+                          oraciones=ORACIONES_RESUMEN):
+    """Resumen jerárquico de una transcripción de cualquier longitud.
+
+    Primera pasada: la transcripción se divide en documentos por hablante y
+    tiempo que se envían juntos en el mínimo número de trabajos. Segunda
+    pasada: si hubo varios documentos, se resume la unión de sus resúmenes.
+    Con motor_resumen="local" el resumen es extractivo y se calcula en el
+    proceso (ver resumen_local.py), sin trabajos de Azure ni plazo.
+    """
+    import requests
+    if motor_resumen == "local":
+        with metricas.etapa("resumen", tipo="extractive", motor="local", segmentos=len(segmentos)):
+            resumen = resumir_local(segmentos, oraciones)
+        if not resumen:
+            raise ErrorResumen("La transcripción no contiene texto")
+        return resumen
+
+    limite = time.monotonic() + plazo
+    with metricas.etapa("resumen", tipo=tipo) as extra:
+        try:
+            documentos = dividir_transcripcion(segmentos)
+            if not documentos:
+                raise ErrorResumen("La transcripción no contiene texto")
+            extra["documentos"] = len(documentos)
+
+            resumenes = _resumir_documentos(documentos, tipo, limite, oraciones)
+
+            # Pasadas siguientes sobre la unión de los resúmenes parciales
+            while len(resumenes) > 1:
+                parciales = [{'speaker': None, 'offset': 0.0, 'text': r} for r in resumenes if r]
+                if not parciales:
+                    return ""
+                resumenes = _resumir_documentos(
+                    dividir_transcripcion(parciales, max_segundos=float("inf")), tipo, limite, oraciones
+                )
+            return resumenes[0]
+        except requests.exceptions.RequestException as e:
+            detalles = getattr(getattr(e, 'response', None), 'text', None)
+            raise ErrorResumen(f"Error al generar resumen: {e}" + (f"\nDetalles: {detalles}" if detalles else "")) from e
+
+# ==============================
+# FUNCIÓN DE TRANSCRIPCIÓN CON DIARIZACIÓN
+# ==============================
+RECORTAR_SILENCIOS = os.getenv("RECORTAR_SILENCIOS", "1") != "0"  # VAD antes de transcribir un WAV
+REUTILIZAR_TRAMOS = os.getenv("REUTILIZAR_TRAMOS", "1") != "0"  # No retranscribir tramos de episodios anteriores
+PUNTOS_CONTROL_DIR = os.getenv("PUNTOS_CONTROL_DIR") or os.path.join(CACHE_DIR, "puntos_control")
+SOLAPE_REANUDACION = 15  # Segundos que se vuelven a reconocer al reanudar, para reconciliar los hablantes
+HABLANTES_DESCONOCIDOS = ("Unknown", "Desconocido")  # Sin hablante asignado: no se renumeran
+
+
+@functools.lru_cache(maxsize=None)
+def obtener_speechsdk():
+    """Speech SDK, importado al transcribir por primera vez: ver, exportar o resumir no lo necesitan"""
+    import azure.cognitiveservices.speech as speechsdk
+    return speechsdk
+
+
+def _crear_entrada_audio(fuente):
+    """AudioConfig para una ruta WAV o para un iterable de bloques PCM 16 kHz/16 bit/mono.
+
+    Con un iterable, los bytes se escriben en un PushAudioInputStream desde un
+    hilo propio, sin pasar por ningún archivo en disco. Si el iterable falla,
+    el stream se cierra igualmente y la excepción queda en `alimentador.error`.
+    """
+    speechsdk = obtener_speechsdk()
+    if isinstance(fuente, (str, os.PathLike)):
+        return speechsdk.audio.AudioConfig(filename=os.fspath(fuente)), None
+
+    formato = speechsdk.audio.AudioStreamFormat(samples_per_second=SR_DESTINO, bits_per_sample=16, channels=1)
+    stream = speechsdk.audio.PushAudioInputStream(stream_format=formato)
+
+    def alimentar():
+        try:
+            for bloque in fuente:
+                stream.write(bloque)
+        except Exception as e:
+            alimentador.error = e  # Lo recoge _ejecutar_sesion: el audio reconocido está incompleto
+        finally:
+            stream.close()
+
+    alimentador = threading.Thread(target=alimentar, name="push-audio", daemon=True)
+    alimentador.error = None
+    return speechsdk.audio.AudioConfig(stream=stream), alimentador
+
+
+def _transcribir_sesion(fuente, idioma, max_hablantes, al_segmento=None, palabras=None):
+    """Ejecuta una sesión de ConversationTranscriber y devuelve (segmentos, error).
+
+    `fuente` es la ruta de un WAV o un iterable de bytes PCM (ver leer_pcm).
+    Si se pasa un ConstructorPalabras en `palabras`, se le añaden las marcas de
+    tiempo por palabra de cada segmento reconocido.
+    Como mucho MAX_SESIONES_SPEECH sesiones se ejecutan a la vez en el proceso;
+    las que esperan se reparten por rondas entre trabajos (ver limitador.py).
+    """
+    with obtener_limitador("speech").turno():
+        if _transcriptor_simulado is not None:
+            return _transcriptor_simulado(fuente, idioma, max_hablantes, al_segmento, palabras)
+        return _ejecutar_sesion(fuente, idioma, max_hablantes, al_segmento, palabras)
+
+
+def _ejecutar_sesion(fuente, idioma, max_hablantes, al_segmento, palabras=None):
+    speechsdk = obtener_speechsdk()
+    speech_config = speechsdk.SpeechConfig(subscription=SPEECH_KEY, region=REGION)
+    
+    # Configurar idioma
+    speech_config.speech_recognition_language = idioma
+    
+    # ACTIVAR DIARIZACIÓN - Método correcto
+    speech_config.set_property(
+        speechsdk.PropertyId.SpeechServiceConnection_LanguageIdMode, "Continuous"
+    )
+    speech_config.request_word_level_timestamps()
+    
+    # Habilitar diarización del hablante
+    speech_config.set_property_by_name("DiarizationEnabled", "true")
+    speech_config.set_property_by_name("MaxSpeakerCount", str(max_hablantes))  # Máximo de hablantes a detectar
+    
+    # Configurar audio de entrada
+    audio_config, alimentador = _crear_entrada_audio(fuente)
+    
+    # Usar ConversationTranscriber para diarización
+    conversation_transcriber = speechsdk.transcription.ConversationTranscriber(
+        speech_config=speech_config,
+        audio_config=audio_config
+    )
+    
+    # Los callbacks llegan desde hilos del SDK: lista protegida por lock y
+    # finalización señalizada con un Future en lugar de sondear un flag
+    transcripcion_completa = []
+    lock = threading.Lock()
+    terminado = Future()
+
+    def finalizar(error_msg=None):
+        with lock:
+            if not terminado.done():
+                terminado.set_result(error_msg)
+
+    def transcribed_cb(evt):
+        """Callback cuando se reconoce un segmento con hablante"""
+        if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech:
+            speaker_id = evt.result.speaker_id if hasattr(evt.result, 'speaker_id') else "Desconocido"
+            segmento = {
+                'speaker': speaker_id,
+                'offset': evt.result.offset / 10_000_000,  # Convertir a segundos
+                'duration': evt.result.duration / 10_000_000,
+                'text': evt.result.text
+            }
+            with lock:
+                if palabras is not None:
+                    palabras.agregar_resultado_json(evt.result.json, speaker_id, len(transcripcion_completa))
+                transcripcion_completa.append(segmento)
+            if al_segmento is not None:
+                al_segmento(segmento)
+
+    def session_stopped_cb(evt):
+        """Callback cuando termina la sesión"""
+        finalizar()
+
+    def canceled_cb(evt):
+        """Callback en caso de error"""
+        detalles = evt.cancellation_details
+        if detalles.reason == speechsdk.CancellationReason.Error:
+            finalizar(f"Error: {detalles.error_details}")
+        else:
+            finalizar()
+
+    # Conectar callbacks
+    conversation_transcriber.transcribed.connect(transcribed_cb)
+    conversation_transcriber.session_stopped.connect(session_stopped_cb)
+    conversation_transcriber.canceled.connect(canceled_cb)
+
+    # Iniciar transcripción
+    conversation_transcriber.start_transcribing_async().get()
+    if alimentador is not None:
+        alimentador.start()
+    
+    # Esperar hasta que termine (retorna en cuanto llega session_stopped o canceled).
+    # La sesión ya está detenida: llamar a stop_transcribing_async aquí haría que
+    # destruir el transcriptor se bloquee ~10 s dentro del SDK.
+    error_msg = terminado.result()
+    if alimentador is not None:
+        alimentador.join()
+        if alimentador.error is not None and not error_msg:
+            error_msg = f"Error al leer el audio: {alimentador.error}"
+    with lock:
+        return list(transcripcion_completa), error_msg
+
+
+def transcribir(fuente, huella, idioma, max_hablantes, paralelo=False, max_workers=4,
+                al_segmento=None, al_progreso=None):
+    """Transcribe con diarización usando la caché de transcripciones.
+
+    Con paralelo=True, `fuente` debe ser la ruta del WAV y se usa
+    transcribir_en_paralelo. Devuelve (segmentos, error); las marcas de tiempo
+    por palabra quedan en la caché junto a los segmentos (ver cargar_palabras).
+    Con REUTILIZAR_TRAMOS, los tramos que ya aparecen en episodios transcritos
+    antes (sintonías, cuñas) no se envían a Speech: se toma su texto del índice
+    de firmas acústicas. Lo reconocido se va guardando en un punto de control
+    (ver puntos_control.py), así que un intento que se corta continúa en el
+    siguiente donde se quedó.
+    """
+    cache = obtener_cache()
+    clave = clave_transcripcion(huella, idioma, max_hablantes)
+    en_cache = cache.obtener_json(clave)
+    if en_cache is not None:
+        metricas.contar("transcripcion_cache")
+        return en_cache, None
+
+    original = fuente
+    mapa = None
+    firma, conocidos = None, []
+    if isinstance(fuente, (str, os.PathLike)):
+        if REUTILIZAR_TRAMOS:
+            firma, conocidos = buscar_tramos_conocidos(fuente, huella, idioma)
+        if RECORTAR_SILENCIOS or conocidos:
+            fuente, mapa = recortar_audio(fuente, huella, [(c['inicio'], c['fin']) for c in conocidos])
+        if mapa is not None and al_segmento is not None:
+            al_segmento = functools.partial(_al_segmento_original, al_segmento, mapa)
+
+    palabras = ConstructorPalabras()
+    punto_control = None
+    if isinstance(fuente, (str, os.PathLike)):
+        modo = f"paralelo|{DURACION_FRAGMENTO}|{SOLAPE_FRAGMENTO}" if paralelo else "secuencial"
+        punto_control = PuntoControl(PUNTOS_CONTROL_DIR, clave, _identidad_audio(fuente, modo))
+    inicio = time.perf_counter()
+    # El WAV recortado no se expulsa de la caché mientras se transcribe
+    with obtener_cache().retener(fuente if isinstance(fuente, (str, os.PathLike)) else None):
+        try:
+            if fuente is None:
+                segmentos, error_msg = [], None  # Todo el audio ya estaba transcrito en otros episodios
+            elif paralelo:
+                segmentos, error_msg = transcribir_en_paralelo(
+                    fuente, idioma, max_hablantes, max_workers=max_workers, al_progreso=al_progreso,
+                    palabras=palabras, punto_control=punto_control,
+                )
+            elif punto_control is not None:
+                segmentos, error_msg = _transcribir_reanudable(
+                    fuente, idioma, max_hablantes, punto_control, al_segmento, palabras)
+            else:
+                segmentos, error_msg = _transcribir_sesion(fuente, idioma, max_hablantes, al_segmento, palabras)
+        finally:
+            if punto_control is not None:
+                punto_control.cerrar()
+    segundos = time.perf_counter() - inicio
+    palabras = palabras.construir()
+    if mapa is not None:
+        # Devolver los tiempos en la línea de tiempo del audio original
+        segmentos = [mapa.segmento(seg) for seg in segmentos]
+        palabras = palabras.remapear_tiempos(mapa.milisegundos, lambda ms: mapa.milisegundos(ms, final=True))
+    if conocidos and not error_msg:
+        segmentos, palabras = empalmar_conocidos(segmentos, palabras, conocidos)
+    if isinstance(original, (str, os.PathLike)):
+        audio = duracion_audio(original)
+    else:
+        audio = max((seg['offset'] + seg['duration'] for seg in segmentos), default=0.0)
+    metricas.registrar("transcripcion", segundos, duracion_audio=audio, paralelo=paralelo,
+                       segmentos=len(segmentos), error=bool(error_msg),
+                       factor_tiempo_real=audio / segundos if segundos > 0 else 0.0)
+
+    if not error_msg and segmentos:
+        guardar_palabras(clave, palabras)
+        cache.guardar_json(clave, segmentos)
+        if firma is not None:
+            firmas.obtener_indice().indexar(huella, clave, idioma, firma, segmentos)
+    if punto_control is not None and not error_msg:
+        punto_control.eliminar()
+    return segmentos, error_msg
+
+
+def _al_segmento_original(al_segmento, mapa, segmento):
+    al_segmento(mapa.segmento(segmento))
+
+
+def _identidad_audio(ruta_wav, modo):
+    """Identifica el audio (y el modo) de un punto de control: el WAV de la caché lleva su huella en el nombre"""
+    return f"{os.path.basename(os.fspath(ruta_wav))}|{os.path.getsize(ruta_wav)}|{modo}"
+
+
+def _transcribir_reanudable(ruta_wav, idioma, max_hablantes, punto_control, al_segmento=None, palabras=None):
+    """_transcribir_sesion que registra cada segmento en `punto_control` y retoma un intento anterior.
+
+    Si un intento previo se cortó, la nueva sesión empieza SOLAPE_REANUDACION s
+    antes del final del último segmento confirmado (buscando en el WAV); cada
+    sesión se trata como un fragmento de unir_palabras, que descarta lo repetido
+    y reconcilia los hablantes en el solape.
+    """
+    anteriores = [sesion for sesion in punto_control.sesiones() if sesion['segmentos']]
+    corte = max([sesion['corte'] for sesion in anteriores] + [
+        sesion['inicio'] + seg['offset'] + seg['duration'] for sesion in anteriores for seg, _ in sesion['segmentos']
+    ], default=0.0)
+    inicio = max(corte - SOLAPE_REANUDACION, 0.0)
+    if anteriores:
+        metricas.contar("transcripcion_reanudada")
+    punto_control.iniciar_sesion(inicio, corte)
+    registro = ConstructorRegistrado(punto_control, al_segmento, inicio)
+    fuente = leer_pcm(ruta_wav, inicio) if inicio else ruta_wav
+    segmentos, error_msg = _transcribir_sesion(fuente, idioma, max_hablantes, registro.al_segmento, registro)
+    actual = registro.construir()
+    if not anteriores:
+        if palabras is not None:
+            palabras.extender(actual)
+        return segmentos, error_msg
+
+    sesiones = anteriores + [{'inicio': inicio, 'corte': corte, 'segmentos': None}]
+    fragmentos, resultados, partes = [], [], []
+    for i, sesion in enumerate(sesiones):
+        siguiente = sesiones[i + 1]['corte'] if i + 1 < len(sesiones) else math.inf
+        fragmentos.append({'inicio': sesion['inicio'], 'fin': siguiente,
+                           'propio_inicio': sesion['corte'], 'propio_fin': siguiente})
+        if sesion['segmentos'] is None:
+            resultados.append(segmentos)
+            partes.append(actual)
+            continue
+        constructor = ConstructorPalabras()
+        for indice, (seg, marcas) in enumerate(sesion['segmentos']):
+            constructor.agregar(marcas, seg['speaker'], indice)
+        resultados.append([seg for seg, _ in sesion['segmentos']])
+        partes.append(constructor.construir())
+    unidos, unidas = unir_palabras(fragmentos, resultados, partes)
+    if palabras is not None:
+        palabras.extender(unidas)
+    return unidos, error_msg
+
+
+def recortar_audio(ruta_wav, huella, excluir=()):
+    """WAV sin las pausas largas ni los tramos de `excluir` (en caché) y su vad.MapaOffsets.
+
+    Devuelve (ruta_wav, None) si no hay nada que recortar y (None, mapa) si no queda nada que transcribir.
+    """
+    import soundfile as sf
+    info = sf.info(ruta_wav)
+    duracion = info.duration
+    if RECORTAR_SILENCIOS:
+        with metricas.etapa("vad") as informe:
+            intervalos, datos = vad.detectar_voz(ruta_wav)
+            # Sin voz detectada o casi nada que quitar: transcribir el original por si acaso
+            if not intervalos or datos['segundos_recortados'] < vad.MIN_SILENCIO:
+                intervalos = None
+                datos = vad.informe_recorte([(0.0, duracion)], duracion)
+            informe.update(datos)
+    else:
+        intervalos = None
+    if intervalos is None and not excluir:
+        return ruta_wav, None
+
+    intervalos = vad.restar_intervalos(intervalos or [(0.0, duracion)], excluir)
+    mapa = vad.MapaOffsets(intervalos, info.samplerate)
+    if not intervalos:
+        return None, mapa
+    cache = obtener_cache()
+    clave = f"{huella}-vad" if RECORTAR_SILENCIOS else f"{huella}-recorte"
+    if excluir:
+        clave += "-" + hashlib.sha256(json.dumps(intervalos).encode()).hexdigest()[:16]
+    ruta = cache.obtener(clave, ".wav")
+    if ruta is None:
+        with cache.temporal(".wav") as temporal:
+            vad.escribir_recorte(ruta_wav, intervalos, temporal)
+            ruta = cache.guardar_archivo(clave, ".wav", temporal)
+    return ruta, mapa
+
+
+def buscar_tramos_conocidos(ruta_wav, huella, idioma):
+    """(firma del audio, tramos ya transcritos en otros episodios); (None, []) si el WAV no admite firma"""
+    import soundfile as sf
+    if sf.info(ruta_wav).samplerate != firmas.SR_FIRMA:
+        return None, []
+    with metricas.etapa("firmas") as extra:
+        firma = firmas.calcular_firma(ruta_wav)
+        conocidos = firmas.obtener_indice().buscar(firma, huella, idioma)
+        extra.update(coincidencias=len(conocidos),
+                     segundos_reutilizados=sum(c['fin'] - c['inicio'] for c in conocidos),
+                     segmentos_reutilizados=sum(len(c['segmentos']) for c in conocidos))
+    return firma, conocidos
+
+
+def _hablantes_reutilizados(segmentos, conocidos):
+    """Por tramo reutilizado, {hablante en su episodio de origen: hablante en esta transcripción}.
+
+    Los números de hablante de otra sesión no significan nada en esta, y el
+    tramo no se ha reconocido aquí, así que no hay tiempo de habla común con el
+    que emparejarlos: cada hablante de cada episodio de origen pasa a ser uno
+    nuevo, numerado a continuación de los de `segmentos`.
+    """
+    numero = max((int(seg['speaker'][6:]) for seg in segmentos
+                  if seg['speaker'].startswith("Guest-") and seg['speaker'][6:].isdigit()), default=0)
+    nuevos = {}  # (clave de origen, hablante de origen) -> hablante nuevo
+    mapas = []
+    for c in conocidos:
+        mapa = {}
+        for seg in c['segmentos']:
+            origen = seg['speaker']
+            if origen in HABLANTES_DESCONOCIDOS:
+                mapa[origen] = origen
+            elif origen not in mapa:
+                if (c['clave'], origen) not in nuevos:
+                    numero += 1
+                    nuevos[(c['clave'], origen)] = f"Guest-{numero}"
+                mapa[origen] = nuevos[(c['clave'], origen)]
+        mapas.append(mapa)
+    return mapas
+
+
+def empalmar_conocidos(segmentos, palabras, conocidos):
+    """Intercala por offset los segmentos reutilizados (y sus palabras, si siguen en caché) con los nuevos.
+
+    Los hablantes de los tramos reutilizados se renombran con _hablantes_reutilizados.
+    """
+    mapas = _hablantes_reutilizados(segmentos, conocidos)
+    fuentes = [segmentos] + [
+        [dict(seg, speaker=mapa[seg['speaker']]) for seg in c['segmentos']] for c, mapa in zip(conocidos, mapas)
+    ]
+    orden = sorted((seg['offset'], f, i) for f, segs in enumerate(fuentes) for i, seg in enumerate(segs))
+    posiciones = [np.zeros(len(segs), dtype=np.int32) for segs in fuentes]
+    for posicion, (_, f, i) in enumerate(orden):
+        posiciones[f][i] = posicion
+    unidos = [fuentes[f][i] for _, f, i in orden]
+
+    partes = [palabras.seleccionar(np.ones(len(palabras), dtype=bool), mapa_segmentos=posiciones[0])]
+    for c, mapa, posicion in zip(conocidos, mapas, posiciones[1:]):
+        origen = cargar_palabras(c['clave'])
+        if origen is None:
+            continue
+        mapa_segmentos = np.full(c['total_segmentos'], -1, dtype=np.int32)
+        mapa_segmentos[c['indices']] = posicion
+        partes.append(origen.seleccionar(np.isin(origen.segmentos, c['indices']), -c['desplazamiento'],
+                                         mapa_hablantes=mapa, mapa_segmentos=mapa_segmentos))
+    return unidos, TranscripcionPalabras.concatenar(partes)
+
+
+def guardar_palabras(clave, palabras):
+    """Guarda un TranscripcionPalabras en la caché como `<clave>.npz`"""
+    cache = obtener_cache()
+    with cache.temporal(".npz") as temporal:
+        with open(temporal, "wb") as f:
+            palabras.guardar(f)
+        return cache.guardar_archivo(clave, ".npz", temporal)
+
+
+def cargar_palabras(clave):
+    """TranscripcionPalabras de una transcripción en caché, o None si no hay"""
+    ruta = obtener_cache().obtener(clave, ".npz")
+    if ruta is None:
+        return None
+    return TranscripcionPalabras.cargar(ruta)
+
+
+# ==============================
+# TRANSCRIPCIÓN PARALELA POR FRAGMENTOS
+# ==============================
+DURACION_FRAGMENTO = 300  # Segundos de audio propio por fragmento
+SOLAPE_FRAGMENTO = 15  # Segundos compartidos con cada fragmento vecino
+VENTANA_CORTE = 30  # Margen alrededor del corte ideal para buscar un silencio
+DURACION_TRAMA = 0.02
+
+
+def energia_por_tramas(ruta_wav, duracion_trama=DURACION_TRAMA, tam_bloque=TAM_BLOQUE):
+    """Energía RMS por trama de un WAV mono, leído por bloques"""
+    import soundfile as sf
+    with sf.SoundFile(ruta_wav) as f:
+        muestras_trama = int(f.samplerate * duracion_trama)
+        tam_bloque = max(tam_bloque // muestras_trama, 1) * muestras_trama
+        energias = []
+        for bloque in f.blocks(blocksize=tam_bloque, dtype="float32", always_2d=True):
+            mono = bloque.mean(axis=1)
+            n = len(mono) // muestras_trama
+            if n:
+                tramas = mono[:n * muestras_trama].reshape(n, muestras_trama)
+                energias.append(np.sqrt(np.mean(tramas ** 2, axis=1)))
+    return np.concatenate(energias) if energias else np.zeros(0)
+
+
+def calcular_cortes(energia, duracion_trama=DURACION_TRAMA, duracion_fragmento=DURACION_FRAGMENTO,
+                    ventana=VENTANA_CORTE):
+    """Elige puntos de corte (en segundos) en el tramo más silencioso cerca de cada múltiplo de duracion_fragmento"""
+    duracion_total = len(energia) * duracion_trama
+    if duracion_total <= duracion_fragmento + ventana:
+        return []
+
+    # Suavizar ~300 ms para cortar en pausas reales y no en un cero puntual
+    ancho = max(int(0.3 / duracion_trama), 1)
+    suavizada = np.convolve(energia, np.ones(ancho) / ancho, mode="same")
+
+    cortes = []
+    objetivo = duracion_fragmento
+    while objetivo < duracion_total - ventana:
+        desde = int((objetivo - ventana) / duracion_trama)
+        hasta = int(min(objetivo + ventana, duracion_total) / duracion_trama)
+        corte = (desde + int(np.argmin(suavizada[desde:hasta]))) * duracion_trama
+        cortes.append(corte)
+        objetivo = corte + duracion_fragmento
+    return cortes
+
+
+def planificar_fragmentos(duracion_total, cortes, solape=SOLAPE_FRAGMENTO):
+    """Fragmentos con la región propia delimitada por los cortes y extendidos `solape` segundos a cada lado"""
+    limites = [0.0] + list(cortes) + [duracion_total]
+    return [
+        {
+            'inicio': max(propio_inicio - solape, 0.0),
+            'fin': min(propio_fin + solape, duracion_total),
+            'propio_inicio': propio_inicio,
+            'propio_fin': propio_fin,
+        }
+        for propio_inicio, propio_fin in zip(limites[:-1], limites[1:])
+    ]
+
+
+def _solape_temporal(a, b):
+    return max(0.0, min(a['offset'] + a['duration'], b['offset'] + b['duration']) - max(a['offset'], b['offset']))
+
+
+def unir_fragmentos(fragmentos, resultados):
+    """Une las transcripciones de fragmentos solapados en una sola línea de tiempo.
+
+    - Desplaza cada `offset` al tiempo absoluto del audio original.
+    - Conserva cada segmento solo en el fragmento dueño de su punto medio,
+      eliminando los duplicados de las zonas de solape.
+    - Reconcilia los hablantes: cada sesión numera los suyos de forma
+      independiente, así que se emparejan con los del fragmento anterior por
+      tiempo de habla coincidente en el solape.
+    """
+    return _unir(fragmentos, resultados)[0]
+
+
+def unir_palabras(fragmentos, resultados, palabras):
+    """Une segmentos y palabras por fragmento con los mismos criterios que unir_fragmentos.
+
+    Cada palabra sigue al segmento al que pertenece: se conserva si su segmento
+    se conserva, con el tiempo absoluto, el hablante global y el índice del
+    segmento en la transcripción unida. Devuelve (segmentos, TranscripcionPalabras).
+    """
+    unidos, mapas, indices = _unir(fragmentos, resultados)
+    partes = []
+    for fragmento, parte, mapa, indice in zip(fragmentos, palabras, mapas, indices):
+        if len(parte) and len(indice):
+            partes.append(parte.seleccionar(
+                indice[parte.segmentos] >= 0, fragmento['inicio'], mapa, indice,
+            ))
+    return unidos, TranscripcionPalabras.concatenar(partes)
+
+
+def _unir(fragmentos, resultados):
+    """Implementa unir_fragmentos y devuelve además, por fragmento, el mapa de
+    hablantes local→global y el índice de cada segmento en la salida (-1 si se descarta)"""
+    unidos = []
+    mapas = []
+    anteriores = []  # Segmentos absolutos (ya con hablante global) del fragmento previo
+    fin_anterior = 0.0
+    total_hablantes = 0
+
+    for fragmento, segmentos in zip(fragmentos, resultados):
+        absolutos = [dict(seg, offset=seg['offset'] + fragmento['inicio']) for seg in segmentos]
+
+        # Tiempo de habla compartido entre cada hablante local y cada hablante global previo
+        coincidencias = {}
+        for seg in absolutos:
+            if seg['offset'] >= fin_anterior:
+                continue
+            for previo in anteriores:
+                comun = _solape_temporal(seg, previo)
+                if comun > 0:
+                    par = (seg['speaker'], previo['speaker'])
+                    coincidencias[par] = coincidencias.get(par, 0.0) + comun
+
+        mapa = {}
+        usados = set()
+        for (local, global_), _ in sorted(coincidencias.items(), key=lambda x: -x[1]):
+            if local not in mapa and global_ not in usados:
+                mapa[local] = global_
+                usados.add(global_)
+        for seg in absolutos:
+            local = seg['speaker']
+            if local not in mapa:
+                if local in HABLANTES_DESCONOCIDOS:
+                    mapa[local] = local
+                else:
+                    total_hablantes += 1
+                    mapa[local] = f"Guest-{total_hablantes}"
+            seg['speaker'] = mapa[local]
+        mapas.append(mapa)
+
+        for i, seg in enumerate(absolutos):
+            medio = seg['offset'] + seg['duration'] / 2
+            if fragmento['propio_inicio'] <= medio < fragmento['propio_fin']:
+                unidos.append((seg['offset'], len(mapas) - 1, i, seg))
+        anteriores = absolutos
+        fin_anterior = fragmento['fin']
+
+    unidos.sort(key=lambda x: x[0])
+    indices = [np.full(len(segmentos), -1, dtype=np.int32) for segmentos in resultados]
+    for posicion, (_, k, i, _) in enumerate(unidos):
+        indices[k][i] = posicion
+    return [seg for *_, seg in unidos], mapas, indices
+
+
+def transcribir_en_paralelo(ruta_wav, idioma, max_hablantes, transcriptor=None, max_workers=4,
+                            duracion_fragmento=DURACION_FRAGMENTO, solape=SOLAPE_FRAGMENTO, al_progreso=None,
+                            palabras=None, punto_control=None):
+    """Divide el WAV en fragmentos solapados cortados en silencios y los transcribe en paralelo.
+
+    `transcriptor(fuente, idioma, max_hablantes)` recibe los bytes PCM del
+    fragmento (ver leer_pcm) y debe devolver (segmentos, error); por defecto es
+    una sesión de Azure, pero puede sustituirse por uno local.
+    Con un ConstructorPalabras en `palabras`, el transcriptor recibe además
+    `palabras=` con un constructor propio por fragmento y las palabras unidas
+    se añaden al final al de la llamada.
+    Con un PuntoControl en `punto_control`, cada fragmento terminado sin error
+    se registra y los ya registrados en un intento anterior no se repiten.
+    Devuelve (segmentos unidos, error del primer fragmento que falló o None).
+    """
+    import soundfile as sf
+    transcriptor = transcriptor or _transcribir_sesion
+
+    energia = energia_por_tramas(ruta_wav)
+    duracion_total = sf.info(ruta_wav).duration
+    cortes = calcular_cortes(energia, duracion_fragmento=duracion_fragmento)
+    fragmentos = planificar_fragmentos(duracion_total, cortes, solape)
+
+    constructores = [ConstructorPalabras() for _ in fragmentos] if palabras is not None else None
+
+    def trabajo(indice):
+        fragmento = fragmentos[indice]
+        fuente = leer_pcm(ruta_wav, fragmento['inicio'], fragmento['fin'])
+        if constructores is None:
+            return transcriptor(fuente, idioma, max_hablantes)
+        return transcriptor(fuente, idioma, max_hablantes, palabras=constructores[indice])
+
+    resultados = [None] * len(fragmentos)
+    partes = [None] * len(fragmentos)
+    hechos = punto_control.fragmentos() if punto_control is not None else {}
+    for indice, (segmentos, marcas) in hechos.items():
+        resultados[indice], partes[indice] = segmentos, marcas
+    if hechos:
+        metricas.contar("transcripcion_reanudada")
+    errores = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futuros = {pool.submit(metricas.en_contexto(trabajo), i): i for i in range(len(fragmentos)) if i not in hechos}
+        for completados, futuro in enumerate(as_completed(futuros), start=len(hechos) + 1):
+            indice = futuros[futuro]
+            segmentos, error_msg = futuro.result()
+            resultados[indice] = segmentos
+            if constructores is not None:
+                partes[indice] = constructores[indice].construir()
+            if error_msg:
+                errores.append(error_msg)
+            elif punto_control is not None:
+                punto_control.agregar_fragmento(indice, segmentos, partes[indice] or TranscripcionPalabras.vacia())
+            if al_progreso is not None:
+                al_progreso(completados, len(fragmentos))
+
+    error_msg = errores[0] if errores else None
+    if constructores is None:
+        return unir_fragmentos(fragmentos, resultados), error_msg
+    unidos, unidas = unir_palabras(fragmentos, resultados, partes)
+    palabras.extender(unidas)
+    return unidos, error_msg
+
+# ==============================
+# EXPORTACIÓN SRT / VTT / TXT / JSON / PARQUET
+# ==============================
+# Los exportadores de texto son generadores que producen el documento cue a
+# cue: una vista previa solo consume los primeros y una descarga se escribe por
+# trozos sin construir nunca la lista completa de líneas.
+TAM_TROZO_EXPORTACION = 64 * 1024
+
+
+def formato_tiempo(segundos):
+    horas = int(segundos // 3600)
+    minutos = int((segundos % 3600) // 60)
+    segs = int(segundos % 60)
+    milis = int((segundos - int(segundos)) * 1000)
+    return f"{horas:02}:{minutos:02}:{segs:02},{milis:03}"
+
+
+def iterar_srt(transcripcion):
+    for i, item in enumerate(transcripcion, start=1):
+        start = formato_tiempo(item['offset'])
+        end = formato_tiempo(item['offset'] + item['duration'])
+        speaker = f"Hablante {item['speaker']}"
+        separador = "" if i == 1 else "\n"
+        yield f"{separador}{i}\n{start} --> {end}\n[{speaker}] {item['text']}\n"
+
+
+def iterar_vtt(transcripcion):
+    yield "WEBVTT\n"
+    for item in transcripcion:
+        start = formato_tiempo(item['offset']).replace(",", ".")
+        end = formato_tiempo(item['offset'] + item['duration']).replace(",", ".")
+        speaker = f"Hablante {item['speaker']}"
+        yield f"\n{start} --> {end}\n<v {speaker}>{item['text']}\n"
+
+
+def iterar_txt(transcripcion):
+    for i, item in enumerate(transcripcion):
+        tiempo = formato_tiempo(item['offset'])
+        speaker = f"Hablante {item['speaker']}"
+        separador = "" if i == 0 else "\n\n"
+        yield f"{separador}[{tiempo}] {speaker}: {item['text']}"
+
+
+def iterar_json(transcripcion):
+    """Lista JSON de segmentos {speaker, offset, duration, text}, un segmento por línea"""
+    yield "["
+    for i, item in enumerate(transcripcion):
+        segmento = {clave: item[clave] for clave in ('speaker', 'offset', 'duration', 'text')}
+        separador = "" if i == 0 else ","
+        yield f"{separador}\n{json.dumps(segmento, ensure_ascii=False)}"
+    yield "\n]\n"
+
+
+def generar_srt(transcripcion):
+    return "".join(iterar_srt(transcripcion))
+
+
+def generar_vtt(transcripcion):
+    return "".join(iterar_vtt(transcripcion))
+
+
+def generar_txt(transcripcion):
+    return "".join(iterar_txt(transcripcion))
+
+
+def tabla_arrow(transcripcion):
+    """Transcripción como tabla Arrow columnar (hablante codificado como diccionario)"""
+    import pyarrow as pa
+    return pa.table({
+        "speaker": pa.array([item['speaker'] for item in transcripcion], type=pa.string()).dictionary_encode(),
+        "offset": pa.array([item['offset'] for item in transcripcion], type=pa.float64()),
+        "duration": pa.array([item['duration'] for item in transcripcion], type=pa.float64()),
+        "text": pa.array([item['text'] for item in transcripcion], type=pa.string()),
+    })
+
+
+def escribir_parquet(transcripcion, destino):
+    import pyarrow.parquet as pq
+    pq.write_table(tabla_arrow(transcripcion), destino, compression="zstd")
+
+
+def escribir_arrow(transcripcion, destino):
+    import pyarrow as pa
+    tabla = tabla_arrow(transcripcion)
+    with pa.ipc.new_file(destino, tabla.schema) as escritor:
+        escritor.write_table(tabla)
+
+
+# formato -> (generador de texto, extensión, mime)
+EXPORTADORES = {
+    "SRT": (iterar_srt, ".srt", "text/plain"),
+    "VTT": (iterar_vtt, ".vtt", "text/vtt"),
+    "TXT": (iterar_txt, ".txt", "text/plain"),
+    "JSON": (iterar_json, ".json", "application/json"),
+}
+
+# formato -> (escritor a un archivo binario, extensión, mime); requieren pyarrow
+EXPORTADORES_BINARIOS = {}
+if PYARROW_DISPONIBLE:
+    EXPORTADORES_BINARIOS = {
+        "PARQUET": (escribir_parquet, ".parquet", "application/vnd.apache.parquet"),
+        "ARROW": (escribir_arrow, ".arrow", "application/vnd.apache.arrow.file"),
+    }
+
+FORMATOS_EXPORTACION = [*EXPORTADORES, *EXPORTADORES_BINARIOS]
+
+
+def info_formato(formato):
+    """(extensión, mime) de un formato de exportación"""
+    _, extension, mime = EXPORTADORES.get(formato) or EXPORTADORES_BINARIOS[formato]
+    return extension, mime
+
+
+def exportar(transcripcion, formato, destino):
+    """Escribe la transcripción en `destino` (archivo binario abierto) por trozos"""
+    with metricas.etapa("exportacion", formato=formato, segmentos=len(transcripcion)):
+        _exportar(transcripcion, formato, destino)
+
+
+def _exportar(transcripcion, formato, destino):
+    if formato in EXPORTADORES_BINARIOS:
+        EXPORTADORES_BINARIOS[formato][0](transcripcion, destino)
+        return
+
+    generador = EXPORTADORES[formato][0]
+    trozo, tam = [], 0
+    for parte in generador(transcripcion):
+        trozo.append(parte)
+        tam += len(parte)
+        if tam >= TAM_TROZO_EXPORTACION:
+            destino.write("".join(trozo).encode("utf-8"))
+            trozo, tam = [], 0
+    if trozo:
+        destino.write("".join(trozo).encode("utf-8"))
+
+
+def exportar_a_cache(transcripcion, clave, formato):
+    """Ruta del documento exportado en la caché, generándolo por trozos solo la primera vez.
+
+    `clave` identifica el contenido de la transcripción (p. ej. su clave_transcripcion).
+    """
+    cache = obtener_cache()
+    extension, _ = info_formato(formato)
+    clave_exportacion = hashlib.sha256(f"{clave}|{formato}".encode()).hexdigest()
+    ruta = cache.obtener(clave_exportacion, extension)
+    if ruta is None:
+        with cache.temporal(extension) as temporal:
+            with open(temporal, "wb") as destino:
+                exportar(transcripcion, formato, destino)
+            ruta = cache.guardar_archivo(clave_exportacion, extension, temporal)
+    return ruta
+
+
+def vista_previa(transcripcion, formato, cues=6):
+    """Primeros `cues` elementos del documento (cabecera incluida), sin generar el resto"""
+    if formato not in EXPORTADORES:
+        formato = "JSON"  # Los formatos binarios se previsualizan como JSON
+    return "".join(itertools.islice(EXPORTADORES[formato][0](transcripcion), cues))
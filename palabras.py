@@ -0,0 +1,231 @@
+"""Almacén compacto y columnar de marcas de tiempo por palabra.
+
+Las palabras de toda la transcripción se guardan en arrays de NumPy (inicio y
+fin en milisegundos, hablante internado como índice, segmento al que
+pertenecen) y un único buffer de texto con los límites de cada palabra, en vez
+de un dict por palabra o por segmento.
+"""
+import array
+import json
+
+import numpy as np
+
+TICKS_POR_MS = 10_000  # El SDK de Speech expresa los tiempos en ticks de 100 ns
+
+
+class ConstructorPalabras:
+    """Acumula palabras desde los callbacks del SDK y construye un TranscripcionPalabras"""
+
+    def __init__(self):
+        self._inicios = array.array("q")
+        self._fines = array.array("q")
+        self._hablantes = array.array("H")
+        self._segmentos = array.array("l")
+        self._textos = []
+        self._ids_hablante = {}
+
+    def _id_hablante(self, hablante):
+        return self._ids_hablante.setdefault(hablante, len(self._ids_hablante))
+
+    def agregar(self, palabras, hablante, segmento):
+        """Añade palabras [(texto, inicio_ms, fin_ms), ...] de un segmento"""
+        id_hablante = self._id_hablante(hablante)
+        for texto, inicio, fin in palabras:
+            self._inicios.append(int(inicio))
+            self._fines.append(int(fin))
+            self._hablantes.append(id_hablante)
+            self._segmentos.append(segmento)
+            self._textos.append(texto)
+
+    def agregar_resultado_json(self, resultado_json, hablante, segmento):
+        """Añade las palabras del JSON de un resultado del SDK (NBest[0].Words, en ticks)"""
+        try:
+            mejor = json.loads(resultado_json)["NBest"][0]
+        except (ValueError, KeyError, IndexError, TypeError):
+            return
+        self.agregar(
+            (
+                (p["Word"], p["Offset"] // TICKS_POR_MS, (p["Offset"] + p["Duration"]) // TICKS_POR_MS)
+                for p in mejor.get("Words", [])
+            ),
+            hablante,
+            segmento,
+        )
+
+    def extender(self, palabras):
+        """Añade todas las palabras de un TranscripcionPalabras"""
+        traduccion = np.array([self._id_hablante(n) for n in palabras.nombres_hablante] or [0], dtype=np.uint16)
+        self._inicios.frombytes(palabras.inicios.astype(np.int64).tobytes())
+        self._fines.frombytes(palabras.fines.astype(np.int64).tobytes())
+        self._hablantes.frombytes(traduccion[palabras.hablantes].tobytes())
+        self._segmentos.extend(int(s) for s in palabras.segmentos)
+        self._textos.extend(palabras.palabra(i) for i in range(len(palabras)))
+
+    def construir(self):
+        hablantes = [None] * len(self._ids_hablante)
+        for hablante, i in self._ids_hablante.items():
+            hablantes[i] = hablante
+        return TranscripcionPalabras.desde_columnas(
+            np.frombuffer(self._inicios, dtype=np.int64),
+            np.frombuffer(self._fines, dtype=np.int64),
+            np.frombuffer(self._hablantes, dtype=np.uint16),
+            np.asarray(self._segmentos, dtype=np.int32),
+            self._textos,
+            hablantes,
+        )
+
+
+class TranscripcionPalabras:
+    """Palabras ordenadas por inicio, con búsquedas por tiempo en O(log n)"""
+
+    def __init__(self, inicios, fines, hablantes, segmentos, texto, limites, nombres_hablante):
+        self.inicios = inicios  # int32 ms
+        self.fines = fines  # int32 ms
+        self.hablantes = hablantes  # uint16, índice en nombres_hablante
+        self.segmentos = segmentos  # int32, índice del segmento de la transcripción
+        self.texto = texto  # Todas las palabras separadas por un espacio
+        self.limites = limites  # int64 (n+1): la palabra i es texto[limites[i]:limites[i+1]-1]
+        self.nombres_hablante = nombres_hablante
+
+    @classmethod
+    def desde_columnas(cls, inicios, fines, hablantes, segmentos, textos, nombres_hablante):
+        orden = np.argsort(inicios, kind="stable")
+        textos = [textos[i] for i in orden]
+        longitudes = np.fromiter((len(t) + 1 for t in textos), dtype=np.int64, count=len(textos))
+        limites = np.concatenate([[0], np.cumsum(longitudes)])
+        return cls(
+            inicios[orden].astype(np.int32), fines[orden].astype(np.int32),
+            hablantes[orden].astype(np.uint16), segmentos[orden].astype(np.int32),
+            "".join(t + " " for t in textos), limites, list(nombres_hablante),
+        )
+
+    @classmethod
+    def vacia(cls):
+        return ConstructorPalabras().construir()
+
+    def __len__(self):
+        return len(self.inicios)
+
+    def palabra(self, i):
+        return self.texto[self.limites[i]:self.limites[i + 1] - 1]
+
+    def _fila(self, i):
+        return {
+            'palabra': self.palabra(i),
+            'speaker': self.nombres_hablante[self.hablantes[i]],
+            'offset': int(self.inicios[i]) / 1000,
+            'duration': int(self.fines[i] - self.inicios[i]) / 1000,
+            'segmento': int(self.segmentos[i]),
+        }
+
+    def en_tiempo(self, segundos):
+        """Palabra que se estaba diciendo en el instante dado (o None si era silencio)"""
+        ms = segundos * 1000
+        i = int(np.searchsorted(self.inicios, ms, side="right")) - 1
+        if i < 0 or ms >= self.fines[i]:
+            return None
+        return self._fila(i)
+
+    def entre(self, desde, hasta):
+        """Texto dicho entre dos instantes (en segundos)"""
+        a = int(np.searchsorted(self.inicios, desde * 1000, side="left"))
+        b = int(np.searchsorted(self.inicios, hasta * 1000, side="right"))
+        return self.texto[self.limites[a]:self.limites[b]].rstrip() if b > a else ""
+
+    def seleccionar(self, mascara, desplazamiento=0.0, mapa_hablantes=None, mapa_segmentos=None):
+        """Subconjunto de palabras, opcionalmente desplazado en el tiempo y con hablantes/segmentos renombrados"""
+        indices = np.flatnonzero(mascara)
+        nombres = [
+            (mapa_hablantes or {}).get(nombre, nombre) for nombre in self.nombres_hablante
+        ]
+        segmentos = self.segmentos[indices]
+        if mapa_segmentos is not None:
+            segmentos = np.asarray(mapa_segmentos, dtype=np.int32)[segmentos]
+        desplazamiento_ms = int(round(desplazamiento * 1000))
+        return TranscripcionPalabras.desde_columnas(
+            self.inicios[indices].astype(np.int64) + desplazamiento_ms,
+            self.fines[indices].astype(np.int64) + desplazamiento_ms,
+            self.hablantes[indices], segmentos, [self.palabra(i) for i in indices], nombres,
+        )
+
+    def remapear_tiempos(self, inicio_ms, fin_ms):
+        """Copia con los tiempos transformados por funciones monótonas de ms (p. ej. vad.MapaOffsets)"""
+        return TranscripcionPalabras(
+            inicio_ms(self.inicios).astype(np.int32), fin_ms(self.fines).astype(np.int32), self.hablantes,
+            self.segmentos, self.texto, self.limites, self.nombres_hablante,
+        )
+
+    @classmethod
+    def concatenar(cls, partes):
+        """Une varios almacenes (con hablantes ya en un espacio de nombres común)"""
+        if not partes:
+            return cls.vacia()
+        ids = {}
+        inicios, fines, hablantes, segmentos, textos = [], [], [], [], []
+        for parte in partes:
+            traduccion = np.array(
+                [ids.setdefault(n, len(ids)) for n in parte.nombres_hablante] or [0], dtype=np.uint16
+            )
+            inicios.append(parte.inicios.astype(np.int64))
+            fines.append(parte.fines.astype(np.int64))
+            hablantes.append(traduccion[parte.hablantes] if len(parte) else parte.hablantes)
+            segmentos.append(parte.segmentos)
+            textos.extend(parte.palabra(i) for i in range(len(parte)))
+        nombres = [None] * len(ids)
+        for nombre, i in ids.items():
+            nombres[i] = nombre
+        return cls.desde_columnas(
+            np.concatenate(inicios), np.concatenate(fines), np.concatenate(hablantes),
+            np.concatenate(segmentos), textos, nombres,
+        )
+
+    def resegmentar(self, max_caracteres=42, max_duracion=6.0, max_pausa=0.8):
+        """Segmentos de subtítulo con cortes exactos por palabra.
+
+        Se abre un segmento nuevo al cambiar de hablante, tras una pausa de más
+        de `max_pausa` segundos o cuando el texto o la duración superarían los
+        límites del subtítulo.
+        """
+        segmentos = []
+        inicio = 0
+        caracteres = 0
+        for i in range(len(self)):
+            largo = self.limites[i + 1] - self.limites[i]
+            if i > inicio and (
+                self.hablantes[i] != self.hablantes[inicio]
+                or self.inicios[i] - self.fines[i - 1] > max_pausa * 1000
+                or caracteres + largo - 1 > max_caracteres
+                or self.fines[i] - self.inicios[inicio] > max_duracion * 1000
+            ):
+                segmentos.append(self._segmento(inicio, i))
+                inicio, caracteres = i, 0
+            caracteres += largo
+        if len(self):
+            segmentos.append(self._segmento(inicio, len(self)))
+        return segmentos
+
+    def _segmento(self, a, b):
+        return {
+            'speaker': self.nombres_hablante[self.hablantes[a]],
+            'offset': int(self.inicios[a]) / 1000,
+            'duration': int(self.fines[b - 1] - self.inicios[a]) / 1000,
+            'text': self.texto[self.limites[a]:self.limites[b]].rstrip(),
+        }
+
+    def guardar(self, destino):
+        """Serializa en formato .npz (destino: ruta o archivo binario abierto)"""
+        np.savez(
+            destino, inicios=self.inicios, fines=self.fines, hablantes=self.hablantes,
+            segmentos=self.segmentos, limites=self.limites,
+            texto=np.frombuffer(self.texto.encode("utf-8"), dtype=np.uint8),
+            nombres_hablante=np.array(json.dumps(self.nombres_hablante)),
+        )
+
+    @classmethod
+    def cargar(cls, origen):
+        with np.load(origen) as datos:
+            return cls(
+                datos["inicios"], datos["fines"], datos["hablantes"], datos["segmentos"],
+                datos["texto"].tobytes().decode("utf-8"), datos["limites"],
+                json.loads(str(datos["nombres_hablante"])),
+            )
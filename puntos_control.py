@@ -0,0 +1,140 @@
+"""Puntos de control de las transcripciones, para reanudarlas tras un corte.
+
+Mientras se transcribe un audio se va escribiendo un archivo JSONL: en modo
+secuencial, una línea por segmento reconocido (con sus palabras) en cuanto
+llega del servicio; en modo paralelo, una línea por fragmento terminado. Si el
+trabajo se cancela, el contenedor se reinicia o se corta la red, el siguiente
+intento lee el archivo y solo transcribe lo que falta. La primera línea
+identifica el audio: si no coincide, el archivo se descarta y se empieza de cero.
+
+No depende de Streamlit; lo usa motor.py.
+"""
+import json
+import os
+import threading
+
+from palabras import ConstructorPalabras
+
+
+class PuntoControl:
+    """Archivo JSONL con lo ya reconocido de una transcripción identificada por `clave`"""
+
+    def __init__(self, directorio, clave, identidad):
+        os.makedirs(directorio, exist_ok=True)
+        self.ruta = os.path.join(directorio, f"{clave}.jsonl")
+        self.identidad = identidad
+        self._lock = threading.Lock()
+        self.registros = self._leer()
+        # Reescribir solo las líneas válidas: si el proceso murió a mitad de una
+        # línea, las siguientes no deben quedar pegadas a ella
+        temporal = f"{self.ruta}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            for registro in [{'tipo': "cabecera", 'identidad': identidad}, *self.registros]:
+                f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        os.replace(temporal, self.ruta)
+        self._archivo = open(self.ruta, "a", encoding="utf-8")
+
+    def _leer(self):
+        """Registros de un intento anterior sobre el mismo audio (sin la cabecera)"""
+        registros = []
+        try:
+            with open(self.ruta, encoding="utf-8") as f:
+                for linea in f:
+                    try:
+                        registros.append(json.loads(linea))
+                    except ValueError:
+                        break  # Línea a medio escribir: lo confirmado termina aquí
+        except FileNotFoundError:
+            return []
+        if not registros or registros[0] != {'tipo': "cabecera", 'identidad': self.identidad}:
+            return []
+        return registros[1:]
+
+    def agregar(self, registro):
+        """Añade un registro y lo lleva a disco antes de volver"""
+        linea = json.dumps(registro, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._archivo.write(linea)
+            self._archivo.flush()
+            os.fsync(self._archivo.fileno())
+        self.registros.append(registro)
+
+    def cerrar(self):
+        with self._lock:
+            self._archivo.close()
+
+    def eliminar(self):
+        """Borra el punto de control de una transcripción que ya ha terminado bien"""
+        self.cerrar()
+        try:
+            os.remove(self.ruta)
+        except FileNotFoundError:
+            pass
+
+    # --- Modo secuencial: sesiones y segmentos ---
+    def iniciar_sesion(self, inicio, corte):
+        """Nueva sesión que reconoce desde `inicio` s; lo anterior a `corte` ya está confirmado"""
+        self.agregar({'tipo': "sesion", 'inicio': inicio, 'corte': corte})
+
+    def sesiones(self):
+        """Sesiones registradas [{inicio, corte, segmentos: [(segmento, palabras)]}]; offsets relativos a `inicio`"""
+        sesiones = []
+        for registro in self.registros:
+            if registro['tipo'] == "sesion":
+                sesiones.append({'inicio': registro['inicio'], 'corte': registro['corte'], 'segmentos': []})
+            elif registro['tipo'] == "segmento" and sesiones:
+                sesiones[-1]['segmentos'].append((registro['segmento'], registro['palabras']))
+        return sesiones
+
+    # --- Modo paralelo: fragmentos terminados ---
+    def agregar_fragmento(self, indice, segmentos, palabras):
+        """Registra un fragmento terminado con su TranscripcionPalabras"""
+        self.agregar({
+            'tipo': "fragmento", 'indice': indice, 'segmentos': segmentos,
+            'palabras': [
+                [palabras.palabra(i), int(palabras.inicios[i]), int(palabras.fines[i]),
+                 palabras.nombres_hablante[palabras.hablantes[i]], int(palabras.segmentos[i])]
+                for i in range(len(palabras))
+            ],
+        })
+
+    def fragmentos(self):
+        """{indice: (segmentos, TranscripcionPalabras)} de los fragmentos ya terminados"""
+        hechos = {}
+        for registro in self.registros:
+            if registro['tipo'] == "fragmento":
+                constructor = ConstructorPalabras()
+                for texto, inicio, fin, hablante, segmento in registro['palabras']:
+                    constructor.agregar([(texto, inicio, fin)], hablante, segmento)
+                hechos[registro['indice']] = (registro['segmentos'], constructor.construir())
+        return hechos
+
+
+class ConstructorRegistrado(ConstructorPalabras):
+    """ConstructorPalabras que escribe en el punto de control cada segmento con sus palabras.
+
+    Se pasa a la sesión como `palabras=` y su método `al_segmento` como
+    `al_segmento=`: la sesión añade primero las palabras de un segmento y
+    después avisa del segmento. `desplazamiento` (s) se suma a los offsets que
+    recibe `al_segmento` de la llamada, para informar en tiempo absoluto.
+    """
+
+    def __init__(self, punto_control, al_segmento=None, desplazamiento=0.0):
+        super().__init__()
+        self.punto_control = punto_control
+        self._al_segmento = al_segmento
+        self.desplazamiento = desplazamiento
+        self._pendientes = {}
+        self._siguiente = 0
+
+    def agregar(self, palabras, hablante, segmento):
+        palabras = [(texto, int(inicio), int(fin)) for texto, inicio, fin in palabras]
+        self._pendientes.setdefault(segmento, []).extend(palabras)
+        super().agregar(palabras, hablante, segmento)
+
+    def al_segmento(self, segmento):
+        palabras = self._pendientes.pop(self._siguiente, [])
+        self._siguiente += 1
+        self.punto_control.agregar({'tipo': "segmento", 'segmento': segmento, 'palabras': palabras})
+        if self._al_segmento is not None:
+            self._al_segmento(dict(segmento, offset=segmento['offset'] + self.desplazamiento))
@@ -0,0 +1,160 @@
+"""Transcripción por la API REST de audio corto de Azure Speech, para audios de cualquier duración.
+
+La API de audio corto solo acepta unos 60 s por petición. Un WAV PCM 16 kHz
+mono que cabe en ese límite se sube tal cual, en streaming (codificación
+chunked) directamente desde el archivo, sin leerlo entero en memoria. Los
+más largos, o en otro formato (se convierten antes con motor.convertir_a_wav),
+se cortan en los silencios en tramos de menos de un minuto que se envían a
+la vez; sus textos se unen en un único DisplayText con el offset de cada tramo.
+
+No depende de Streamlit; lo usa voz2.py.
+"""
+import functools
+import os
+import shutil
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import metricas
+from motor import (DURACION_TRAMA, calcular_cortes, convertir_a_wav, energia_por_tramas, leer_pcm,
+                   obtener_cache, planificar_fragmentos)
+from sintesis import post_con_reintentos
+
+LIMITE_AUDIO_CORTO = 60  # Segundos máximos por petición a la API de audio corto
+DURACION_TRAMO = 50  # Duración objetivo de cada tramo; el corte se busca en un silencio cercano
+VENTANA_TRAMO = 8  # DURACION_TRAMO + VENTANA_TRAMO < LIMITE_AUDIO_CORTO
+MAX_PETICIONES_STT = int(os.getenv("MAX_PETICIONES_STT", "4"))  # Tramos transcribiéndose a la vez
+TAM_TROZO_SUBIDA = 64 * 1024
+SR_STT = 16000
+
+
+class ErrorReconocimiento(Exception):
+    """Fallo de la API REST de audio corto; `respuesta` es la respuesta HTTP si la hubo"""
+
+    def __init__(self, mensaje, respuesta=None):
+        super().__init__(mensaje)
+        self.respuesta = respuesta
+
+
+@functools.lru_cache(maxsize=None)
+def obtener_ejecutor_stt():
+    return ThreadPoolExecutor(max_workers=MAX_PETICIONES_STT, thread_name_prefix="stt-rest")
+
+
+def cabecera_wav(bytes_datos, sr=SR_STT):
+    """Cabecera RIFF de 44 bytes para `bytes_datos` de PCM 16 bit mono"""
+    return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + bytes_datos, b"WAVE", b"fmt ", 16, 1, 1,
+                       sr, sr * 2, 2, 16, b"data", bytes_datos)
+
+
+def es_audio_corto(fuente):
+    """True si `fuente` (ruta o archivo abierto) es un WAV PCM 16 kHz mono que cabe en una petición"""
+    import soundfile as sf
+    try:
+        info = sf.info(fuente)
+    except RuntimeError:
+        return False
+    finally:
+        if hasattr(fuente, "seek"):
+            fuente.seek(0)
+    return (info.format == "WAV" and info.subtype == "PCM_16" and info.samplerate == SR_STT
+            and info.channels == 1 and info.duration <= LIMITE_AUDIO_CORTO)
+
+
+def _trozos_archivo(archivo, tam=TAM_TROZO_SUBIDA):
+    archivo.seek(0)
+    while True:
+        trozo = archivo.read(tam)
+        if not trozo:
+            return
+        yield trozo
+
+
+def _trozos_tramo(ruta_wav, inicio, fin):
+    muestras = int(fin * SR_STT) - int(inicio * SR_STT)
+    yield cabecera_wav(2 * muestras)
+    yield from leer_pcm(ruta_wav, inicio, fin)
+
+
+def _reconocer(crear_cuerpo, endpoint, clave, idioma):
+    """Resultado JSON de una petición de audio corto; el cuerpo se sube por trozos"""
+    respuesta = post_con_reintentos(
+        f"{endpoint}/speech/recognition/conversation/cognitiveservices/v1", "stt", cuerpo=crear_cuerpo,
+        params={"language": idioma}, headers={
+            "Ocp-Apim-Subscription-Key": clave,
+            "Content-Type": "audio/wav; codecs=audio/pcm; samplerate=16000",
+        })
+    if respuesta.status_code != 200:
+        raise ErrorReconocimiento(f"Error en la transcripción: {respuesta.status_code} - {respuesta.text}",
+                                  respuesta)
+    return respuesta.json()
+
+
+def _tramo(resultado, inicio):
+    return {
+        'offset': inicio + resultado.get("Offset", 0) / 10_000_000,
+        'duration': resultado.get("Duration", 0) / 10_000_000,
+        'text': resultado.get("DisplayText", ""),
+    }
+
+
+def preparar_wav(fuente):
+    """Ruta de un WAV 16 kHz mono equivalente a `fuente` (ruta o archivo abierto), en la caché"""
+    if isinstance(fuente, (str, os.PathLike)):
+        return convertir_a_wav(os.fspath(fuente))[0]
+    # Volcar la subida por trozos a disco: la conversión y los tramos leen por rangos.
+    # Si ya es WAV 16 kHz mono, el volcado pasa a la caché tal cual en vez de copiarse otra vez
+    with obtener_cache().temporal(".subida") as temporal:
+        with open(temporal, "wb") as f:
+            fuente.seek(0)
+            shutil.copyfileobj(fuente, f, TAM_TROZO_SUBIDA)
+        return convertir_a_wav(temporal, mover=True)[0]
+
+
+def transcribir_rest(fuente, endpoint, clave, idioma="es-ES", al_progreso=None):
+    """Transcribe `fuente` (ruta o archivo abierto) por la API de audio corto.
+
+    Devuelve {'DisplayText': texto completo, 'tramos': [{offset, duration, text}, ...]}.
+    `al_progreso(hechos, total)` se llama al terminar cada tramo.
+    """
+    import soundfile as sf
+    if es_audio_corto(fuente):
+        if isinstance(fuente, (str, os.PathLike)):
+            def crear_cuerpo():
+                with open(fuente, "rb") as archivo:
+                    yield from _trozos_archivo(archivo)
+        else:
+            def crear_cuerpo():
+                return _trozos_archivo(fuente)
+        with metricas.etapa("stt_rest", tramos=1):
+            resultado = _reconocer(crear_cuerpo, endpoint, clave, idioma)
+        tramos = [_tramo(resultado, 0.0)] if resultado.get("DisplayText") else []
+        if al_progreso is not None:
+            al_progreso(1, 1)
+        return {'DisplayText': " ".join(t['text'] for t in tramos), 'tramos': tramos}
+
+    ruta_wav = preparar_wav(fuente)
+    duracion = sf.info(ruta_wav).duration
+    cortes = calcular_cortes(energia_por_tramas(ruta_wav), DURACION_TRAMA, DURACION_TRAMO, VENTANA_TRAMO)
+    # Cortes en silencios: los tramos no necesitan solape
+    planes = planificar_fragmentos(duracion, cortes, solape=0.0)
+    ejecutor = obtener_ejecutor_stt()
+    futuros = [
+        ejecutor.submit(metricas.en_contexto(_reconocer),
+                        functools.partial(_trozos_tramo, ruta_wav, plan['inicio'], plan['fin']),
+                        endpoint, clave, idioma)
+        for plan in planes
+    ]
+    tramos = []
+    with metricas.etapa("stt_rest", tramos=len(planes), duracion_audio=duracion):
+        try:
+            for hechos, (plan, futuro) in enumerate(zip(planes, futuros), 1):
+                resultado = futuro.result()
+                if resultado.get("DisplayText"):
+                    tramos.append(_tramo(resultado, plan['inicio']))
+                if al_progreso is not None:
+                    al_progreso(hechos, len(planes))
+        finally:
+            for futuro in futuros:
+                futuro.cancel()
+    return {'DisplayText': " ".join(t['text'] for t in tramos), 'tramos': tramos}
@@ -0,0 +1,158 @@
+"""Resumen extractivo local (TF-IDF + TextRank), sin llamadas a Azure Language.
+
+Las oraciones de la transcripción se representan como vectores TF-IDF en una
+matriz dispersa y se puntúan con TextRank sobre el grafo de similitud coseno
+entre oraciones. El grafo no se construye nunca: cada iteración del método de
+la potencia multiplica por X·Xᵀ en dos productos dispersos, así que el coste
+crece con el número de palabras y no con el cuadrado de las oraciones, y una
+transcripción de una hora se resume en milisegundos.
+
+Las `oraciones` elegidas se reparten entre los hablantes según lo que habla
+cada uno (al menos una por hablante con peso suficiente), se descartan las
+casi repetidas y se devuelven en el orden de la conversación, como el
+resumen extractivo de Azure con sortBy=Offset.
+
+No depende de Streamlit; lo usa motor.py.
+"""
+import re
+
+import numpy as np
+
+AMORTIGUACION = 0.85
+MAX_ITERACIONES = 100
+TOLERANCIA = 1e-6
+MIN_PALABRAS_ORACION = 4  # Las oraciones más cortas ("Sí, claro.") no se eligen salvo que no haya otras
+MIN_PESO_HABLANTE = 0.05  # Fracción de las palabras a partir de la cual un hablante tiene oración garantizada
+MAX_SIMILITUD = 0.7  # Coseno por encima del cual una oración repite otra ya elegida
+
+_FIN_ORACION = re.compile(r"(?<=[.!?…])\s+")
+_PALABRA = re.compile(r"\w+")
+PALABRAS_VACIAS = frozenset("""
+a al algo ante antes aquí así aunque bien cada como con cual cuando de del desde donde dos el ella ellos
+en entre era es esa ese eso esta este esto está están estoy fue ha hay hasta la las le les lo los más me
+mi muy mucho nada ni no nos o os otra otro para pero poco por porque pues que qué se sea ser si sí sin
+sobre son su sus también tan te tiene todo todos tu tú un una uno unos va vamos y ya yo
+the and of to in is it that this for on with as are was be at by or an we you they i
+""".split())
+
+
+def dividir_oraciones(segmentos):
+    """[(texto, hablante, offset), ...] con las oraciones de cada segmento, en orden"""
+    oraciones = []
+    for seg in segmentos:
+        for texto in _FIN_ORACION.split(seg['text'].strip()):
+            if texto:
+                oraciones.append((texto, seg.get('speaker'), seg.get('offset', 0.0)))
+    return oraciones
+
+
+def matriz_tfidf(textos):
+    """Matriz dispersa (oraciones × términos) TF-IDF con tf sublineal y filas de norma 1"""
+    import scipy.sparse  # Solo al resumir: cargarlo al importar retrasaría el arranque de la app
+    vocabulario = {}
+    filas, columnas = [], []
+    for i, texto in enumerate(textos):
+        for palabra in _PALABRA.findall(texto.lower()):
+            if palabra not in PALABRAS_VACIAS and not palabra.isdigit():
+                filas.append(i)
+                columnas.append(vocabulario.setdefault(palabra, len(vocabulario)))
+    n = len(textos)
+    conteos = scipy.sparse.csr_matrix(
+        (np.ones(len(filas), dtype=np.float64), (filas, columnas)), shape=(n, len(vocabulario))
+    )
+    conteos.sum_duplicates()
+    conteos.data = 1 + np.log(conteos.data)
+    documentos = np.bincount(conteos.indices, minlength=len(vocabulario))
+    idf = np.log((1 + n) / (1 + documentos)) + 1
+    tfidf = conteos @ scipy.sparse.diags(idf)
+    normas = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+    return scipy.sparse.diags(np.divide(1.0, normas, out=np.zeros(n), where=normas > 0)) @ tfidf
+
+
+def puntuar_textrank(x):
+    """PageRank de cada oración en el grafo de similitudes X·Xᵀ (sin bucles), sin formar el grafo"""
+    n = x.shape[0]
+    propia = np.asarray(x.multiply(x).sum(axis=1)).ravel()  # 1, o 0 si la oración no tiene términos
+    grado = x @ (x.T @ np.ones(n)) - propia
+    conectadas = grado > 1e-12
+    puntuacion = np.full(n, 1.0 / n)
+    for _ in range(MAX_ITERACIONES):
+        pesos = np.divide(puntuacion, grado, out=np.zeros(n), where=conectadas)
+        reparto = x @ (x.T @ pesos) - propia * pesos
+        colgante = puntuacion[~conectadas].sum()  # Las oraciones aisladas reparten su peso entre todas
+        nueva = (1 - AMORTIGUACION) / n + AMORTIGUACION * (reparto + colgante / n)
+        if np.abs(nueva - puntuacion).sum() < TOLERANCIA:
+            return nueva
+        puntuacion = nueva
+    return puntuacion
+
+
+def _cupos(cantidad, palabras_hablante):
+    """{hablante: oraciones}: una por hablante con peso suficiente y el resto por restos mayores"""
+    total = sum(palabras_hablante.values())
+    pesos = {h: p / total for h, p in palabras_hablante.items()}
+    garantizados = [h for h, peso in pesos.items() if peso >= MIN_PESO_HABLANTE]
+    cupos = dict.fromkeys(pesos, 0)
+    if len(garantizados) <= cantidad:
+        for h in garantizados:
+            cupos[h] = 1
+    restantes = cantidad - sum(cupos.values())
+    ideales = {h: max(cantidad * peso - cupos[h], 0.0) for h, peso in pesos.items()}
+    suma_ideales = sum(ideales.values()) or 1.0
+    exactos = {h: restantes * ideal / suma_ideales for h, ideal in ideales.items()}
+    for h, exacto in exactos.items():
+        cupos[h] += int(exacto)
+    sobrantes = cantidad - sum(cupos.values())
+    for h in sorted(exactos, key=lambda h: exactos[h] - int(exactos[h]), reverse=True)[:sobrantes]:
+        cupos[h] += 1
+    return cupos
+
+
+def resumir_local(segmentos, oraciones=5, equilibrar_hablantes=True):
+    """Resumen extractivo de una transcripción: las `oraciones` más representativas, en orden"""
+    candidatas = dividir_oraciones(segmentos)
+    if not candidatas:
+        return ""
+    textos = [texto for texto, _, _ in candidatas]
+    x = matriz_tfidf(textos)
+    puntuacion = puntuar_textrank(x)
+    longitudes = np.array([len(texto.split()) for texto in textos])
+    elegibles = (longitudes >= MIN_PALABRAS_ORACION) & (x.getnnz(axis=1) > 0)
+    if not elegibles.any():
+        elegibles = x.getnnz(axis=1) > 0
+    if not elegibles.any():
+        elegibles[:] = True
+    orden = [i for i in np.argsort(-puntuacion, kind="stable") if elegibles[i]]
+    cantidad = min(oraciones, len(orden))
+
+    hablantes = [hablante for _, hablante, _ in candidatas]
+    if equilibrar_hablantes:
+        palabras_hablante = {}
+        for hablante, longitud in zip(hablantes, longitudes):
+            palabras_hablante[hablante] = palabras_hablante.get(hablante, 0) + int(longitud)
+        cupos = _cupos(cantidad, palabras_hablante)
+    else:
+        cupos = None
+
+    elegidas = []
+    similitud = np.zeros(x.shape[0])  # Máxima similitud de cada oración con las ya elegidas
+
+    def elegir(i):
+        elegidas.append(i)
+        np.maximum(similitud, (x @ x[i].T).toarray().ravel(), out=similitud)
+        similitud[i] = np.inf
+
+    # Primero cada hablante hasta su cupo; después, si alguno no tenía bastantes, las mejores que queden
+    for i in orden:
+        if len(elegidas) == cantidad:
+            break
+        if (cupos is None or cupos[hablantes[i]] > 0) and similitud[i] < MAX_SIMILITUD:
+            elegir(i)
+            if cupos is not None:
+                cupos[hablantes[i]] -= 1
+    for i in orden:
+        if len(elegidas) == cantidad:
+            break
+        if similitud[i] < MAX_SIMILITUD:
+            elegir(i)
+    return " ".join(textos[i] for i in sorted(elegidas))
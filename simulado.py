@@ -0,0 +1,311 @@
+"""Dobles locales de los servicios de Azure, para desarrollar, probar y medir sin claves ni red.
+
+- TranscriptorSimulado sustituye a una sesión de ConversationTranscriber:
+  genera segmentos y palabras sintéticos a partir de la duración del audio, a
+  la velocidad (factor de tiempo real) y con la latencia configuradas.
+- ServidorSimulado es un servidor HTTP local que imita las API REST de
+  Language (trabajos analyze-text), Speech (STT corto, TTS y lista de voces) y
+  Translator, con latencia configurable y respuestas 429 opcionales.
+
+Se activan con BACKEND=local (ver motor.configurar y voz2.py).
+"""
+import io
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+LATENCIA_SIMULADA = float(os.getenv("LATENCIA_SIMULADA", "0.05"))  # Segundos por petición / sesión
+FACTOR_TIEMPO_REAL_SIMULADO = float(os.getenv("FACTOR_TIEMPO_REAL_SIMULADO", "50"))  # Segundos de audio por segundo
+
+VOCABULARIO = (
+    "hoy hablamos de economía política música ciencia tecnología datos programa episodio invitado "
+    "pregunta respuesta historia mercado empresa proyecto idea tiempo mundo ciudad gente trabajo "
+    "futuro problema solución ejemplo momento verdad parte forma caso nuevo grande importante"
+).split()
+PALABRAS_POR_SEGUNDO = 2.5
+
+
+# ==============================
+# TRANSCRIPCIÓN SIMULADA
+# ==============================
+def _duracion_fuente(fuente):
+    """Segundos de audio de una ruta WAV o de un iterable de bytes PCM 16 kHz/16 bit (se consume entero)"""
+    import soundfile as sf
+    if isinstance(fuente, (str, os.PathLike)):
+        return sf.info(os.fspath(fuente)).duration
+    return sum(len(bloque) for bloque in fuente) / (2 * 16000)
+
+
+def frase_sintetica(rng, palabras):
+    texto = " ".join(rng.choice(VOCABULARIO) for _ in range(palabras))
+    return texto[:1].upper() + texto[1:] + "."
+
+
+class TranscriptorSimulado:
+    """Transcriptor con la firma de motor._transcribir_sesion y salida sintética reproducible"""
+
+    def __init__(self, factor_tiempo_real=FACTOR_TIEMPO_REAL_SIMULADO, latencia=LATENCIA_SIMULADA,
+                 duracion_segmento=4.0, hablantes=3, error=None, semilla=0):
+        self.factor_tiempo_real = factor_tiempo_real
+        self.latencia = latencia
+        self.duracion_segmento = duracion_segmento
+        self.hablantes = hablantes
+        self.error = error
+        self.semilla = semilla
+
+    def segmentos(self, duracion, max_hablantes):
+        """Segmentos sintéticos [(segmento, [(palabra, inicio_ms, fin_ms), ...]), ...] para `duracion` segundos"""
+        rng = random.Random(self.semilla)
+        hablantes = max(min(self.hablantes, max_hablantes), 1)
+        turno = 0
+        resultado = []
+        t = 0.0
+        while duracion - t >= 0.5:
+            largo = min(rng.uniform(0.5, 1.5) * self.duracion_segmento, duracion - t)
+            if rng.random() < 0.3:
+                turno = (turno + 1) % hablantes
+            n = max(int(largo * PALABRAS_POR_SEGUNDO), 1)
+            texto = frase_sintetica(rng, n)
+            paso = largo * 1000 / n
+            inicio_ms = t * 1000
+            palabras = [
+                (palabra, int(inicio_ms + i * paso), int(inicio_ms + (i + 0.8) * paso))
+                for i, palabra in enumerate(texto.rstrip(".").split())
+            ]
+            segmento = {'speaker': f"Guest-{turno + 1}", 'offset': t, 'duration': largo, 'text': texto}
+            resultado.append((segmento, palabras))
+            t += largo + rng.uniform(0.2, 1.0)
+        return resultado
+
+    def __call__(self, fuente, idioma, max_hablantes, al_segmento=None, palabras=None):
+        duracion = _duracion_fuente(fuente)
+        time.sleep(self.latencia)
+        segmentos = []
+        reloj = time.monotonic()
+        for indice, (segmento, marcas) in enumerate(self.segmentos(duracion, max_hablantes)):
+            # Entregar cada segmento cuando "terminaría" de reconocerse al factor configurado
+            espera = reloj + (segmento['offset'] + segmento['duration']) / self.factor_tiempo_real - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            if palabras is not None:
+                palabras.agregar(marcas, segmento['speaker'], indice)
+            segmentos.append(segmento)
+            if al_segmento is not None:
+                al_segmento(segmento)
+        return segmentos, self.error
+
+
+# ==============================
+# SERVIDOR HTTP SIMULADO
+# ==============================
+def _trama_mp3_silencio():
+    """Una trama MPEG-2 Layer III (16 kHz, mono, 128 kbps) de silencio: 36 ms de audio en 576 bytes"""
+    cabecera = bytes([0xFF, 0xF3, 0xC8, 0xC0])
+    return cabecera + bytes(576 - len(cabecera))
+
+
+TRAMA_MP3 = _trama_mp3_silencio()
+SEGUNDOS_TRAMA_MP3 = 576 / 16000
+CARACTERES_POR_SEGUNDO_VOZ = 15
+LIMITE_AUDIO_CORTO = 60  # Segundos máximos que acepta la API REST de audio corto
+
+
+def wav_silencio(segundos, sr=16000):
+    """WAV PCM 16 bit mono de `segundos` de silencio, como la salida riff-16khz-16bit-mono-pcm"""
+    import soundfile as sf
+    buffer = io.BytesIO()
+    sf.write(buffer, np.zeros(int(segundos * sr), dtype=np.int16), sr, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def _frases(texto):
+    return [f for f in re.split(r"(?<=[.!?])\s+", texto.strip()) if f]
+
+
+class _ManejadorSimulado(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _responder(self, estado, cuerpo=b"", tipo="application/json", cabeceras=None):
+        if not isinstance(cuerpo, bytes):
+            cuerpo = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _leer_cuerpo(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            trozos = []
+            while True:
+                tam = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+                if tam == 0:
+                    while self.rfile.readline().strip():  # Cabeceras finales, si las hay
+                        pass
+                    return b"".join(trozos)
+                trozos.append(self.rfile.read(tam))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _limitado(self, servicio):
+        """Simula la limitación de Azure: responde 429 con la probabilidad configurada"""
+        servidor = self.server
+        servidor.contar(servicio)
+        if servidor.tasa_429 and servidor.rng.random() < servidor.tasa_429:
+            self._responder(429, {"error": {"code": "429", "message": "Rate limit exceeded"}},
+                            cabeceras={"Retry-After": "0"})
+            return True
+        time.sleep(servidor.latencia)
+        return False
+
+    def do_POST(self):
+        cuerpo = self._leer_cuerpo()
+        ruta = urlparse(self.path)
+        if ruta.path.endswith("/language/analyze-text/jobs"):
+            if self._limitado("language"):
+                return
+            trabajo = self.server.crear_trabajo(json.loads(cuerpo))
+            url = f"{self.server.url}/language/analyze-text/jobs/{trabajo}"
+            self._responder(202, cabeceras={"Operation-Location": url})
+        elif ruta.path.endswith("/cognitiveservices/v1") and "/speech/recognition/" in ruta.path:
+            if self._limitado("stt"):
+                return
+            segundos = len(cuerpo) / (2 * 16000)
+            if segundos > LIMITE_AUDIO_CORTO:
+                self._responder(400, {"error": {"code": "InvalidPayload", "message": "Audio too long"}})
+                return
+            rng = random.Random(len(cuerpo))
+            texto = " ".join(
+                frase_sintetica(rng, 8) for _ in range(max(int(segundos * PALABRAS_POR_SEGUNDO / 8), 1))
+            )
+            self._responder(200, {"RecognitionStatus": "Success", "DisplayText": texto,
+                                  "Offset": 0, "Duration": int(segundos * 10_000_000)})
+        elif ruta.path.endswith("/cognitiveservices/v1"):
+            if self._limitado("tts"):
+                return
+            ssml = cuerpo.decode("utf-8")
+            texto = re.sub(r"<[^>]+>", " ", ssml)
+            segundos = len(" ".join(texto.split())) / CARACTERES_POR_SEGUNDO_VOZ
+            velocidad = re.search(r"rate='([+-]?\d+)%'", ssml)
+            if velocidad:
+                segundos /= 1 + int(velocidad.group(1)) / 100
+            if self.headers.get("X-Microsoft-OutputFormat", "").startswith("riff-16khz-16bit-mono-pcm"):
+                self._responder(200, wav_silencio(segundos), tipo="audio/wav")
+            else:
+                self._responder(200, TRAMA_MP3 * max(int(segundos / SEGUNDOS_TRAMA_MP3), 1), tipo="audio/mpeg")
+        elif ruta.path.endswith("/translate"):
+            if self._limitado("translator"):
+                return
+            destino = parse_qs(ruta.query).get("to", ["es"])[0]
+            self._responder(200, [
+                {"translations": [{"text": elemento["text"], "to": destino}]} for elemento in json.loads(cuerpo)
+            ])
+        else:
+            self._responder(404, {"error": {"code": "NotFound", "message": ruta.path}})
+
+    def do_GET(self):
+        ruta = urlparse(self.path)
+        if "/language/analyze-text/jobs/" in ruta.path:
+            if self._limitado("language"):
+                return
+            estado = self.server.estado_trabajo(ruta.path.rsplit("/", 1)[1])
+            self._responder(200 if estado is not None else 404, estado or {})
+        elif ruta.path.endswith("/voices/list"):
+            if self._limitado("voces"):
+                return
+            self._responder(200, [
+                {"ShortName": nombre, "Locale": nombre[:5]}
+                for nombre in ("es-ES-ElviraNeural", "es-ES-AlvaroNeural", "es-MX-DaliaNeural", "en-US-JennyNeural")
+            ])
+        else:
+            self._responder(404, {"error": {"code": "NotFound", "message": ruta.path}})
+
+
+class ServidorSimulado(ThreadingHTTPServer):
+    """Servidor local en un puerto libre que imita las API REST de Azure usadas por la app"""
+
+    daemon_threads = True
+
+    def __init__(self, latencia=LATENCIA_SIMULADA, duracion_trabajo=0.3, tasa_429=0.0, semilla=0):
+        super().__init__(("127.0.0.1", 0), _ManejadorSimulado)
+        self.latencia = latencia
+        self.duracion_trabajo = duracion_trabajo
+        self.tasa_429 = tasa_429
+        self.rng = random.Random(semilla)
+        self.url = f"http://127.0.0.1:{self.server_port}"
+        self.peticiones = {}
+        self._trabajos = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._hilo = None
+
+    def contar(self, servicio):
+        with self._lock:
+            self.peticiones[servicio] = self.peticiones.get(servicio, 0) + 1
+
+    def crear_trabajo(self, cuerpo):
+        with self._lock:
+            trabajo = str(next(self._ids))
+            self._trabajos[trabajo] = (time.monotonic(), cuerpo)
+        return trabajo
+
+    def estado_trabajo(self, trabajo):
+        """Estado de un trabajo analyze-text: 'running' hasta cumplir duracion_trabajo"""
+        with self._lock:
+            if trabajo not in self._trabajos:
+                return None
+            creado, cuerpo = self._trabajos[trabajo]
+        if time.monotonic() - creado < self.duracion_trabajo:
+            return {"status": "running"}
+        tarea = cuerpo["tasks"][0]
+        frases_resumen = tarea.get("parameters", {}).get("sentenceCount", 3)
+        documentos = []
+        for documento in cuerpo["analysisInput"]["documents"]:
+            frases = _frases(documento["text"])[:frases_resumen]
+            if tarea["kind"] == "ExtractiveSummarization":
+                documentos.append({"id": documento["id"], "sentences": [{"text": f} for f in frases]})
+            else:
+                documentos.append({"id": documento["id"], "summaries": [{"text": " ".join(frases)}]})
+        return {"status": "succeeded", "tasks": {"items": [{"results": {"documents": documentos}}]}}
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self.serve_forever, name="servidor-simulado", daemon=True)
+            self._hilo.start()
+        return self
+
+    def detener(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
+
+
+_servidor = None
+_servidor_lock = threading.Lock()
+
+
+def obtener_servidor():
+    """Servidor simulado del proceso, ya arrancado"""
+    global _servidor
+    with _servidor_lock:
+        if _servidor is None:
+            _servidor = ServidorSimulado().iniciar()
+        return _servidor
@@ -0,0 +1,231 @@
+"""Texto a voz con Azure Speech (REST): síntesis por frases en paralelo y caché de audio en disco.
+
+El texto se divide en frases y cada una se sintetiza en su propia petición,
+varias a la vez sobre la sesión HTTP compartida. Las tramas MP3 se concatenan
+en el orden del texto, así que el audio de la primera frase está listo en
+cuanto llega su respuesta (ver sintetizar_por_bloques). Cada frase se guarda en una caché LRU en disco
+direccionada por (voz, formato de salida, hash del texto): repetir una frase
+con la misma voz no vuelve a llamar al servicio.
+
+No depende de Streamlit; lo usa voz2.py.
+"""
+import collections
+import functools
+import hashlib
+import itertools
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape, quoteattr
+
+import metricas
+from limitador import obtener_limitador
+from motor import CACHE_DIR, CacheDisco, _segundos_retry_after, obtener_sesion_http
+
+FORMATO_TTS = "audio-16khz-128kbitrate-mono-mp3"
+MAX_PETICIONES_TTS = int(os.getenv("MAX_PETICIONES_TTS", "4"))  # Frases sintetizándose a la vez
+MAX_CARACTERES_FRASE = 1000  # Las frases más largas se parten por comas o espacios
+REINTENTOS_HTTP = 5
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR") or os.path.join(CACHE_DIR, "tts")
+TTS_CACHE_MAX_MB = int(os.getenv("TTS_CACHE_MAX_MB", "256"))
+
+_FIN_FRASE = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+
+class ErrorSintesis(Exception):
+    """Fallo al sintetizar voz con Azure Speech; `respuesta` es la respuesta HTTP si la hubo"""
+
+    def __init__(self, mensaje, respuesta=None):
+        super().__init__(mensaje)
+        self.respuesta = respuesta
+
+
+@functools.lru_cache(maxsize=None)
+def obtener_cache_tts():
+    return CacheDisco(TTS_CACHE_DIR, TTS_CACHE_MAX_MB * 1024 * 1024)
+
+
+@functools.lru_cache(maxsize=None)
+def obtener_ejecutor_tts():
+    """Hilos compartidos por todas las síntesis del proceso"""
+    return ThreadPoolExecutor(max_workers=MAX_PETICIONES_TTS, thread_name_prefix="tts")
+
+
+def resultados_en_orden(tareas, ventana=MAX_PETICIONES_TTS):
+    """Ejecuta en los hilos de TTS las funciones sin argumentos de `tareas` y genera sus resultados en orden.
+
+    Cada llamada tiene como mucho `ventana` tareas en el pool a la vez. La cola
+    del pool es FIFO: si un doblaje de cientos de segmentos las enviara todas de
+    golpe, las frases de las demás sesiones esperarían detrás sin llegar al
+    limitador compartido, que es el que reparte los turnos entre clientes.
+    """
+    ejecutor = obtener_ejecutor_tts()
+    tareas = iter(tareas)
+    futuros = collections.deque(
+        ejecutor.submit(metricas.en_contexto(tarea)) for tarea in itertools.islice(tareas, ventana)
+    )
+    try:
+        while futuros:
+            resultado = futuros.popleft().result()
+            for tarea in itertools.islice(tareas, 1):
+                futuros.append(ejecutor.submit(metricas.en_contexto(tarea)))
+            yield resultado
+    finally:
+        for futuro in futuros:
+            futuro.cancel()
+
+
+def _partir_frase(frase, max_caracteres):
+    """Parte una frase demasiado larga por la última coma (o espacio) antes del límite"""
+    trozos = []
+    while len(frase) > max_caracteres:
+        corte = max(frase.rfind(", ", 0, max_caracteres), frase.rfind("; ", 0, max_caracteres))
+        if corte <= 0:
+            corte = frase.rfind(" ", 0, max_caracteres)
+        corte = corte + 1 if corte > 0 else max_caracteres
+        trozos.append(frase[:corte].strip())
+        frase = frase[corte:].strip()
+    if frase:
+        trozos.append(frase)
+    return trozos
+
+
+def dividir_frases(texto, max_caracteres=MAX_CARACTERES_FRASE):
+    """Frases del texto, en orden, ninguna de más de `max_caracteres`"""
+    frases = []
+    for frase in _FIN_FRASE.split(texto.strip()):
+        frase = " ".join(frase.split())
+        if frase:
+            frases.extend(_partir_frase(frase, max_caracteres))
+    return frases
+
+
+def clave_tts(texto, voz, formato=FORMATO_TTS, velocidad=1.0):
+    """Clave de caché de una frase: voz, formato de salida, velocidad y hash del texto"""
+    return hashlib.sha256(f"{voz}\0{formato}\0{velocidad:g}\0{texto}".encode("utf-8")).hexdigest()
+
+
+def _ssml(texto, voz, velocidad=1.0):
+    idioma = "-".join(voz.split("-")[:2]) or "es-ES"
+    contenido = escape(texto)
+    if velocidad != 1.0:
+        contenido = f"<prosody rate='{(velocidad - 1) * 100:+.0f}%'>{contenido}</prosody>"
+    return (f"<speak version='1.0' xml:lang={quoteattr(idioma)}>"
+            f"<voice xml:lang={quoteattr(idioma)} name={quoteattr(voz)}>{contenido}</voice></speak>")
+
+
+def peticion_con_reintentos(metodo, url, servicio, cuerpo=None, **kwargs):
+    """Petición por la sesión compartida que reintenta 429/503 respetando Retry-After.
+
+    Cada intento espera su turno en el limitador compartido de `servicio` (ver
+    limitador.py), y un 429/503 lo frena para todo el proceso. `servicio` da
+    nombre también a los contadores de métricas. Devuelve la última
+    respuesta, con éxito o no.
+    `cuerpo`, si se indica, es una función que crea el cuerpo de cada intento (p. ej. un
+    generador, que requests envía con codificación chunked y no se puede reenviar).
+    """
+    sesion = obtener_sesion_http()
+    limitador = obtener_limitador(servicio)
+    kwargs.setdefault("timeout", 60)
+    espera = 0.5
+    for intento in range(REINTENTOS_HTTP + 1):
+        metricas.contar(f"{servicio}_peticiones")
+        if cuerpo is not None:
+            kwargs["data"] = cuerpo()
+        with limitador.turno():
+            respuesta = sesion.request(metodo, url, **kwargs)
+        if respuesta.status_code not in (429, 503) or intento == REINTENTOS_HTTP:
+            return respuesta
+        metricas.contar(f"{servicio}_reintentos")
+        espera = _segundos_retry_after(respuesta, min(espera * 2, 8.0))
+        limitador.frenar(espera)
+
+
+def post_con_reintentos(url, servicio, cuerpo=None, **kwargs):
+    """POST con peticion_con_reintentos"""
+    return peticion_con_reintentos("POST", url, servicio, cuerpo, **kwargs)
+
+
+def listar_voces(endpoint, clave, idioma="es", timeout=5):
+    """ShortName de las voces cuyo locale empieza por `idioma`; lanza requests.RequestException si falla"""
+    respuesta = peticion_con_reintentos("GET", f"{endpoint}/cognitiveservices/voices/list", "tts",
+                                        headers={"Ocp-Apim-Subscription-Key": clave}, timeout=timeout)
+    respuesta.raise_for_status()
+    voces = []
+    for v in respuesta.json():
+        locale = v.get("Locale") or v.get("locale") or v.get("LocaleName")
+        nombre = v.get("ShortName") or v.get("Name") or v.get("shortName")
+        if locale and nombre and str(locale).lower().startswith(idioma):
+            voces.append(nombre)
+    return voces
+
+
+def _peticion_tts(texto, voz, endpoint, clave, formato, velocidad=1.0):
+    respuesta = post_con_reintentos(
+        f"{endpoint}/cognitiveservices/v1", "tts", data=_ssml(texto, voz, velocidad).encode("utf-8"), headers={
+            "Ocp-Apim-Subscription-Key": clave,
+            "Content-Type": "application/ssml+xml",
+            "X-Microsoft-OutputFormat": formato,
+            "User-Agent": "curso-ia-speech-ejemplo",
+        })
+    if respuesta.status_code != 200:
+        raise ErrorSintesis(f"Error al generar el audio: {respuesta.status_code}", respuesta)
+    return respuesta.content
+
+
+def sintetizar_frase(texto, voz, endpoint, clave, formato=FORMATO_TTS, cache=None, velocidad=1.0):
+    """Audio de una frase, desde la caché si ya se sintetizó con la misma voz, formato y velocidad"""
+    clave_cache = clave_tts(texto, voz, formato, velocidad)
+    if cache is not None:
+        ruta = cache.obtener(clave_cache, ".audio")
+        if ruta is not None:
+            metricas.contar("tts_cache")
+            with open(ruta, "rb") as f:
+                return f.read()
+    audio = _peticion_tts(texto, voz, endpoint, clave, formato, velocidad)
+    if cache is not None:
+        cache.guardar_bytes(clave_cache, ".audio", audio)
+    return audio
+
+
+def sintetizar_por_frases(frases, voz, endpoint, clave, formato=FORMATO_TTS, cache=True):
+    """Genera el audio de cada frase en orden mientras las siguientes se sintetizan en paralelo.
+
+    `cache=True` usa la caché del proceso, `None` la desactiva (o se pasa otra CacheDisco).
+    """
+    if cache is True:
+        cache = obtener_cache_tts()
+    yield from resultados_en_orden(
+        functools.partial(sintetizar_frase, frase, voz, endpoint, clave, formato, cache) for frase in frases
+    )
+
+
+def sintetizar_por_bloques(texto, voz, endpoint, clave, formato=FORMATO_TTS, cache=True):
+    """Genera (audio, frases hechas, total de frases) por bloques de frases consecutivas.
+
+    El primer bloque es solo la primera frase, para empezar a reproducir en
+    cuanto llega su respuesta; cada bloque siguiente tiene el doble de frases,
+    así que dura más de lo que tarda en llegar el próximo y hay pocos bloques.
+    Concatenar los bloques da el mismo audio que sintetizar().
+    """
+    frases = dividir_frases(texto)
+    bloque, tam = [], 1
+    with metricas.etapa("tts", voz=voz, caracteres=len(texto), frases=len(frases)):
+        for hechas, parte in enumerate(sintetizar_por_frases(frases, voz, endpoint, clave, formato, cache), 1):
+            bloque.append(parte)
+            if len(bloque) == tam or hechas == len(frases):
+                yield b"".join(bloque), hechas, len(frases)
+                bloque, tam = [], tam * 2
+
+
+def sintetizar(texto, voz, endpoint, clave, formato=FORMATO_TTS, cache=True, al_progreso=None):
+    """Audio MP3 completo del texto; `al_progreso(hechas, total)` se llama tras cada frase"""
+    frases = dividir_frases(texto)
+    partes = []
+    with metricas.etapa("tts", voz=voz, caracteres=len(texto), frases=len(frases)):
+        for parte in sintetizar_por_frases(frases, voz, endpoint, clave, formato, cache):
+            partes.append(parte)
+            if al_progreso is not None:
+                al_progreso(len(partes), len(frases))
+    # Las tramas MP3 son independientes: concatenarlas da un flujo reproducible
+    return b"".join(partes)
@@ -0,0 +1,78 @@
+"""Sesión de Speech alimentada por un PushAudioInputStream cuyo origen de bytes falla a medias"""
+import threading
+import types
+
+import pytest
+
+import motor
+
+speechsdk = pytest.importorskip("azure.cognitiveservices.speech")
+
+
+class _Senal:
+    def __init__(self):
+        self.callbacks = []
+
+    def connect(self, callback):
+        self.callbacks.append(callback)
+
+    def emitir(self, evento):
+        for callback in self.callbacks:
+            callback(evento)
+
+
+class TranscriptorFalso:
+    """ConversationTranscriber que reconoce un segmento y termina la sesión, sin red"""
+
+    def __init__(self, speech_config, audio_config):
+        self.transcribed = _Senal()
+        self.session_stopped = _Senal()
+        self.canceled = _Senal()
+
+    def start_transcribing_async(self):
+        def sesion():
+            resultado = types.SimpleNamespace(
+                reason=speechsdk.ResultReason.RecognizedSpeech, speaker_id="Guest-1",
+                offset=0, duration=10_000_000, text="Hola.", json="{}",
+            )
+            self.transcribed.emitir(types.SimpleNamespace(result=resultado))
+            self.session_stopped.emitir(None)
+
+        threading.Thread(target=sesion, daemon=True).start()
+        return types.SimpleNamespace(get=lambda: None)
+
+
+def _pcm_truncado(bloques_buenos=3):
+    for _ in range(bloques_buenos):
+        yield b"\0\0" * 1600
+    raise RuntimeError("Error decoding")
+
+
+@pytest.fixture
+def sesion_falsa(monkeypatch):
+    monkeypatch.setattr(speechsdk.transcription, "ConversationTranscriber", TranscriptorFalso)
+    monkeypatch.setattr(motor, "SPEECH_KEY", "clave")
+    monkeypatch.setattr(motor, "REGION", "westeurope")
+
+
+def test_alimentador_guarda_el_error():
+    _, alimentador = motor._crear_entrada_audio(_pcm_truncado())
+    alimentador.start()
+    alimentador.join(5)
+
+    assert not alimentador.is_alive()
+    assert isinstance(alimentador.error, RuntimeError)
+
+
+def test_sesion_con_audio_truncado_devuelve_error(sesion_falsa):
+    segmentos, error = motor._ejecutar_sesion(_pcm_truncado(), "es-ES", 2, None)
+
+    assert segmentos and error is not None
+    assert "Error decoding" in error
+
+
+def test_sesion_con_audio_completo_sin_error(sesion_falsa):
+    segmentos, error = motor._ejecutar_sesion(iter([b"\0\0" * 1600] * 3), "es-ES", 2, None)
+
+    assert error is None
+    assert [s['text'] for s in segmentos] == ["Hola."]
@@ -0,0 +1,144 @@
+"""transcribir_en_paralelo con un transcriptor local: corte, dueño por punto medio y hablantes"""
+import numpy as np
+import pytest
+import soundfile as sf
+
+import limitador
+import metricas
+import motor
+from palabras import ConstructorPalabras
+from simulado import TranscriptorSimulado
+
+SR = 16000
+DURACION = 200.0
+DURACION_FRAGMENTO = 60
+SOLAPE = 15
+
+
+class TranscriptorGuion:
+    """Transcribe cada fragmento según un guion global generado con TranscriptorSimulado.
+
+    Como una sesión real, solo ve el audio del fragmento: localiza su inicio en el
+    audio completo por sus bytes, recorta los segmentos que cruzan los bordes y
+    numera los hablantes por orden de aparición dentro del fragmento.
+    """
+
+    def __init__(self, pcm, guion):
+        self.pcm = pcm
+        self.guion = guion
+
+    def __call__(self, fuente, idioma, max_hablantes, palabras=None):
+        datos = b"".join(fuente)
+        posicion = self.pcm.find(datos[:256])
+        assert posicion >= 0 and posicion % 2 == 0
+        inicio = posicion / 2 / SR
+        fin = inicio + len(datos) / 2 / SR
+
+        locales = {}
+        segmentos = []
+        for segmento, marcas in self.guion:
+            desde = max(segmento['offset'], inicio)
+            hasta = min(segmento['offset'] + segmento['duration'], fin)
+            if hasta <= desde:
+                continue
+            hablante = locales.setdefault(segmento['speaker'], f"Guest-{len(locales) + 1}")
+            if palabras is not None:
+                palabras.agregar(
+                    [(p, a - inicio * 1000, b - inicio * 1000) for p, a, b in marcas
+                     if desde * 1000 <= (a + b) / 2 < hasta * 1000],
+                    hablante, len(segmentos),
+                )
+            segmentos.append({'speaker': hablante, 'offset': desde - inicio, 'duration': hasta - desde,
+                              'text': segmento['text']})
+        return segmentos, None
+
+
+@pytest.fixture(params=[2, 3], ids=lambda n: f"{n}_hablantes")
+def episodio(request, tmp_path):
+    guion = TranscriptorSimulado(hablantes=request.param, semilla=7).segmentos(DURACION, request.param)
+    rng = np.random.default_rng(7)
+    muestras = rng.integers(-3, 4, int(DURACION * SR)).astype(np.int16)  # Ruido de fondo: todo instante es único
+    for segmento, _ in guion:
+        desde = int(segmento['offset'] * SR)
+        hasta = int((segmento['offset'] + segmento['duration']) * SR)
+        muestras[desde:hasta] = rng.integers(-3000, 3000, hasta - desde)
+    ruta = tmp_path / "episodio.wav"
+    sf.write(ruta, muestras, SR, subtype="PCM_16")
+    return str(ruta), guion, TranscriptorGuion(muestras.astype("<i2").tobytes(), guion)
+
+
+def _transcribir(ruta, transcriptor, palabras=None):
+    return motor.transcribir_en_paralelo(
+        ruta, "es-ES", 3, transcriptor=transcriptor, max_workers=3,
+        duracion_fragmento=DURACION_FRAGMENTO, solape=SOLAPE, palabras=palabras,
+    )
+
+
+def test_varios_fragmentos_solapados(episodio):
+    ruta, _, _ = episodio
+    energia = motor.energia_por_tramas(ruta)
+    fragmentos = motor.planificar_fragmentos(
+        DURACION, motor.calcular_cortes(energia, duracion_fragmento=DURACION_FRAGMENTO), SOLAPE,
+    )
+    assert len(fragmentos) >= 3
+    for anterior, siguiente in zip(fragmentos, fragmentos[1:]):
+        assert anterior['propio_fin'] == siguiente['propio_inicio']
+        assert anterior['fin'] - SOLAPE == pytest.approx(siguiente['inicio'] + SOLAPE)
+
+
+def test_sin_segmentos_duplicados_ni_perdidos(episodio):
+    ruta, guion, transcriptor = episodio
+    unidos, error = _transcribir(ruta, transcriptor)
+
+    assert error is None
+    assert [s['text'] for s in unidos] == [s['text'] for s, _ in guion]
+    assert [s['offset'] for s in unidos] == pytest.approx([s['offset'] for s, _ in guion], abs=1e-6)
+    assert [s['duration'] for s in unidos] == pytest.approx([s['duration'] for s, _ in guion], abs=1e-6)
+
+
+def test_hablantes_coherentes_entre_fragmentos(episodio):
+    ruta, guion, transcriptor = episodio
+    unidos, _ = _transcribir(ruta, transcriptor)
+
+    # Cada hablante del guion corresponde a un solo hablante unido, y viceversa
+    pares = {(s['speaker'], u['speaker']) for (s, _), u in zip(guion, unidos)}
+    assert len(pares) == len({s['speaker'] for s, _ in guion}) == len({u['speaker'] for u in unidos})
+
+
+def test_palabras_siguen_a_su_segmento(episodio):
+    ruta, guion, transcriptor = episodio
+    palabras = ConstructorPalabras()
+    unidos, _ = _transcribir(ruta, transcriptor, palabras)
+    unidas = palabras.construir()
+
+    assert len(unidas) == sum(len(marcas) for _, marcas in guion)
+    assert np.array_equal(unidas.inicios, np.sort([a for _, marcas in guion for _, a, _ in marcas]))
+    for i in range(len(unidas)):
+        segmento = unidos[unidas.segmentos[i]]
+        assert unidas.nombres_hablante[unidas.hablantes[i]] == segmento['speaker']
+        assert segmento['offset'] * 1000 - 1 <= unidas.inicios[i] <= (segmento['offset'] + segmento['duration']) * 1000
+
+
+def test_fragmentos_esperan_turno_como_su_trabajo(episodio, monkeypatch):
+    ruta, _, transcriptor = episodio
+
+    def simulado(fuente, idioma, max_hablantes, al_segmento, palabras):
+        metricas.contar("fragmento_simulado")  # Debe llegar al registro del trabajo
+        return transcriptor(fuente, idioma, max_hablantes)
+
+    monkeypatch.setattr(motor, "_transcriptor_simulado", simulado)
+    speech = motor.obtener_limitador("speech")
+    turno = speech.turno
+    clientes = []
+
+    def espiar(cliente=None):
+        clientes.append(limitador.cliente_actual() if cliente is None else cliente)
+        return turno(cliente)
+
+    monkeypatch.setattr(speech, "turno", espiar)
+    with metricas.trabajo("42", "transcripcion") as registro:
+        _, error = _transcribir(ruta, None)
+
+    assert error is None
+    assert len(clientes) >= 3 and set(clientes) == {"trabajo-42"}
+    assert registro.como_dict()["contadores"]["fragmento_simulado"] == len(clientes)
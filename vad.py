@@ -0,0 +1,163 @@
+"""Detección de actividad de voz (VAD) vectorizada para no transcribir silencios.
+
+Cada trama de 20 ms se clasifica como voz o no voz a partir de su energía,
+comparada con el ruido de fondo estimado del propio archivo, y de su tasa de
+cruces por cero: el siseo (cruces muy frecuentes) y el zumbido (casi ninguno)
+no cuentan como voz aunque tengan energía. Solo se recortan las pausas de al
+menos MIN_SILENCIO segundos, dejando un margen a cada lado de la voz.
+
+MapaOffsets traduce los tiempos del audio recortado a la línea de tiempo
+original, para que cada `offset`/`duration` devuelto se refiera al audio subido.
+"""
+import os
+
+import numpy as np
+
+DURACION_TRAMA_VAD = 0.02
+MARGEN_DB = 12.0  # La voz queda al menos estos dB por encima del ruido de fondo
+UMBRAL_MINIMO_DB = -60.0  # dBFS; por debajo siempre es silencio
+RANGO_DINAMICO_DB = 35.0  # El umbral nunca queda más de esto por debajo de las tramas más fuertes
+ZCR_MAXIMO = 0.35  # Cruces por muestra: por encima, ruido o siseo
+ZCR_MINIMO = 0.005  # Por debajo, zumbido o tono grave continuo
+MIN_SILENCIO = float(os.getenv("VAD_MIN_SILENCIO", "1.0"))  # Solo se recortan pausas de al menos esta duración
+MARGEN_VOZ = 0.25  # Segundos conservados a cada lado de la voz
+MIN_VOZ = 0.1  # Las ráfagas más cortas (clics, golpes) no cuentan como voz
+TAM_BLOQUE_VAD = 16000 * 30
+
+
+def caracteristicas_tramas(ruta_wav, duracion_trama=DURACION_TRAMA_VAD, tam_bloque=TAM_BLOQUE_VAD):
+    """Energía (dBFS) y tasa de cruces por cero de cada trama de un WAV, leído por bloques"""
+    import soundfile as sf
+    with sf.SoundFile(ruta_wav) as f:
+        muestras_trama = max(int(f.samplerate * duracion_trama), 1)
+        tam_bloque = max(tam_bloque // muestras_trama, 1) * muestras_trama
+        energias, cruces = [], []
+        for bloque in f.blocks(blocksize=tam_bloque, dtype="float32", always_2d=True):
+            mono = bloque.mean(axis=1)
+            n = len(mono) // muestras_trama
+            if not n:
+                continue
+            tramas = mono[:n * muestras_trama].reshape(n, muestras_trama)
+            energias.append(10 * np.log10(np.mean(tramas ** 2, axis=1) + 1e-10))
+            signos = np.signbit(tramas)
+            cruces.append(np.count_nonzero(signos[:, 1:] != signos[:, :-1], axis=1) / muestras_trama)
+    if not energias:
+        return np.zeros(0), np.zeros(0)
+    return np.concatenate(energias), np.concatenate(cruces)
+
+
+def clasificar_tramas(energia_db, zcr):
+    """Máscara booleana de tramas con voz"""
+    if not len(energia_db):
+        return np.zeros(0, dtype=bool)
+    piso = np.percentile(energia_db, 10)
+    alto = np.percentile(energia_db, 98)
+    umbral = min(max(piso + MARGEN_DB, UMBRAL_MINIMO_DB), alto - RANGO_DINAMICO_DB)
+    umbral = max(umbral, UMBRAL_MINIMO_DB)
+    return (energia_db > umbral) & (zcr >= ZCR_MINIMO) & (zcr <= ZCR_MAXIMO)
+
+
+def _rachas(mascara):
+    """Índices (inicios, fines) de las rachas de True; fines exclusivos"""
+    bordes = np.diff(np.concatenate([[False], mascara, [False]]).astype(np.int8))
+    return np.flatnonzero(bordes == 1), np.flatnonzero(bordes == -1)
+
+
+def intervalos_voz(mascara, duracion_trama=DURACION_TRAMA_VAD, duracion_total=None,
+                   min_silencio=MIN_SILENCIO, margen=MARGEN_VOZ, min_voz=MIN_VOZ):
+    """Tramos [(inicio, fin), ...] en segundos que se conservan: voz con margen, pausas cortas incluidas"""
+    duracion_total = len(mascara) * duracion_trama if duracion_total is None else duracion_total
+    inicios, fines = _rachas(mascara)
+    largas = (fines - inicios) * duracion_trama >= min_voz
+    inicios, fines = inicios[largas] * duracion_trama - margen, fines[largas] * duracion_trama + margen
+    if not len(inicios):
+        return []
+    inicios = np.clip(inicios, 0.0, duracion_total)
+    fines = np.clip(fines, 0.0, duracion_total)
+    # Unir los tramos separados por pausas más cortas que min_silencio
+    nuevos = np.concatenate([[True], inicios[1:] - fines[:-1] >= min_silencio])
+    fin_grupo = np.maximum.reduceat(fines, np.flatnonzero(nuevos))
+    return [(float(a), float(b)) for a, b in zip(inicios[nuevos], fin_grupo)]
+
+
+def restar_intervalos(intervalos, excluir):
+    """Tramos de `intervalos` que quedan fuera de todos los de `excluir` (ambos ordenados)"""
+    resultado = []
+    for inicio, fin in intervalos:
+        for a, b in excluir:
+            if b <= inicio or a >= fin:
+                continue
+            if a > inicio:
+                resultado.append((inicio, a))
+            inicio = max(inicio, b)
+            if inicio >= fin:
+                break
+        if inicio < fin:
+            resultado.append((inicio, fin))
+    return resultado
+
+
+def informe_recorte(intervalos, duracion_total):
+    """Cuánto audio se recorta con estos tramos conservados"""
+    voz = sum(fin - inicio for inicio, fin in intervalos)
+    return {
+        'duracion_original': duracion_total,
+        'duracion_voz': voz,
+        'segundos_recortados': duracion_total - voz,
+        'porcentaje_recortado': 100 * (duracion_total - voz) / duracion_total if duracion_total else 0.0,
+        'tramos_voz': len(intervalos),
+    }
+
+
+def detectar_voz(ruta_wav):
+    """(intervalos conservados, informe) de un WAV"""
+    import soundfile as sf
+    duracion_total = sf.info(ruta_wav).duration
+    energia_db, zcr = caracteristicas_tramas(ruta_wav)
+    intervalos = intervalos_voz(clasificar_tramas(energia_db, zcr), DURACION_TRAMA_VAD, duracion_total)
+    return intervalos, informe_recorte(intervalos, duracion_total)
+
+
+def escribir_recorte(ruta_wav, intervalos, destino, tam_bloque=TAM_BLOQUE_VAD):
+    """Escribe en `destino` solo los tramos conservados del WAV, uno tras otro"""
+    import soundfile as sf
+    with sf.SoundFile(ruta_wav) as entrada, sf.SoundFile(
+        destino, "w", samplerate=entrada.samplerate, channels=entrada.channels, format="WAV", subtype="PCM_16"
+    ) as salida:
+        for inicio, fin in intervalos:
+            entrada.seek(int(inicio * entrada.samplerate))
+            restantes = int(fin * entrada.samplerate) - int(inicio * entrada.samplerate)
+            while restantes > 0:
+                bloque = entrada.read(min(restantes, tam_bloque), dtype="int16")
+                if not len(bloque):
+                    break
+                salida.write(bloque)
+                restantes -= len(bloque)
+
+
+class MapaOffsets:
+    """Correspondencia entre la línea de tiempo del audio recortado y la del original"""
+
+    def __init__(self, intervalos, sr=16000):
+        # Redondear a muestras como escribir_recorte, para que los tiempos casen exactamente
+        muestras = np.array([(int(a * sr), int(b * sr)) for a, b in intervalos], dtype=np.int64).reshape(-1, 2)
+        self.origen = muestras[:, 0] / sr
+        longitudes = (muestras[:, 1] - muestras[:, 0]) / sr
+        self.recortado = np.concatenate([[0.0], np.cumsum(longitudes)[:-1]])
+        self.duracion_recortada = float(longitudes.sum())
+
+    def a_original(self, t, final=False):
+        """Tiempo(s) del audio recortado en el original; `final` asigna los límites al tramo anterior"""
+        t = np.asarray(t, dtype=np.float64)
+        i = np.clip(np.searchsorted(self.recortado, t, side="left" if final else "right") - 1, 0, None)
+        return self.origen[i] + (t - self.recortado[i])
+
+    def segmento(self, segmento):
+        """Copia del segmento con offset y duración en la línea de tiempo original"""
+        inicio = float(self.a_original(segmento['offset']))
+        fin = float(self.a_original(segmento['offset'] + segmento['duration'], final=True))
+        return {**segmento, 'offset': inicio, 'duration': max(fin - inicio, 0.0)}
+
+    def milisegundos(self, ms, final=False):
+        """Versión vectorizada en milisegundos enteros (marcas de tiempo por palabra)"""
+        return np.round(self.a_original(np.asarray(ms) / 1000, final) * 1000).astype(np.int64)
@@ -1,154 +1,206 @@
 import streamlit as st
-import requests, os
+import requests, os, json, uuid
 
-SPEECH_KEY = os.getenv("SPEECH_KEY") or st.secrets.get("SPEECH_KEY")
-REGION = os.getenv("SPEECH_REGION") or st.secrets.get("SPEECH_REGION")
-TRANSLATOR_KEY = os.getenv("TRANSLATOR_KEY") or st.secrets.get("TRANSLATOR_KEY")
-TRANSLATOR_REGION = os.getenv("TRANSLATOR_REGION") or st.secrets.get("TRANSLATOR_REGION")
+from biblioteca import obtener_biblioteca
+from limitador import fijar_cliente
+from doblaje import doblar_transcripcion, traducir, traducir_transcripcion, voces_por_hablante
+from reconocimiento import ErrorReconocimiento, transcribir_rest
+from sintesis import ErrorSintesis, listar_voces, sintetizar_por_bloques
+from simulado import obtener_servidor
 
-if not SPEECH_KEY or not REGION:
-    st.error("❌ No se encontraron las variables de entorno SPEECH_KEY o SPEECH_REGION.")
-    st.stop()
+# BACKEND=local atiende STT, TTS y Translator con el servidor simulado (simulado.py): no hacen falta claves
+BACKEND = os.getenv("BACKEND", "azure")
 
+if BACKEND == "local":
+    SPEECH_KEY = REGION = TRANSLATOR_KEY = TRANSLATOR_REGION = "local"
+    STT_ENDPOINT = TTS_ENDPOINT = TRANSLATOR_ENDPOINT = obtener_servidor().url
+else:
+    SPEECH_KEY = os.getenv("SPEECH_KEY") or st.secrets.get("SPEECH_KEY")
+    REGION = os.getenv("SPEECH_REGION") or st.secrets.get("SPEECH_REGION")
+    TRANSLATOR_KEY = os.getenv("TRANSLATOR_KEY") or st.secrets.get("TRANSLATOR_KEY")
+    TRANSLATOR_REGION = os.getenv("TRANSLATOR_REGION") or st.secrets.get("TRANSLATOR_REGION")
 
-# Obtener las variables desde variables de entorno o secrets como fallback
-SPEECH_KEY = os.getenv("SPEECH_KEY") or st.secrets.get("SPEECH_KEY")
-REGION = os.getenv("REGION") or st.secrets.get("REGION")
-TRANSLATOR_KEY = os.getenv("TRANSLATOR_KEY") or st.secrets.get("TRANSLATOR_KEY")
-TRANSLATOR_REGION = os.getenv("TRANSLATOR_REGION") or st.secrets.get("TRANSLATOR_REGION")
+    if not SPEECH_KEY or not REGION:
+        st.error("❌ No se encontraron las variables de entorno SPEECH_KEY o SPEECH_REGION.")
+        st.stop()
+
+
+    # Obtener las variables desde variables de entorno o secrets como fallback
+    SPEECH_KEY = os.getenv("SPEECH_KEY") or st.secrets.get("SPEECH_KEY")
+    REGION = os.getenv("REGION") or st.secrets.get("REGION")
+    TRANSLATOR_KEY = os.getenv("TRANSLATOR_KEY") or st.secrets.get("TRANSLATOR_KEY")
+    TRANSLATOR_REGION = os.getenv("TRANSLATOR_REGION") or st.secrets.get("TRANSLATOR_REGION")
+
+    STT_ENDPOINT = f"https://{REGION}.stt.speech.microsoft.com"
+    TTS_ENDPOINT = f"https://{REGION}.tts.speech.microsoft.com"
+    TRANSLATOR_ENDPOINT = "https://api.cognitive.microsofttranslator.com"
+
+# Las peticiones de esta sesión se turnan con las de las demás en los limitadores compartidos
+fijar_cliente(st.session_state.setdefault("cliente_azure", f"sesion-{uuid.uuid4().hex[:8]}"))
 
 st.title("🎤 Audio con Azure Speech")
 
 
+def reproducir_por_bloques(texto, voz, al_progreso=None, autoplay=True):
+    """Muestra un reproductor por bloque de frases en cuanto está sintetizado y devuelve el audio completo.
+
+    Con `autoplay`, el primer bloque (la primera frase) empieza a sonar sin esperar al resto del texto.
+    """
+    partes = []
+    for audio, hechas, total in sintetizar_por_bloques(texto, voz, TTS_ENDPOINT, SPEECH_KEY):
+        st.audio(audio, format="audio/mp3", autoplay=autoplay and not partes)
+        partes.append(audio)
+        if al_progreso is not None:
+            al_progreso(hechas, total)
+    return b"".join(partes)
+
+
 tab1, tab2,tab3 = st.tabs(["Transcripción", " Texto a Voz","Texto ingles a voz en español"])
 with tab1:
-    audio_file = st.file_uploader("Sube un archivo de audio:", type=["wav"], help="El archivo debe estar en formato WAV, 16kHz, mono")
+    audio_file = st.file_uploader("Sube un archivo de audio:", type=["wav"], help="WAV de cualquier duración; si no es 16kHz mono se convierte antes de transcribir")
     if audio_file is not None:
         st.audio(audio_file, format="audio/wav")
-        with st.spinner("Transcribiendo audio..."):
-            speech_to_text_url = f"https://{REGION}.stt.speech.microsoft.com/speech/recognition/conversation/cognitiveservices/v1?language=es-ES"
-            headers = {
-                "Ocp-Apim-Subscription-Key": SPEECH_KEY,
-                "Content-Type": "audio/wav; codecs=audio/pcm; samplerate=16000"
-            }
-            audio_data = audio_file.read()
-            response = requests.post(speech_to_text_url, headers=headers, data=audio_data)
-            if response.status_code == 200:
-                result = response.json()
-                if "DisplayText" in result:
-                    st.markdown("### Texto transcrito:")
-                    st.write(result["DisplayText"])
-                else:
-                    st.error("No se pudo transcribir el audio.")
+        # Guardar el resultado por archivo: los reruns de las otras pestañas no vuelven a transcribir
+        transcripciones = st.session_state.setdefault("transcripciones_rest", {})
+        if audio_file.file_id not in transcripciones:
+            progreso = st.progress(0.0, text="Transcribiendo audio...")
+            try:
+                # Se sube por trozos desde el archivo; los audios largos se cortan en silencios y se envían a la vez
+                transcripciones[audio_file.file_id] = transcribir_rest(
+                    audio_file, STT_ENDPOINT, SPEECH_KEY, "es-ES",
+                    al_progreso=lambda hechos, total: progreso.progress(
+                        hechos / total, text=f"Transcribiendo audio... {hechos}/{total} tramos"))
+            except ErrorReconocimiento as e:
+                st.error(str(e))
+            except requests.exceptions.RequestException as e:
+                st.error(f"Error en la transcripción: {e}")
+            progreso.empty()
+        result = transcripciones.get(audio_file.file_id)
+        if result is not None:
+            if result["DisplayText"]:
+                st.markdown("### Texto transcrito:")
+                st.write(result["DisplayText"])
+                if len(result["tramos"]) > 1:
+                    with st.expander(f"Tramos ({len(result['tramos'])})"):
+                        for tramo in result["tramos"]:
+                            minutos, segundos = divmod(int(tramo["offset"]), 60)
+                            st.markdown(f"`{minutos:02d}:{segundos:02d}` {tramo['text']}")
             else:
-                st.error(f"Error en la transcripción: {response.status_code} - {response.text}")
+                st.error("No se pudo transcribir el audio.")
 with tab2:
     st.markdown("### Convertir Texto a Voz")
-    texto_voz = st.text_input("Introduce el texto que quieres convertir a voz:")
+    texto_voz = st.text_area("Introduce el texto que quieres convertir a voz:")
     
     @st.cache_data(ttl=600)
     def get_available_voices():
-        available_voices = []
+        # Por la sesión HTTP compartida y el limitador de TTS, como la síntesis
         try:
-            voices_url = f"https://{REGION}.tts.speech.microsoft.com/cognitiveservices/voices/list"
-            rv = requests.get(voices_url, headers={"Ocp-Apim-Subscription-Key": SPEECH_KEY}, timeout=5)
-            if rv.status_code == 200:
-                voices_json = rv.json()
-                for v in voices_json:
-                    locale = v.get("Locale") or v.get("locale") or v.get("LocaleName")
-                    short = v.get("ShortName") or v.get("Name") or v.get("shortName")
-                    if locale and short and str(locale).lower().startswith("es"):
-                        available_voices.append(short)
+            available_voices = listar_voces(TTS_ENDPOINT, SPEECH_KEY)
         except Exception:
-            pass
+            available_voices = []
         if not available_voices:
             available_voices = ["es-ES-ElviraNeural"]
         return available_voices
 
     if texto_voz:  
-        tts_url = f"https://{REGION}.tts.speech.microsoft.com/cognitiveservices/v1"
         available_voices = get_available_voices()
 
         voice = st.selectbox("Selecciona la voz:", available_voices, index=0)
         
         
         if st.button("🔊 Generar Audio"):
-
-            ssml = f"""<speak version='1.0' xml:lang='es-ES'>
-            <voice xml:lang='es-ES' name='{voice}'>
-                {texto_voz}
-            </voice>
-            </speak>"""
-        
-            headers = {
-                "Ocp-Apim-Subscription-Key": SPEECH_KEY,
-                "Content-Type": "application/ssml+xml",
-                "X-Microsoft-OutputFormat": "audio-16khz-128kbitrate-mono-mp3",
-                "User-Agent": "curso-ia-speech-ejemplo"
-            }
-
-            with st.spinner("Generando audio..."):
-                try:
-                    tts_resp = requests.post(tts_url, headers=headers, data=ssml.encode("utf-8"))
-                    
-                    if tts_resp.status_code == 200:
-                        st.audio(tts_resp.content, format="audio/mp3")
-                        st.success("¡Audio generado con éxito!")
-                    else:
-                        st.error(f"Error al generar el audio: {tts_resp.status_code}")
-                        # Mostrar texto de error y sugerir voces disponibles
-                        try:
-                            st.write(tts_resp.json())
-                        except Exception:
-                            st.write(tts_resp.text)
-                        st.info("Voces disponibles (filtradas por 'es-'): ")
-                        st.write(available_voices)
-                except Exception as e:
-                    st.error(f"Error inesperado: {str(e)}")
+            # Cada frase se sintetiza en paralelo y se guarda en caché: repetir texto y voz no llama al servicio.
+            # La primera frase suena en cuanto está lista; el resto llega en bloques cada vez más largos
+            progreso = st.progress(0.0, text="Generando audio...")
+            try:
+                audio = reproducir_por_bloques(texto_voz, voice,
+                                               al_progreso=lambda hechas, total: progreso.progress(
+                                                   hechas / total, text=f"Generando audio... {hechas}/{total} frases"))
+                progreso.empty()
+                st.download_button("💾 Descargar audio completo", audio, file_name="audio.mp3", mime="audio/mpeg")
+                st.success("¡Audio generado con éxito!")
+            except ErrorSintesis as e:
+                progreso.empty()
+                st.error(str(e))
+                # Mostrar texto de error y sugerir voces disponibles
+                if e.respuesta is not None:
+                    try:
+                        st.write(e.respuesta.json())
+                    except Exception:
+                        st.write(e.respuesta.text)
+                st.info("Voces disponibles (filtradas por 'es-'): ")
+                st.write(available_voices)
+            except Exception as e:
+                progreso.empty()
+                st.error(f"Error inesperado: {str(e)}")
 with tab3:
     st.markdown("### Convertir Texto en Inglés a Voz en Español")
-    texto_ingles = st.text_input("Introduce el texto en inglés que quieres convertir a voz en español:")
-    
-    if texto_ingles:  
-        # Traducir el texto al español usando Translator
-        translate_url = f"https://api.cognitive.microsofttranslator.com/translate?api-version=3.0&to=es"
-        headers_translate = {
-            "Ocp-Apim-Subscription-Key": TRANSLATOR_KEY,
-            "Ocp-Apim-Subscription-Region": TRANSLATOR_REGION,
-            "Content-Type": "application/json"
-        }
-        body_translate = [{"text": texto_ingles}]
-        
-        try:
-            translate_resp = requests.post(translate_url, headers=headers_translate, json=body_translate)
-            translate_resp.raise_for_status()
-            translated_text = translate_resp.json()[0]["translations"][0]["text"]
-                        
-            tts_url = f"https://{REGION}.tts.speech.microsoft.com/cognitiveservices/v1"
-            voice = "es-ES-ElviraNeural" 
-            
-            ssml = f"""<speak version='1.0' xml:lang='es-ES'>
-                <voice xml:lang='es-ES' name='{voice}'>
-                    {translated_text}
-                </voice>
-            </speak>"""
-            
-            headers_tts = {
-                "Ocp-Apim-Subscription-Key": SPEECH_KEY,
-                "Content-Type": "application/ssml+xml",
-                "X-Microsoft-OutputFormat": "audio-16khz-128kbitrate-mono-mp3",
-                "User-Agent": "curso-ia-speech-ejemplo"
-            }
-            
-            with st.spinner("Generando audio..."):
-                tts_resp = requests.post(tts_url, headers=headers_tts, data=ssml.encode("utf-8"))
-                    
-                if tts_resp.status_code == 200:
-                    st.audio(tts_resp.content, format="audio/mp3")
-                    st.success("¡Audio generado con éxito!")
-                else:
-                    st.error(f"Error al generar el audio: {tts_resp.status_code}")
-                    st.write(tts_resp.text)
-        except requests.exceptions.RequestException as e:
-            st.error(f"Error al traducir el texto: {e}")
+    modo_doblaje = st.radio("¿Qué quieres convertir?", ["Texto", "Transcripción completa"], horizontal=True)
+
+    if modo_doblaje == "Texto":
+        texto_ingles = st.text_input("Introduce el texto en inglés que quieres convertir a voz en español:")
+
+        if texto_ingles:  
+            # La traducción se memoriza y el audio sale de la caché: los reruns no vuelven a llamar a Azure
+            try:
+                translated_text = traducir([texto_ingles], TRANSLATOR_ENDPOINT, TRANSLATOR_KEY, TRANSLATOR_REGION)[0]
+
+                voice = "es-ES-ElviraNeural" 
 
+                with st.spinner("Generando audio..."):
+                    try:
+                        # Se vuelve a mostrar en cada rerun (desde la caché): sin autoplay
+                        reproducir_por_bloques(translated_text, voice, autoplay=False)
+                        st.success("¡Audio generado con éxito!")
+                    except ErrorSintesis as e:
+                        st.error(str(e))
+                        if e.respuesta is not None:
+                            st.write(e.respuesta.text)
+            except requests.exceptions.RequestException as e:
+                st.error(f"Error al traducir el texto: {e}")
+    else:
+        # Transcripción diarizada: un episodio de la biblioteca o un JSON exportado desde main.py
+        episodios = {f"{ep['nombre']} ({ep['segmentos']} segmentos)": ep['clave']
+                     for ep in obtener_biblioteca().episodios()}
+        origen = st.selectbox("Episodio de la biblioteca:", ["— Subir JSON —", *episodios])
+        segmentos = None
+        if origen in episodios:
+            segmentos = obtener_biblioteca().segmentos(episodios[origen])
+        else:
+            archivo_json = st.file_uploader("Transcripción exportada en JSON:", type=["json"])
+            if archivo_json is not None:
+                try:
+                    segmentos = json.load(archivo_json)
+                except ValueError:
+                    st.error("El archivo no es un JSON de transcripción válido.")
+
+        if segmentos:
+            hablantes = sorted({seg['speaker'] for seg in segmentos})
+            voces_es = get_available_voices()
+            st.caption(f"{len(segmentos)} segmentos, {len(hablantes)} hablantes")
+            voces = voces_por_hablante(segmentos, voces_es)
+            columnas = st.columns(min(len(hablantes), 4))
+            for i, hablante in enumerate(hablantes):
+                voces[hablante] = columnas[i % len(columnas)].selectbox(
+                    f"Voz de {hablante}:", voces_es, index=voces_es.index(voces[hablante]), key=f"voz_{hablante}")
+
+            if st.button("🎬 Traducir y doblar"):
+                progreso = st.progress(0.0, text="Traduciendo...")
+                try:
+                    traducidos = traducir_transcripcion(segmentos, TRANSLATOR_ENDPOINT, TRANSLATOR_KEY,
+                                                        TRANSLATOR_REGION)
+                    pista = doblar_transcripcion(
+                        traducidos, TTS_ENDPOINT, SPEECH_KEY, voces=voces,
+                        al_progreso=lambda hechos, total: progreso.progress(
+                            hechos / total, text=f"Doblando... {hechos}/{total} segmentos"))
+                    progreso.empty()
+                    st.audio(pista, format="audio/wav")
+                    st.download_button("💾 Descargar pista doblada", pista, file_name="doblaje.wav",
+                                       mime="audio/wav")
+                    st.success("¡Transcripción doblada con éxito!")
+                except requests.exceptions.RequestException as e:
+                    progreso.empty()
+                    st.error(f"Error al traducir la transcripción: {e}")
+                except ErrorSintesis as e:
+                    progreso.empty()
+                    st.error(str(e))